@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
+import json
 import logging
+import os
 import subprocess
 import re
 
@@ -17,6 +19,8 @@ from ops.main import main
 from interface_mssql_cluster import MssqlCluster
 from interface_hacluster import HaCluster
 from interface_mssql_provider import MssqlDBProvider
+import mssql_db_client
+import mssql_stats
 from utils import retry_on_error
 
 logger = logging.getLogger(__name__)
@@ -47,6 +51,11 @@ class MSSQLCharm(CharmBase):
     def __init__(self, *args):
         super().__init__(*args)
         self.state.set_default(initialized=False)
+        mssql_stats.configure(
+            slow_query_threshold=self.model.config.get(
+                'slow-query-threshold'))
+        mssql_db_client.configure(
+            hook_time_budget=self.model.config.get('hook-time-budget'))
         self.cluster = MssqlCluster(self, 'cluster')
         self.ha = HaCluster(self, 'ha')
         self.db_provider = MssqlDBProvider(self, 'db')
@@ -62,6 +71,15 @@ class MSSQLCharm(CharmBase):
         self.framework.observe(
             self.on.get_sa_password_action,
             self.on_get_sa_password_action)
+        self.framework.observe(
+            self.on.get_sql_stats_action,
+            self.on_get_sql_stats_action)
+        self.framework.observe(
+            self.on.get_seeding_progress_action,
+            self.on_get_seeding_progress_action)
+        self.framework.observe(
+            self.framework.on.commit,
+            self.on_commit)
 
     @retry_on_error()
     def on_install(self, _):
@@ -98,6 +116,24 @@ class MSSQLCharm(CharmBase):
     def on_get_sa_password_action(self, event):
         event.set_results({'sa-password': self.cluster.sa_password})
 
+    def on_get_sql_stats_action(self, event):
+        event.set_results({'summary': json.dumps(mssql_stats.summary())})
+
+    def on_get_seeding_progress_action(self, event):
+        if not self.cluster.state.ag_configured:
+            event.fail('The unit is not an availability group replica yet.')
+            return
+        progress = self.cluster.mssql_db_client().get_seeding_progress(
+            self.cluster.AG_NAME)
+        event.set_results({'progress': json.dumps(progress)})
+
+    def on_commit(self, _):
+        # The pooled SQL Server connections are reused by all the handlers
+        # run during the current dispatch. Close them once we are done.
+        mssql_db_client.close_connections()
+        mssql_stats.flush(os.environ.get('JUJU_HOOK_NAME') or
+                          os.environ.get('JUJU_ACTION_NAME') or 'unknown')
+
     def _is_product_key(self, key):
         regex = re.compile(r"^([A-Z]|[0-9]){5}(-([A-Z]|[0-9]){5}){4}$")
         if regex.match(key.upper()):
@@ -2,11 +2,16 @@
 Implementation of the MSSQL charm cluster interface used with a peer relation.
 """
 
+import collections
+import hashlib
+import json
 import logging
 import secrets
 import string
 import math
+import time
 import uuid
+import zlib
 
 from base64 import b64encode, b64decode
 from socket import gethostname as get_unit_hostname
@@ -17,11 +22,11 @@ from ops.framework import (
     EventSource,
     Object,
     StoredState)
-from ops.model import ActiveStatus
+from ops.model import ActiveStatus, WaitingStatus
 from charmhelpers.core import host
 
 from mssql_db_client import MSSQLDatabaseClient
-from utils import append_hosts_entry
+from utils import HostsManager, run_concurrently
 
 logger = logging.getLogger(__name__)
 
@@ -50,25 +55,74 @@ class MssqlCluster(Object):
     state = StoredState()
     AG_NAME = 'juju-ag'
     UNIT_ACTIVE_STATUS = ActiveStatus('Unit is ready')
+    TOPOLOGY_CONNECT_TIMEOUT = 30
+    # SQL logins which are never synced from the primary replica. Besides
+    # these, the certificate based logins (named '##<name>##') are skipped.
+    SYNC_EXCLUDED_LOGINS = ['sa', 'MSSQLPacemaker']
+    # The ALLOW_CONNECTIONS value of the secondary replicas, for every
+    # readable-secondaries config option value.
+    READABLE_SECONDARIES_MODES = {
+        'no': 'NO',
+        'read-intent-only': 'READ_ONLY',
+        'all': 'ALL',
+    }
+    # The SEEDING_MODE of the replicas, for every seeding-mode config option
+    # value.
+    SEEDING_MODES = {
+        'automatic': 'AUTOMATIC',
+        'automatic-compressed': 'AUTOMATIC',
+        'manual': 'MANUAL',
+    }
 
     def __init__(self, charm, relation_name):
         super().__init__(charm, relation_name)
         self.state.set_default(
             initialized_nodes={},
             master_cert_configured=False,
-            ag_configured=False)
+            ag_configured=False,
+            applied_logins={},
+            applied_logins_version=None,
+            db_mirroring_endpoint_configured=False,
+            cluster_node_fingerprint=None,
+            unit_nodes={},
+            read_routing=None,
+            availability_modes=None,
+            seeding_mode=None,
+            seeding_compression=False,
+            contained_database_authentication=False,
+            replication_health=None,
+            replication_health_time=0)
         self.relation_name = relation_name
         self.app = self.model.app
         self.unit = self.model.unit
+        # The AG topology is fetched at most once per dispatch, and it is
+        # invalidated whenever the charm changes the AG.
+        self._ag_topology = None
+        self._ag_topology_fetched = False
+        # The hosts entries of the nodes are written once, at the end of the
+        # dispatch, or before connecting to the other nodes.
+        self.hosts = HostsManager()
         self.framework.observe(
             charm.on[relation_name].relation_joined,
             self.on_joined)
         self.framework.observe(
             charm.on[relation_name].relation_changed,
             self.on_changed)
+        self.framework.observe(
+            charm.on[relation_name].relation_departed,
+            self.on_departed)
         self.framework.observe(
             self.on.initialized_unit,
             self.on_initialized_unit)
+        self.framework.observe(
+            charm.on.config_changed,
+            self.on_config_changed)
+        self.framework.observe(
+            charm.on.update_status,
+            self.on_update_status)
+        self.framework.observe(
+            self.framework.on.commit,
+            self.on_commit)
 
     def on_joined(self, _):
         if self.node_name in self.state.initialized_nodes.keys():
@@ -82,6 +136,8 @@ class MssqlCluster(Object):
         rel_data = event.relation.data.get(event.unit)
         if rel_data:
             if rel_data.get('node_name') and rel_data.get('node_address'):
+                self.state.unit_nodes[event.unit.name] = \
+                    rel_data.get('node_name')
                 self.add_to_initialized_nodes(
                     rel_data.get('node_name'),
                     rel_data.get('node_address'),
@@ -103,6 +159,92 @@ class MssqlCluster(Object):
         if self.master_cert:
             self.configure_cluster_node()
 
+    def on_departed(self, event):
+        node_name = self.state.unit_nodes.pop(event.unit.name, None)
+        if not node_name:
+            return
+        logger.info("Node %s departed the cluster.", node_name)
+        self.state.initialized_nodes.pop(node_name, None)
+        self.hosts.remove_entry([node_name])
+
+    def on_config_changed(self, _):
+        if self.state.ag_configured:
+            self.configure_contained_database_authentication()
+            self.configure_seeding()
+            self.configure_availability_modes()
+            self.configure_read_routing()
+
+    def on_update_status(self, _):
+        if not self.state.ag_configured:
+            return
+        health = self.replication_health()
+        if health is None:
+            return
+        self.unit.status = self.replication_status(health)
+
+    def replication_health(self):
+        """Returns the replication health of the AG replicas.
+
+        The health is queried from the local SQL Server, with a single
+        connection, at most once every replication-health-interval seconds.
+        Meanwhile, the last result is returned from the unit state.
+
+        :returns: dict with the health of every replica, as returned by
+                  MSSQLDatabaseClient.get_replication_health(), or None if
+                  it cannot be queried.
+        """
+        interval = self.model.config.get('replication-health-interval') or 0
+        elapsed = time.time() - self.state.replication_health_time
+        if self.state.replication_health and elapsed < interval:
+            return json.loads(self.state.replication_health)
+        try:
+            health = self.mssql_db_client(
+                connect_timeout=self.TOPOLOGY_CONNECT_TIMEOUT
+            ).get_replication_health(self.AG_NAME)
+        except Exception as ex:
+            logger.warning("Cannot query the replication health: %s", ex)
+            return None
+        self.state.replication_health = json.dumps(health)
+        self.state.replication_health_time = time.time()
+        return health
+
+    def replication_status(self, health):
+        """Returns the unit status for the given replication health.
+
+        The primary replica reports the lag of all the secondary replicas,
+        while a secondary replica reports only its own lag.
+        """
+        log_send_queue_threshold = self.model.config.get(
+            'log-send-queue-threshold') or 0
+        redo_queue_threshold = self.model.config.get(
+            'redo-queue-threshold') or 0
+        unhealthy = []
+        lagging = []
+        for node_name, replica in sorted(health.items()):
+            if replica['synchronization_health'] != 'HEALTHY':
+                unhealthy.append(node_name)
+                continue
+            if replica['role'] == 'PRIMARY':
+                continue
+            log_send_queue = replica['log_send_queue_kb']
+            redo_queue = replica['redo_queue_kb']
+            if (0 < log_send_queue_threshold <= log_send_queue or
+                    0 < redo_queue_threshold <= redo_queue):
+                lagging.append(
+                    '{} (log send queue {} KB, redo queue {} KB)'.format(
+                        node_name, log_send_queue, redo_queue))
+        if unhealthy:
+            return WaitingStatus('Replicas not healthy: {}'.format(
+                ', '.join(unhealthy)))
+        if lagging:
+            return ActiveStatus('{}. Replicas lagging: {}'.format(
+                self.UNIT_ACTIVE_STATUS.message, ', '.join(lagging)))
+        return self.UNIT_ACTIVE_STATUS
+
+    def on_commit(self, _):
+        self.invalidate_ag_topology()
+        self.hosts.flush()
+
     def configure_master_cert(self):
         if self.node_name not in self.state.initialized_nodes.keys():
             logger.warning("Current unit is not initialized yet. Skipping "
@@ -122,14 +264,53 @@ class MssqlCluster(Object):
         self.state.master_cert_configured = True
 
     def configure_cluster_node(self):
+        # Skip the reconciliation if none of its inputs changed since the
+        # last time it ran successfully. The fingerprint is saved after the
+        # reconciliation, so it includes the changes done by the unit itself.
+        if self.cluster_node_fingerprint() == \
+                self.state.cluster_node_fingerprint:
+            logger.info("The cluster node inputs didn't change. Skipping "
+                        "the cluster node configuration.")
+            return
         self.configure_master_cert()
-        self.mssql_db_client().setup_db_mirroring_endpoint()
+        self.configure_db_mirroring_endpoint()
         self.state.initialized_nodes[self.node_name]['ready_to_cluster'] = True
         self.relation.data[self.unit]['ready_to_cluster'] = 'true'
         if self.is_primary_replica:
             self.configure_primary_replica()
         else:
             self.configure_secondary_replica()
+        self.state.cluster_node_fingerprint = self.cluster_node_fingerprint()
+
+    def cluster_node_fingerprint(self):
+        """Returns a digest of the inputs of the cluster node configuration.
+
+        These are the peer units and application relation data (the ready
+        and clustered nodes, the master cert, the AG readiness, the replica
+        changes signaled via nonces and the SQL logins manifest), the known
+        nodes and the unit leadership.
+        """
+        rel = self.relation
+        peers_rel_data = {}
+        for unit in rel.units:
+            peers_rel_data[unit.name] = dict(rel.data[unit])
+        initialized_nodes = {}
+        for node_name, node_info in self.state.initialized_nodes.items():
+            initialized_nodes[node_name] = dict(node_info)
+        inputs = json.dumps({
+            'peers': peers_rel_data,
+            'app': dict(rel.data[self.app]),
+            'initialized_nodes': initialized_nodes,
+            'is_leader': self.unit.is_leader(),
+        }, sort_keys=True)
+        return hashlib.sha256(inputs.encode()).hexdigest()
+
+    def configure_db_mirroring_endpoint(self):
+        if self.state.db_mirroring_endpoint_configured:
+            logger.info("The DB mirroring endpoint is already configured.")
+            return
+        self.mssql_db_client().setup_db_mirroring_endpoint()
+        self.state.db_mirroring_endpoint_configured = True
 
     def configure_primary_replica(self):
         if not self.is_ag_ready:
@@ -144,35 +325,198 @@ class MssqlCluster(Object):
         for node in new_nodes:
             new_ready_nodes.update({
                 node: ready_nodes[node]})
-        self.mssql_db_client().add_replicas(self.AG_NAME, new_ready_nodes)
+        availability_modes = self.replica_availability_modes(
+            set(replicas) | new_nodes)
+        self.mssql_db_client().add_replicas(
+            self.AG_NAME, new_ready_nodes, availability_modes,
+            self.replica_seeding_mode)
+        self.invalidate_ag_topology()
         self.set_unit_rel_nonce()
+        self.publish_logins_manifest()
+        self.configure_availability_modes()
+        self.configure_read_routing()
+
+    def replica_availability_modes(self, node_names):
+        """Returns the availability mode of the given AG nodes.
+
+        The primary replica (the current node) and the next
+        synchronous-replicas - 1 nodes, sorted by name, use synchronous
+        commit. The other nodes use asynchronous commit. All the nodes use
+        synchronous commit, if synchronous-replicas is not positive.
+        """
+        sync_replicas = self.model.config.get('synchronous-replicas') or 0
+        other_nodes = sorted(n for n in node_names if n != self.node_name)
+        availability_modes = {}
+        for i, node_name in enumerate([self.node_name] + other_nodes):
+            if sync_replicas <= 0 or i < sync_replicas:
+                availability_modes[node_name] = 'SYNCHRONOUS_COMMIT'
+            else:
+                availability_modes[node_name] = 'ASYNCHRONOUS_COMMIT'
+        return availability_modes
+
+    def configure_availability_modes(self):
+        """Sets the availability mode of the existing AG replicas.
+
+        This is done on the primary replica, whenever the synchronous
+        replicas policy or the AG replicas change.
+        """
+        sync_replicas = self.model.config.get('synchronous-replicas') or 0
+        if sync_replicas <= 0 and not self.state.availability_modes:
+            # All the replicas use synchronous commit by default.
+            return
+        if not self.is_primary_replica:
+            return
+        availability_modes = self.replica_availability_modes(
+            self.ag_replicas)
+        serialized_modes = json.dumps(availability_modes, sort_keys=True)
+        if serialized_modes == self.state.availability_modes:
+            return
+        self.mssql_db_client().set_availability_modes(
+            self.AG_NAME, availability_modes)
+        self.state.availability_modes = serialized_modes
+
+    def configure_read_routing(self):
+        """Configures the readable secondaries and the read-only routing.
+
+        This is done on the primary replica, whenever the readable
+        secondaries mode or the AG replicas change.
+        """
+        mode = self.readable_secondaries
+        if not mode:
+            return
+        if mode == 'no' and not self.state.read_routing:
+            # The replicas are not readable by default.
+            return
+        if not self.is_primary_replica:
+            return
+        read_routing = json.dumps({
+            'mode': mode,
+            'replicas': sorted(self.ag_replicas),
+        }, sort_keys=True)
+        if read_routing == self.state.read_routing:
+            return
+        self.mssql_db_client().configure_read_routing(
+            self.AG_NAME, self.READABLE_SECONDARIES_MODES[mode])
+        self.state.read_routing = read_routing
 
     def configure_secondary_replica(self):
         primary_replica = self.ag_primary_replica
         if not self.is_ag_ready or not primary_replica:
             return
-        replicas = self.mssql_db_client(primary_replica).get_ag_replicas(
-            self.AG_NAME)
-        if self.node_name in replicas:
+        if self.node_name in self.ag_replicas:
             self.join_existing_ag()
             self.sync_logins_from_primary_replica()
+            self.seed_databases()
+
+    def seed_databases(self):
+        """Manually seeds the AG databases, if manual seeding is used."""
+        manual_seeding_dir = self.manual_seeding_dir
+        if not manual_seeding_dir:
+            return
+        seeded = self.mssql_db_client().seed_databases(
+            self.AG_NAME, manual_seeding_dir)
+        if seeded:
+            logger.info("Seeded databases: %s", ", ".join(seeded))
+
+    def configure_contained_database_authentication(self):
+        """Configures the contained database authentication.
+
+        It's a server option, which is set on every replica, so the users of
+        the contained databases can log in to whichever replica acts as
+        primary.
+        """
+        enabled = self.contained_databases
+        if enabled == self.state.contained_database_authentication:
+            return
+        self.mssql_db_client().set_contained_database_authentication(enabled)
+        self.state.contained_database_authentication = enabled
+
+    def configure_seeding(self):
+        """Configures the seeding of the AG databases.
+
+        The automatic seeding compression (trace flag 9567) is set on every
+        replica, since it's used by whichever replica acts as primary. The
+        primary replica also sets the seeding mode of all the replicas.
+        """
+        mode = self.seeding_mode
+        if not mode:
+            return
+        compression = mode == 'automatic-compressed'
+        if compression or self.state.seeding_compression:
+            # The trace flag doesn't persist across SQL Server restarts, so
+            # it's set again whenever the config is changed.
+            self.mssql_db_client().set_seeding_compression(compression)
+            self.state.seeding_compression = compression
+        replica_seeding_mode = self.SEEDING_MODES[mode]
+        if replica_seeding_mode == (self.state.seeding_mode or 'AUTOMATIC'):
+            return
+        if not self.is_primary_replica:
+            return
+        self.mssql_db_client().set_seeding_mode(
+            self.AG_NAME, replica_seeding_mode)
+        self.state.seeding_mode = replica_seeding_mode
+
+    def publish_logins_manifest(self):
+        """Publishes the SQL logins manifest from the primary replica.
+
+        The SID, password hash and server roles of every synced SQL login are
+        set in the unit relation data, as compressed JSON, together with a
+        version digest of the whole manifest. The secondary replicas apply
+        the changed SQL logins from it, without connecting to the primary
+        replica.
+        """
+        logins = self.mssql_db_client().get_sql_logins()
+        manifest = {}
+        for login_name, login_info in logins.items():
+            if self.is_synced_login(login_name):
+                manifest[login_name] = login_info
+        manifest = json.dumps(manifest, sort_keys=True)
+        version = hashlib.sha256(manifest.encode()).hexdigest()
+        rel_data = self.relation.data[self.unit]
+        if rel_data.get('logins_version') == version:
+            return
+        logger.info("Publishing the SQL logins manifest version %s.", version)
+        rel_data['logins_manifest'] = b64encode(
+            zlib.compress(manifest.encode())).decode()
+        rel_data['logins_version'] = version
 
     def sync_logins_from_primary_replica(self):
-        primary_db_client = self.mssql_db_client(self.ag_primary_replica)
-        primary_logins = primary_db_client.get_sql_logins()
-        this_db_client = self.mssql_db_client()
-        this_logins = this_db_client.get_sql_logins()
-        for login_name, login_info in primary_logins.items():
-            if login_name in this_logins:
-                continue
-            logger.info(
-                "Syncing login %s from the primary replica.", login_name)
-            this_db_client.create_login(
-                name=login_name,
-                sid=login_info['sid'],
-                password=login_info['password_hash'],
-                is_hashed_password=True,
-                server_roles=login_info['roles'])
+        """Syncs the SQL logins changed since the last applied manifest.
+
+        The SQL logins whose digests changed are created or altered from the
+        manifest published by the primary replica, and the ones removed from
+        the manifest are dropped, all with a single round-trip.
+        """
+        primary_rel_data = self.get_node_rel_data(self.ag_primary_replica)
+        version = primary_rel_data.get('logins_version')
+        if not version:
+            logger.info("The primary replica didn't publish the SQL logins "
+                        "manifest yet.")
+            return
+        if version == self.state.applied_logins_version:
+            logger.info("The SQL logins are already in sync.")
+            return
+        manifest = json.loads(zlib.decompress(
+            b64decode(primary_rel_data['logins_manifest'].encode())))
+        digests = {
+            login_name: self.login_digest(login_info)
+            for login_name, login_info in manifest.items()
+        }
+        applied_logins = self.state.applied_logins
+        changed = {
+            login_name: login_info
+            for login_name, login_info in manifest.items()
+            if applied_logins.get(login_name) != digests[login_name]
+        }
+        dropped = [login_name for login_name in applied_logins.keys()
+                   if login_name not in manifest]
+        if changed or dropped:
+            logger.info("Syncing SQL logins from the primary replica. "
+                        "Changed: %s. Dropped: %s.",
+                        list(changed.keys()), dropped)
+            self.mssql_db_client().apply_logins(changed, dropped)
+        self.state.applied_logins = digests
+        self.state.applied_logins_version = version
 
     def create_ag(self):
         if self.state.ag_configured:
@@ -184,12 +528,21 @@ class MssqlCluster(Object):
                 "We need at least 3 nodes ready to create the availability "
                 "group. Current nodes ready: %s", len(ready_nodes))
             return
-        self.mssql_db_client().create_ag(self.AG_NAME, ready_nodes)
+        self.mssql_db_client().create_ag(
+            self.AG_NAME, ready_nodes,
+            self.replica_availability_modes(ready_nodes),
+            self.replica_seeding_mode)
+        self.state.seeding_mode = self.replica_seeding_mode
+        self.invalidate_ag_topology()
         self.on.created_ag.emit()
         self.relation.data[self.unit]['clustered'] = 'true'
         self.set_app_rel_data({'ag_ready': 'true'})
         self.state.ag_configured = True
         self.set_unit_rel_nonce()
+        self.publish_logins_manifest()
+        self.configure_contained_database_authentication()
+        self.configure_seeding()
+        self.configure_read_routing()
         self.set_unit_active_status()
 
     def join_existing_ag(self):
@@ -197,19 +550,44 @@ class MssqlCluster(Object):
             logger.info("AG is already configured.")
             return
         self.mssql_db_client().join_ag(self.AG_NAME)
+        self.invalidate_ag_topology()
         self.relation.data[self.unit]['clustered'] = 'true'
         self.state.ag_configured = True
+        self.configure_contained_database_authentication()
+        self.configure_seeding()
         self.set_unit_active_status()
 
     def add_to_initialized_nodes(self, node_name, node_address,
                                  ready_to_cluster=None, clustered=None):
         self.state.initialized_nodes[node_name] = {'address': node_address}
-        append_hosts_entry(node_address, [node_name])
+        self.hosts.set_entry(node_address, [node_name])
         if ready_to_cluster:
             self.state.initialized_nodes[node_name]['ready_to_cluster'] = True
         if clustered:
             self.state.initialized_nodes[node_name]['clustered'] = True
 
+    def get_node_rel_data(self, node_name):
+        """Returns the relation data of the peer unit with the given node."""
+        for unit in self.relation.units:
+            rel_data = self.relation.data[unit]
+            if rel_data.get('node_name') == node_name:
+                return rel_data
+        return {}
+
+    def is_synced_login(self, login_name):
+        if login_name in self.SYNC_EXCLUDED_LOGINS:
+            return False
+        return not login_name.startswith('##')
+
+    @staticmethod
+    def login_digest(login_info):
+        login_data = json.dumps([
+            login_info['sid'],
+            login_info['password_hash'],
+            sorted(login_info['roles']),
+        ])
+        return hashlib.sha256(login_data.encode()).hexdigest()
+
     def set_master_cert(self):
         master_key_password = host.pwgen(32)
         master_cert_key_password = host.pwgen(32)
@@ -256,10 +634,84 @@ class MssqlCluster(Object):
             return None
         return rel.data[self.app].get(var_name)
 
-    def mssql_db_client(self, db_host=None):
+    def mssql_db_client(self, db_host=None, connect_timeout=None,
+                        flush_hosts=True):
+        if db_host and flush_hosts:
+            # The other nodes are reached by their names.
+            self.hosts.flush()
         mssql_host = db_host or self.bind_address
         return MSSQLDatabaseClient(
-            host=mssql_host, user='SA', password=self.sa_password)
+            host=mssql_host, user='SA', password=self.sa_password,
+            connect_timeout=connect_timeout)
+
+    def invalidate_ag_topology(self):
+        self._ag_topology = None
+        self._ag_topology_fetched = False
+
+    def get_ag_topology(self):
+        """Returns a consolidated snapshot of the AG topology.
+
+        If the current unit is already an AG replica, the topology is read
+        from the local SQL Server. Otherwise, all the other known nodes are
+        queried in parallel, with a short connect timeout, and the primary
+        replica reported by most of the nodes is used. If no primary replica
+        is reported and some nodes couldn't be queried, an exception is
+        raised, so the hook is retried.
+        """
+        if not self.is_ag_ready:
+            return None
+        if self.state.ag_configured:
+            return self.mssql_db_client().get_ag_topology(self.AG_NAME)
+        nodes = [node for node in self.state.initialized_nodes.keys()
+                 if node != self.node_name]
+        if len(nodes) == 0:
+            return None
+
+        # The nodes are queried from worker threads, which must not touch
+        # the hosts file or the charm model. So, the pending hosts entries
+        # are written first, and the DB clients (with the SA password read
+        # from the peer relation) are built before the threads are started.
+        self.hosts.flush()
+        db_clients = {
+            node: self.mssql_db_client(
+                node, connect_timeout=self.TOPOLOGY_CONNECT_TIMEOUT,
+                flush_hosts=False)
+            for node in nodes
+        }
+        ag_name = self.AG_NAME
+
+        def _get_node_topology(node):
+            return db_clients[node].get_ag_topology(ag_name)
+
+        results = run_concurrently(
+            _get_node_topology, nodes,
+            timeout=2 * self.TOPOLOGY_CONNECT_TIMEOUT)
+        primary_votes = collections.Counter()
+        topologies = {}
+        failed_nodes = []
+        for node, (topology, ex) in results.items():
+            if ex:
+                logger.warning(
+                    "Failed to get the AG topology from node %s: %s",
+                    node, ex)
+                failed_nodes.append(node)
+                continue
+            if not topology or not topology['primary_replica']:
+                continue
+            topologies[node] = topology
+            primary_votes[topology['primary_replica']] += 1
+        if not primary_votes:
+            if failed_nodes:
+                raise Exception(
+                    "Cannot get the AG topology. Failed nodes: {}".format(
+                        ", ".join(sorted(failed_nodes))))
+            return None
+        primary_replica = primary_votes.most_common(1)[0][0]
+        if primary_replica in topologies:
+            return topologies[primary_replica]
+        for topology in topologies.values():
+            if topology['primary_replica'] == primary_replica:
+                return topology
 
     @property
     def clustered_nodes(self):
@@ -303,36 +755,71 @@ class MssqlCluster(Object):
     def is_ag_ready(self):
         return self.get_app_rel_data('ag_ready') == 'true'
 
+    @property
+    def ag_topology(self):
+        if not self._ag_topology_fetched:
+            self._ag_topology = self.get_ag_topology()
+            self._ag_topology_fetched = True
+        return self._ag_topology
+
     @property
     def ag_primary_replica(self):
-        if not self.is_ag_ready:
-            return None
-        if self.state.ag_configured:
-            return self.mssql_db_client().get_ag_primary_replica(self.AG_NAME)
-        clustered_nodes = self.clustered_nodes
-        if len(clustered_nodes) == 0:
+        topology = self.ag_topology
+        if not topology:
             return None
-        node = list(self.clustered_nodes.keys()).pop()
-        return self.mssql_db_client(node).get_ag_primary_replica(self.AG_NAME)
+        return topology['primary_replica']
 
     @property
     def is_primary_replica(self):
         primary_replica = self.ag_primary_replica
         if primary_replica:
-            return self.node_name == self.ag_primary_replica
+            return self.node_name == primary_replica
         return self.unit.is_leader()
 
     @property
     def ag_replicas(self):
-        if not self.is_ag_ready:
+        topology = self.ag_topology
+        if not topology:
             return []
-        if self.state.ag_configured:
-            return self.mssql_db_client().get_ag_replicas(self.AG_NAME)
-        clustered_nodes = self.clustered_nodes
-        if len(clustered_nodes) == 0:
-            return []
-        node = list(self.clustered_nodes.keys()).pop()
-        return self.mssql_db_client(node).get_ag_replicas(self.AG_NAME)
+        return topology['replicas']
+
+    @property
+    def readable_secondaries(self):
+        """Returns the readable-secondaries mode, or None if it's invalid."""
+        mode = self.model.config.get('readable-secondaries') or 'no'
+        if mode not in self.READABLE_SECONDARIES_MODES:
+            logger.warning("Invalid readable-secondaries config option: %s",
+                           mode)
+            return None
+        return mode
+
+    @property
+    def seeding_mode(self):
+        """Returns the seeding-mode option, or None if it's invalid."""
+        mode = self.model.config.get('seeding-mode') or 'automatic'
+        if mode not in self.SEEDING_MODES:
+            logger.warning("Invalid seeding-mode config option: %s", mode)
+            return None
+        if mode == 'manual' and not self.model.config.get(
+                'seeding-backup-path'):
+            logger.warning("The seeding-backup-path config option is "
+                           "required for manual seeding.")
+            return None
+        return mode
+
+    @property
+    def replica_seeding_mode(self):
+        return self.SEEDING_MODES.get(self.seeding_mode, 'AUTOMATIC')
+
+    @property
+    def manual_seeding_dir(self):
+        if self.seeding_mode != 'manual':
+            return None
+        return self.model.config.get('seeding-backup-path')
+
+    @property
+    def contained_databases(self):
+        return bool(self.model.config.get('contained-databases'))
 
     @property
     def node_name(self):
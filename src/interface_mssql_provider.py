@@ -2,9 +2,13 @@
 Implementation of the MSSQL charm database provider interface.
 """
 
+import json
 import logging
 
-from ops.framework import Object
+from ops.framework import (
+    Object,
+    StoredState)
+from ops.model import BlockedStatus
 from charmhelpers.core import host
 
 logger = logging.getLogger(__name__)
@@ -12,8 +16,30 @@ logger = logging.getLogger(__name__)
 
 class MssqlDBProvider(Object):
 
+    state = StoredState()
+    # Resource Governor limits which can be requested by the db consumers,
+    # with their valid ranges.
+    RESOURCE_LIMITS = {
+        'max_cpu_percent': (1, 100),
+        'max_memory_percent': (1, 100),
+        'max_iops_per_volume': (0, 2 ** 31 - 1),
+    }
+
     def __init__(self, charm, relation_name):
         super().__init__(charm, relation_name)
+        # Registry of the provisioned db requests, keyed by
+        # "<relation id>/<database>/<username>", with the password of the
+        # provisioned SQL login. The pending db requests are queued with the
+        # same keys. The Resource Governor limits requested by the consumers
+        # (and the ones applied on the local SQL Server) are kept as JSON,
+        # keyed by username. The queued requests which failed to be
+        # provisioned are reported in the unit status.
+        self.state.set_default(
+            provisioned={},
+            pending={},
+            failed_requests=[],
+            resource_limits='{}',
+            applied_resource_limits='{}')
         self.db_rel_name = relation_name
         self.app = self.model.app
         self.unit = self.model.unit
@@ -25,55 +51,325 @@ class MssqlDBProvider(Object):
         self.framework.observe(
             charm.on[relation_name].relation_departed,
             self.on_departed)
+        self.framework.observe(
+            charm.on.config_changed,
+            self.on_config_changed)
+        self.framework.observe(
+            charm.on.update_status,
+            self.on_update_status)
+        self.framework.observe(
+            self.framework.on.pre_commit,
+            self.on_pre_commit)
+        # The queued db requests are processed only at the end of the hooks
+        # which can change them, or the readiness of the AG and the HA
+        # cluster. The actions and the update-status hooks leave them alone.
+        self._process_requests = False
+        trigger_events = [
+            charm.on.config_changed,
+            charm.on.leader_elected,
+            charm.on.leader_settings_changed,
+            charm.on.upgrade_charm,
+        ]
+        for rel_name in charm.meta.relations:
+            trigger_events.extend([
+                charm.on[rel_name].relation_joined,
+                charm.on[rel_name].relation_changed,
+                charm.on[rel_name].relation_departed,
+                charm.on[rel_name].relation_broken,
+            ])
+        for event in trigger_events:
+            self.framework.observe(event, self.on_process_requests_trigger)
 
     def on_changed(self, event):
+        rel_data = self.db_rel_data(event)
+        if not rel_data:
+            logging.info("The db relation data is not available yet.")
+            return
+        # The request is queued, and all the queued requests are provisioned
+        # together before the hook is committed. See
+        # process_pending_requests().
+        rel_data['relation_id'] = event.relation.id
+        self.state.pending[self.request_key(event.relation, rel_data)] = \
+            rel_data
+        self.set_resource_limits(rel_data['username'],
+                                 self.db_resource_limits(event))
+
+    def on_process_requests_trigger(self, _):
+        self._process_requests = True
+
+    def on_pre_commit(self, _):
+        if not self._process_requests:
+            return
+        self._process_requests = False
+        self.process_pending_requests()
+
+    def on_update_status(self, _):
+        if self.state.failed_requests:
+            self.unit.status = self.failed_requests_status
+
+    def process_pending_requests(self):
+        """Provisions the queued db requests.
+
+        The queue is kept until the AG and the HA cluster are ready. Then,
+        all the requests that are not already provisioned are handled with a
+        single batch, over a single connection, and the secondary replicas
+        are notified once.
+
+        If the batch fails, the requests are retried one by one, so a bad
+        request doesn't block the other ones. The failed requests are kept
+        queued, and they are reported in the unit status.
+
+        The changed Resource Governor limits are applied before, on their
+        own. The Resource Governor configuration is not replicated by the
+        AG, so every replica applies the limits requested by the consumers
+        on its own SQL Server.
+        """
+        resource_limits_changed = (self.state.resource_limits !=
+                                   self.state.applied_resource_limits)
+        if not self.state.pending and not resource_limits_changed:
+            return
         if not self.cluster.is_ag_ready or not self.ha.is_ha_cluster_ready:
-            logger.warning('Defering DB on_changed() until the AG and '
-                           'the HA cluster are ready.')
-            event.defer()
+            logger.warning('Queuing %s db request(s) until the AG and the '
+                           'HA cluster are ready.', len(self.state.pending))
             return
+        if resource_limits_changed:
+            self.apply_resource_limits()
+        pending = dict(self.state.pending)
+        self.state.pending = {}
         if not self.cluster.is_primary_replica:
-            logger.warning('Unit is not the SQL Server primary replica. '
-                           'Skipping DB on_changed().')
+            self.forget_provisioned_requests()
+            self.set_failed_requests([])
+            if pending:
+                logger.warning('Unit is not the SQL Server primary replica. '
+                               'Skipping %s db request(s).', len(pending))
             return
-        rel_data = self.db_rel_data(event)
-        if not rel_data:
-            logging.info("The db relation data is not available yet.")
+
+        new_requests = {}
+        for request_key, rel_data in pending.items():
+            rel = self.model.get_relation(self.db_rel_name,
+                                          rel_data['relation_id'])
+            if not rel:
+                logger.info('The db relation %s is gone. Skipping its '
+                            'request.', rel_data['relation_id'])
+                continue
+            if request_key in self.state.provisioned:
+                logging.info("The db request is already provisioned.")
+                self.advertise_credentials(
+                    rel, self.state.provisioned[request_key])
+                self.advertise_read_only_endpoint(rel)
+                continue
+            new_requests[request_key] = (rel, rel_data, host.pwgen(32))
+        if not new_requests:
+            self.set_failed_requests([])
             return
 
-        logging.info("Handling db request.")
-        db_user_password = host.pwgen(32)
+        logging.info("Handling %s db request(s).", len(new_requests))
+        failed_requests = {}
+        try:
+            self.provision_requests(new_requests)
+        except Exception as ex:
+            if len(new_requests) == 1:
+                logger.error('Failed to provision the db request: %s', ex)
+                failed_requests = new_requests
+            else:
+                logger.warning('Failed to provision the db requests with a '
+                               'single batch: %s. Retrying them one by one.',
+                               ex)
+                failed_requests = self.provision_requests_one_by_one(
+                    new_requests)
+        for request_key, (_, rel_data, _) in failed_requests.items():
+            self.state.pending[request_key] = rel_data
+        self.set_failed_requests(failed_requests.keys())
+
+    def provision_requests_one_by_one(self, new_requests):
+        """Provisions every request with its own batch.
+
+        :returns: dict with the requests which failed to be provisioned.
+        """
+        failed_requests = {}
+        for request_key, request in new_requests.items():
+            try:
+                self.provision_requests({request_key: request})
+            except Exception as ex:
+                logger.error('Failed to provision the db request %s: %s',
+                             request_key, ex)
+                failed_requests[request_key] = request
+        return failed_requests
+
+    def set_failed_requests(self, request_keys):
+        """Reports the failed requests in the unit status.
+
+        The unit is set active again once there are no failed requests.
+        """
+        had_failed_requests = bool(self.state.failed_requests)
+        self.state.failed_requests = sorted(request_keys)
+        if self.state.failed_requests:
+            self.unit.status = self.failed_requests_status
+        elif had_failed_requests:
+            self.cluster.set_unit_active_status()
+
+    @property
+    def failed_requests_status(self):
+        return BlockedStatus(
+            'Failed to provision {} db request(s). See the unit '
+            'logs.'.format(len(self.state.failed_requests)))
+
+    def apply_resource_limits(self):
+        """Applies the Resource Governor limits on the local SQL Server.
+
+        A failure doesn't block the db requests, and the limits are applied
+        again by the next hook. The limits are ignored if the SQL Server
+        edition has no Resource Governor.
+        """
+        try:
+            self.cluster.mssql_db_client().configure_resource_governor(
+                json.loads(self.state.resource_limits))
+        except Exception as ex:
+            logger.error('Failed to apply the Resource Governor limits: %s',
+                         ex)
+            return
+        self.state.applied_resource_limits = self.state.resource_limits
+
+    def provision_requests(self, new_requests):
+        """Provisions the db requests, with a single batch.
+
+        :param new_requests: dict with the (relation, relation data,
+                             password) tuples of the requests, keyed by
+                             request key.
+        """
         db_client = self.cluster.mssql_db_client()
-        db_client.create_database(db_name=rel_data['database'],
-                                  ag_name=self.cluster.AG_NAME)
-        db_client.create_login(name=rel_data['username'],
-                               password=db_user_password)
-        db_client.grant_access(db_name=rel_data['database'],
-                               db_user_name=rel_data['username'])
-        # Notify the secondary replicas, so they can sync the new SQL logins
-        # from the primary replica.
-        self.cluster.set_unit_rel_nonce()
-
-        rel = self.model.get_relation(
-            event.relation.name,
-            event.relation.id)
-        # advertise on app
-        rel.data[self.app]['db_host'] = self.ha.bind_address
-        rel.data[self.app]['password'] = db_user_password
-        # advertise on unit
-        rel.data[self.unit]['db_host'] = self.ha.bind_address
-        rel.data[self.unit]['password'] = db_user_password
+        manual_seeding_dir = self.cluster.manual_seeding_dir
+        contained = self.cluster.contained_databases
+        non_contained_dbs = []
+        if contained:
+            # The existing databases which are not contained can't have
+            # contained users, so their requests get SQL logins instead.
+            non_contained_dbs = db_client.get_non_contained_databases(
+                set(rel_data['database']
+                    for _, rel_data, _ in new_requests.values()))
+            for db_name in non_contained_dbs:
+                logger.warning('Database %s is not contained. Using SQL '
+                               'logins for its db requests.', db_name)
+        with db_client.batch() as batch:
+            # The databases are created (and added to the AG) first, since
+            # those statements can't run inside the batch transaction.
+            for _, rel_data, _ in new_requests.values():
+                batch.create_database(db_name=rel_data['database'],
+                                      ag_name=self.cluster.AG_NAME,
+                                      manual_seeding_dir=manual_seeding_dir,
+                                      contained=contained)
+            for _, rel_data, password in new_requests.values():
+                if contained and rel_data['database'] not in non_contained_dbs:
+                    batch.create_contained_user(
+                        db_name=rel_data['database'],
+                        db_user_name=rel_data['username'],
+                        password=password)
+                    continue
+                batch.create_login(name=rel_data['username'],
+                                   password=password)
+                batch.grant_access(db_name=rel_data['database'],
+                                   db_user_name=rel_data['username'])
+        if not contained or non_contained_dbs:
+            # Notify the secondary replicas, so they can sync the new SQL
+            # logins from the primary replica. The contained users are
+            # replicated with their databases instead.
+            self.cluster.publish_logins_manifest()
+        if manual_seeding_dir:
+            # Notify the secondary replicas, so they can seed the databases.
+            self.cluster.set_unit_rel_nonce()
+
+        for request_key, (rel, _, password) in new_requests.items():
+            self.state.provisioned[request_key] = password
+            self.advertise_credentials(rel, password)
+            self.advertise_read_only_endpoint(rel)
+
+    def on_config_changed(self, _):
+        relations = self.model.relations[self.db_rel_name]
+        if not relations:
+            return
+        if not self.cluster.is_ag_ready or not self.ha.is_ha_cluster_ready:
+            return
+        if not self.cluster.is_primary_replica:
+            self.forget_provisioned_requests()
+            return
+        for rel in relations:
+            if rel.data[self.unit].get('db_host'):
+                self.advertise_read_only_endpoint(rel)
+
+    def forget_provisioned_requests(self):
+        """Clears the registry of the provisioned db requests.
+
+        While the unit is a secondary replica, another primary replica may
+        provision the same requests again, with new passwords. The registry
+        is cleared, so the unit doesn't advertise stale credentials if it
+        becomes the primary replica again.
+        """
+        if self.state.provisioned:
+            logger.info('Unit is not the SQL Server primary replica. '
+                        'Clearing the provisioned db requests registry.')
+            self.state.provisioned = {}
+
+    def advertise_credentials(self, rel, password):
+        """Advertises the db host and the password of the SQL login.
+
+        Only the changed keys are written, so the consumer units don't get a
+        relation-changed hook when the request is answered from the
+        provisioning registry.
+        """
+        data = {
+            'db_host': self.ha.bind_address,
+            'password': password,
+        }
+        bags = [rel.data[self.unit]]
+        if self.unit.is_leader():
+            bags.append(rel.data[self.app])
+        for bag in bags:
+            for key, value in data.items():
+                if bag.get(key) != value:
+                    bag[key] = value
+
+    def advertise_read_only_endpoint(self, rel):
+        """Advertises the read-only endpoint, if the secondaries are readable.
+
+        The read-intent connections (ApplicationIntent=ReadOnly) to the
+        primary replica are routed by SQL Server to the readable secondary
+        replicas.
+        """
+        mode = self.cluster.readable_secondaries
+        if not mode:
+            return
+        ro_data = {'ro_db_host': '', 'ro_application_intent': ''}
+        if mode != 'no':
+            ro_data = {
+                'ro_db_host': self.ha.bind_address,
+                'ro_application_intent': 'ReadOnly',
+            }
+        if self.unit.is_leader():
+            rel.data[self.app].update(ro_data)
+        rel.data[self.unit].update(ro_data)
 
     def on_departed(self, event):
         rel_data = self.db_rel_data(event)
         if not rel_data:
             logger.info('No relation data. Skipping DB on_departed().')
             return
+        request_key = self.request_key(event.relation, rel_data)
+        self.state.pending.pop(request_key, None)
+        self.state.provisioned.pop(request_key, None)
+        failed = request_key in self.state.failed_requests
+        if failed:
+            self.set_failed_requests([
+                key for key in self.state.failed_requests
+                if key != request_key])
+        self.set_resource_limits(rel_data['username'], {})
         db_client = self.cluster.mssql_db_client()
         db_client.remove_login(rel_data['username'])
-        if self.cluster.is_ag_ready and self.cluster.is_primary_replica:
+        # The database of a failed request may not exist.
+        if (not failed and self.cluster.is_ag_ready and
+                self.cluster.is_primary_replica):
             db_client.revoke_access(db_name=rel_data['database'],
                                     db_user_name=rel_data['username'])
+            self.cluster.publish_logins_manifest()
 
     def db_rel_data(self, event):
         rel_data = event.relation.data.get(event.unit)
@@ -87,3 +383,44 @@ class MssqlDBProvider(Object):
             'database': database,
             'username': username,
         }
+
+    def db_resource_limits(self, event):
+        """Returns the Resource Governor limits requested by the consumer.
+
+        The invalid limits are ignored.
+        """
+        rel_data = event.relation.data.get(event.unit) or {}
+        limits = {}
+        for key, (min_value, max_value) in self.RESOURCE_LIMITS.items():
+            value = rel_data.get(key)
+            if not value:
+                continue
+            try:
+                value = int(value)
+            except ValueError:
+                value = None
+            if value is None or not min_value <= value <= max_value:
+                logger.warning('Ignoring the invalid %s requested by %s: %s',
+                               key, event.unit.name, rel_data.get(key))
+                continue
+            limits[key] = value
+        return limits
+
+    def set_resource_limits(self, username, limits):
+        """Sets the Resource Governor limits requested for the username.
+
+        The limits are applied by process_pending_requests(), if they
+        changed.
+        """
+        resource_limits = json.loads(self.state.resource_limits)
+        if limits:
+            resource_limits[username] = limits
+        else:
+            resource_limits.pop(username, None)
+        self.state.resource_limits = json.dumps(resource_limits,
+                                                sort_keys=True)
+
+    @staticmethod
+    def request_key(rel, rel_data):
+        return '{}/{}/{}'.format(
+            rel.id, rel_data['database'], rel_data['username'])
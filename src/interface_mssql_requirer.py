@@ -29,9 +29,15 @@ class MssqlDBRequirer(Object):
 
     def __init__(self, charm, relation_name):
         super().__init__(charm, relation_name)
+        # The read-only connections to database_ro_host must be made with
+        # the given application intent (ApplicationIntent=ReadOnly), so SQL
+        # Server routes them to the readable secondary replicas.
         self.state.set_default(
             database_host=None,
+            database_ro_host=None,
+            database_ro_application_intent=None,
             database_user_password=None)
+        self.relation_name = relation_name
         self.app = self.model.app
         self.unit = self.model.unit
         self.framework.observe(
@@ -40,6 +46,9 @@ class MssqlDBRequirer(Object):
         self.framework.observe(
             charm.on[relation_name].relation_changed,
             self.on_changed)
+        self.framework.observe(
+            charm.on.config_changed,
+            self.on_config_changed)
 
     def on_joined(self, event):
         database_name = self.model.config.get('database-name')
@@ -51,12 +60,35 @@ class MssqlDBRequirer(Object):
         rel = self.model.get_relation(event.relation.name, event.relation.id)
         rel.data[self.unit]['database'] = database_name
         rel.data[self.unit]['username'] = database_user_name
+        self.set_resource_limits(rel)
+
+    def on_config_changed(self, _):
+        for rel in self.model.relations[self.relation_name]:
+            self.set_resource_limits(rel)
+
+    def set_resource_limits(self, rel):
+        """Sets the optional Resource Governor limits of the SQL login.
+
+        The limits which are not set in the config are removed from the
+        relation data.
+        """
+        for key in ['max-cpu-percent', 'max-memory-percent',
+                    'max-iops-per-volume']:
+            value = self.model.config.get('database-{}'.format(key))
+            rel_key = key.replace('-', '_')
+            if value:
+                rel.data[self.unit][rel_key] = str(value)
+            elif rel_key in rel.data[self.unit]:
+                del rel.data[self.unit][rel_key]
 
     def on_changed(self, event):
         rel_data = event.relation.data.get(event.unit)
         if not rel_data:
             return
         self.state.database_host = rel_data.get('db_host')
+        self.state.database_ro_host = rel_data.get('ro_db_host')
+        self.state.database_ro_application_intent = rel_data.get(
+            'ro_application_intent')
         self.state.database_user_password = rel_data.get('password')
         if self.state.database_host and self.state.database_user_password:
             self.on.ready_db.emit()
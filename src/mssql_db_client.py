@@ -2,15 +2,23 @@
 DB client helpers for the MSSQL charm.
 """
 
+import contextlib
+import json
 import logging
 import pwd
 import grp
 import os
+import random
+import re
+import socket
 import subprocess
+import threading
 import time
 
 from charmhelpers.fetch import apt_update, apt_install
 
+import mssql_stats
+import mssql_statements as statements
 from utils import retry_on_error
 
 logger = logging.getLogger(__name__)
@@ -47,118 +55,438 @@ except ImportError:
             '--target=venv', '--requirement=requirements.txt'])
     from pymssql import connect  # NOQA:F401
 
+# Optional time budget (in seconds) for a single hook execution, measured
+# from the moment the charm code was loaded. See configure().
+_hook_time_budget = None
+_HOOK_START_TIME = time.monotonic()
+
+# SQL Server login errors which will not be fixed by retrying the connection:
+# login failed (wrong password), login disabled, account locked out, password
+# expired and password must be changed.
+NON_TRANSIENT_LOGIN_ERRORS = [18456, 18470, 18486, 18487, 18488]
+
+_PARAM_PLACEHOLDER_REGEX = re.compile(r'%\((\w+)\)s')
+
+
+class MSSQLLoginError(Exception):
+    pass
+
+
+def configure(hook_time_budget=None):
+    """Configures the DB client.
+
+    :param hook_time_budget: number of seconds after which the connection
+                             attempts of a hook stop retrying (see
+                             MSSQLDatabaseClient._connection). Disabled if
+                             not set.
+    """
+    global _hook_time_budget
+    _hook_time_budget = hook_time_budget or None
+
+
+def _remaining_hook_time():
+    """Returns the remaining hook time budget, or None if it's not set."""
+    if _hook_time_budget is None:
+        return None
+    return _HOOK_START_TIME + _hook_time_budget - time.monotonic()
+
+
+def _is_port_open(host, port, timeout):
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _get_error_number(ex):
+    if not ex.args or not isinstance(ex.args[0], tuple):
+        return None
+    error = ex.args[0]
+    if not error or not isinstance(error[0], int):
+        return None
+    return error[0]
+
+
+class _InstrumentedCursor(object):
+    """Cursor wrapper recording the stats of the executed statements."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._name = None
+
+    def execute(self, t_sql, params=None, name=None):
+        self._name = name or statements.statement_name(t_sql)
+        start = time.monotonic()
+        try:
+            self._cursor.execute(t_sql, params)
+        finally:
+            mssql_stats.record_operation(
+                self._name, time.monotonic() - start)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row:
+            mssql_stats.record_rows(self._name, 1)
+        return row
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        mssql_stats.record_rows(self._name, len(rows))
+        return rows
+
+    def nextset(self):
+        return self._cursor.nextset()
+
+    def close(self):
+        self._cursor.close()
+
+    def __iter__(self):
+        for row in self._cursor:
+            mssql_stats.record_rows(self._name, 1)
+            yield row
+
+
+class MSSQLConnectionPool(object):
+    """Process wide pool of SQL Server connections.
+
+    The connections are keyed by (host, port, user), so every hook performs
+    a single login per SQL Server instance, regardless of how many database
+    operations it runs. Idle connections are health checked before they are
+    handed out again, and they are closed at the end of the hook.
+    """
+
+    HEALTH_CHECK_INTERVAL = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def acquire(self, key, connect_func):
+        while True:
+            with self._lock:
+                idle_conns = self._idle.get(key, [])
+                if not idle_conns:
+                    break
+                conn, last_used = idle_conns.pop()
+            if time.time() - last_used < self.HEALTH_CHECK_INTERVAL:
+                return conn
+            if self._is_healthy(conn):
+                return conn
+            logger.info("Discarding stale SQL Server connection to %s:%s.",
+                        key[0], key[1])
+            self.discard(conn)
+        return connect_func()
+
+    def release(self, key, conn):
+        with self._lock:
+            self._idle.setdefault(key, []).append((conn, time.time()))
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                self.discard(conn)
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+
+_CONNECTION_POOL = MSSQLConnectionPool()
+
+
+def close_connections():
+    """Closes all the pooled SQL Server connections."""
+    _CONNECTION_POOL.close_all()
+
 
 class MSSQLDatabaseClient(object):
 
     MSSQL_DATA_DIR = '/var/opt/mssql/data'
     MSSQL_USER = 'mssql'
     MSSQL_GROUP = 'mssql'
+    CONNECT_TIMEOUT = 300
+    CONNECT_PROBE_TIMEOUT = 2
+    CONNECT_BACKOFF_BASE = 0.5
+    CONNECT_BACKOFF_MAX = 15
+    # Minimum time spent retrying a connection, even if the hook time budget
+    # is exhausted, so a connection always gets a few attempts.
+    CONNECT_MIN_RETRY_TIME = 30
+    MANUAL_SEEDING_BACKUP_STRIPES = 4
+    RESOURCE_POOL_PREFIX = 'juju_'
 
-    def __init__(self, user, password, host="localhost", port=1433):
+    def __init__(self, user, password, host="localhost", port=1433,
+                 connect_timeout=None):
         self._user = user
         self._password = password
         self._host = host
         self._port = port
+        self._connect_timeout = connect_timeout or self.CONNECT_TIMEOUT
+        self._pinned_conn = None
+
+    def __enter__(self):
+        self._pinned_conn = _CONNECTION_POOL.acquire(
+            self._pool_key, self._connection)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        conn = self._pinned_conn
+        self._pinned_conn = None
+        if exc_type:
+            _CONNECTION_POOL.discard(conn)
+        else:
+            _CONNECTION_POOL.release(self._pool_key, conn)
+
+    @property
+    def _pool_key(self):
+        return (self._host, self._port, self._user)
+
+    def _connection(self, timeout=None):
+        """Connects to the SQL Server.
 
-    def _connection(self, timeout=300):
-        sleep_time = 5
-        start = time.time()
+        Before every TDS login, a cheap TCP probe checks whether the SQL
+        Server port is accepting connections. Failed attempts are retried
+        with exponential backoff and jitter, until the deadline given by
+        the connect timeout. If a hook time budget is configured, the
+        deadline is also bounded by the remaining budget, but never below
+        CONNECT_MIN_RETRY_TIME. Login errors which cannot be fixed by
+        retrying are raised immediately.
+        """
+        timeout = timeout or self._connect_timeout
+        start = time.monotonic()
+        retry_time = timeout
+        remaining_hook_time = _remaining_hook_time()
+        if remaining_hook_time is not None:
+            retry_time = min(timeout, max(remaining_hook_time,
+                                          self.CONNECT_MIN_RETRY_TIME))
+        deadline = start + retry_time
+        attempt = 0
         while True:
-            elapsed = time.time() - start
-            if elapsed > timeout:
-                raise Exception(
-                    "Couldn't connect to SQL Server %s:%s within %.2f "
-                    "minutes" % (self._host, self._port, timeout / 60))
+            remaining = deadline - time.monotonic()
             try:
+                if not _is_port_open(self._host, self._port,
+                                     self.CONNECT_PROBE_TIMEOUT):
+                    raise Exception("SQL Server port is not open")
                 _conn = connect(
                     server=self._host, port=self._port,
-                    user=self._user, password=self._password)
+                    user=self._user, password=self._password,
+                    login_timeout=max(1, int(min(remaining, 60))))
                 _conn.autocommit(True)
+                mssql_stats.record_connection(
+                    self._host, time.monotonic() - start, attempt + 1)
                 return _conn
-            except Exception:
-                time.sleep(sleep_time)
+            except Exception as ex:
+                if _get_error_number(ex) in NON_TRANSIENT_LOGIN_ERRORS:
+                    raise MSSQLLoginError(
+                        "Cannot login to SQL Server %s:%s as %s: %s" % (
+                            self._host, self._port, self._user, ex))
+                attempt += 1
+                delay = min(self.CONNECT_BACKOFF_MAX,
+                            self.CONNECT_BACKOFF_BASE * 2 ** attempt)
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                remaining = deadline - time.monotonic()
+                if remaining <= delay:
+                    raise Exception(
+                        "Couldn't connect to SQL Server %s:%s within %.2f "
+                        "seconds (%d attempts): %s" % (
+                            self._host, self._port, timeout, attempt, ex))
+                logger.debug("Failed to connect to SQL Server %s:%s "
+                             "(attempt %d). Retrying in %.2f seconds.",
+                             self._host, self._port, attempt, delay)
+                time.sleep(delay)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Yields a pooled connection to the SQL Server.
+
+        If the client is used as a context manager, the connection pinned
+        for the lifetime of the context is returned.
+        """
+        if self._pinned_conn:
+            yield self._pinned_conn
+            return
+        conn = _CONNECTION_POOL.acquire(self._pool_key, self._connection)
+        try:
+            yield conn
+        except Exception:
+            _CONNECTION_POOL.discard(conn)
+            raise
+        _CONNECTION_POOL.release(self._pool_key, conn)
+
+    @contextlib.contextmanager
+    def cursor(self):
+        with self.connection() as conn:
+            cursor = _InstrumentedCursor(conn.cursor())
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def exec_t_sql(self, t_sql, params=None):
+        with self.cursor() as cursor:
+            cursor.execute(t_sql, params)
+
+    def exec_batch(self, batch_statements, transaction=True):
+        """Executes several statements as a single batch.
+
+        The statements run in a single round-trip to the SQL Server. If
+        transaction is set, they run in a transaction which is rolled back
+        if any of them fails. Statements which cannot run inside a user
+        transaction (see mssql_statements.NON_TRANSACTIONAL) are allowed
+        only at the beginning of the batch, and they run before the
+        transaction is started.
 
-    def exec_t_sql(self, t_sql):
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute(t_sql)
-        conn.close()
+        :param batch_statements: list of (t_sql, params) tuples.
+        :param transaction: whether to run the statements in a transaction.
+        """
+        prefix = []
+        body = []
+        batch_params = {}
+        # The DB driver substitutes the placeholders only if there are
+        # parameters, so only then the literal '%' must be escaped.
+        has_params = any(params for _, params in batch_statements)
+        for i, (t_sql, params) in enumerate(batch_statements):
+            non_transactional = t_sql in statements.NON_TRANSACTIONAL
+            if params:
+                t_sql = _PARAM_PLACEHOLDER_REGEX.sub(
+                    r'%(s{}_\1)s'.format(i), t_sql)
+                for name, value in params.items():
+                    batch_params['s{}_{}'.format(i, name)] = value
+            elif has_params:
+                t_sql = t_sql.replace('%', '%%')
+            if transaction and non_transactional:
+                if body:
+                    raise ValueError(
+                        "Non transactional statements must be at the "
+                        "beginning of the batch")
+                prefix.append(t_sql)
+            else:
+                body.append(t_sql)
+        if transaction and body:
+            body = [statements.BEGIN_BATCH_TRANSACTION] + body + [
+                statements.END_BATCH_TRANSACTION]
+        logger.info("Executing a batch of %d statements.",
+                    len(batch_statements))
+        with self.cursor() as cursor:
+            cursor.execute("\n".join(prefix + body), batch_params or None,
+                           name='BATCH')
 
-    def create_database(self, db_name, ag_name=None):
+    def batch(self, transaction=True):
+        """Returns a batch of DB client operations.
+
+        Usage::
+
+            with db_client.batch() as batch:
+                batch.create_login(name='user', password='password')
+                batch.grant_access(db_name='db', db_user_name='user')
+
+        The operations are executed with a single round-trip, when the
+        context is exited. Only operations which don't return results can
+        be batched.
+        """
+        return MSSQLBatch(self, transaction=transaction)
+
+    def create_database(self, db_name, ag_name=None,
+                        manual_seeding_dir=None, contained=False):
+        """Creates the database, and adds it to the given AG.
+
+        :param manual_seeding_dir: directory shared by all the replicas,
+                                   where the backups used to manually seed
+                                   the database on the secondary replicas
+                                   are taken. Automatic seeding is used if
+                                   it's not given.
+        :param contained: whether a new database is partially contained.
+        """
         logger.info("Creating database %s.", db_name)
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        IF NOT EXISTS (SELECT * FROM sys.databases WHERE name = '{db_name}')
-        BEGIN
-            CREATE DATABASE [{db_name}]
-        END
-        """.format(db_name=db_name))
-        logger.info("Created the database.")
-        if ag_name:
-            logger.info("Adding database %s to AG %s.", db_name, ag_name)
-            cursor.execute("""
-            ALTER DATABASE [{db_name}] SET RECOVERY FULL
-            BACKUP DATABASE [{db_name}] TO DISK = N'{data_dir}/{db_name}.bak'
-            IF NOT EXISTS(
-                SELECT db.name FROM
-                    sys.dm_hadr_database_replica_states rs
-                    JOIN
-                    sys.databases db
-                    ON rs.database_id = db.database_id
-                WHERE db.name = '{db_name}')
-            BEGIN
-                ALTER AVAILABILITY GROUP [{ag_name}] ADD DATABASE [{db_name}]
-            END
-            """.format(ag_name=ag_name,
-                       db_name=db_name,
-                       data_dir=self.MSSQL_DATA_DIR))
-            logger.info("Database added to AG.")
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(statements.CREATE_DATABASE, {
+                'db_name': db_name,
+                'contained': contained,
+            })
+            logger.info("Created the database.")
+            if ag_name and manual_seeding_dir:
+                logger.info("Adding database %s to AG %s, with manual "
+                            "seeding from %s.", db_name, ag_name,
+                            manual_seeding_dir)
+                backup_files, log_backup_file = \
+                    self._manual_seeding_backup_files(
+                        manual_seeding_dir, db_name)
+                cursor.execute(statements.ADD_DATABASE_TO_AG_MANUAL_SEEDING, {
+                    'db_name': db_name,
+                    'ag_name': ag_name,
+                    'backup_files': json.dumps(backup_files),
+                    'log_backup_file': log_backup_file,
+                })
+                logger.info("Database added to AG.")
+            elif ag_name:
+                logger.info("Adding database %s to AG %s.", db_name, ag_name)
+                cursor.execute(statements.ADD_DATABASE_TO_AG, {
+                    'db_name': db_name,
+                    'ag_name': ag_name,
+                })
+                logger.info("Database added to AG.")
+                self._after_execute(self._remove_stale_backup, db_name)
 
     def create_login(self, name, password, is_hashed_password=False,
                      sid=None, server_roles=[]):
         logger.info("Creating SQL login %s.", name)
-        conn = self._connection()
-        cursor = conn.cursor()
-        login_params = []
-        if is_hashed_password:
-            login_params.append("PASSWORD = 0x{0} HASHED".format(password))
-        else:
-            login_params.append("PASSWORD = '{0}'".format(password))
-        cursor.execute("""
-        SELECT * FROM sys.syslogins WHERE name = '{0}'
-        """.format(name))
-        if cursor.fetchone():
-            operation = "ALTER"
-        else:
-            operation = "CREATE"
-            if sid:
-                login_params.append("SID = 0x{0}".format(sid))
-        login_params += ["CHECK_POLICY = OFF", "CHECK_EXPIRATION = OFF"]
-        cursor.execute("""
-        {operation} LOGIN [{login_name}] WITH {login_params}
-        """.format(operation=operation,
-                   login_name=name,
-                   login_params=", ".join(login_params)))
-        for role in server_roles:
-            cursor.execute("""
-            ALTER SERVER ROLE [{role}] ADD MEMBER [{login_name}]
-            """.format(role=role, login_name=name))
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(statements.CREATE_OR_ALTER_LOGIN, {
+                'name': name,
+                'password': password,
+                'is_hashed_password': is_hashed_password,
+                'sid': sid,
+            })
+            for role in server_roles:
+                cursor.execute(statements.ADD_SERVER_ROLE_MEMBER, {
+                    'role': role,
+                    'name': name,
+                })
         logger.info("Created the SQL login.")
 
+    def apply_logins(self, logins, dropped=[]):
+        """Creates, alters and drops several SQL logins in one round-trip.
+
+        :param logins: dict mapping the SQL login names to dicts with their
+                       'sid' and 'password_hash' (hex strings), and 'roles'.
+        :param dropped: list with the names of the SQL logins to drop.
+        """
+        logger.info("Applying %d SQL logins and dropping %d SQL logins.",
+                    len(logins), len(dropped))
+        logins_json = []
+        for name, login_info in logins.items():
+            logins_json.append({
+                'name': name,
+                'sid': login_info['sid'],
+                'password_hash': login_info['password_hash'],
+                'roles': login_info['roles'],
+            })
+        with self.cursor() as cursor:
+            cursor.execute(statements.APPLY_LOGINS, {
+                'logins': json.dumps(logins_json),
+                'dropped': json.dumps(list(dropped)),
+            })
+        logger.info("SQL logins applied.")
+
     def remove_login(self, name):
         logger.info("Removing SQL login %s, if it exists.", name)
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        IF EXISTS (SELECT * FROM sys.syslogins WHERE name = '{0}')
-        BEGIN
-            DROP LOGIN [{0}]
-        END
-        """.format(name))
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(statements.DROP_LOGIN, {'name': name})
         logger.info("SQL login removed.")
 
     def grant_access(self, db_name, db_user_name, login_name=None):
@@ -166,50 +494,85 @@ class MSSQLDatabaseClient(object):
             login_name = db_user_name
         logger.info("Granting access for user %s to database %s.",
                     db_user_name, db_name)
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        USE [{db_name}]
-        IF NOT EXISTS(SELECT * FROM sys.sysusers WHERE name = '{db_user_name}')
-        BEGIN
-            CREATE USER [{db_user_name}] FOR LOGIN [{login_name}]
-        END
-        ALTER ROLE db_owner ADD MEMBER [{db_user_name}]
-        """.format(db_name=db_name,
-                   db_user_name=db_user_name,
-                   login_name=login_name))
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(statements.GRANT_DB_ACCESS, {
+                'db_name': db_name,
+                'db_user_name': db_user_name,
+                'login_name': login_name,
+            })
         logger.info("Database access granted.")
 
+    def create_contained_user(self, db_name, db_user_name, password):
+        """Creates or alters a contained user of the given database.
+
+        The user gets the db_owner role, like the users granted access with
+        grant_access().
+        """
+        logger.info("Creating contained user %s of database %s.",
+                    db_user_name, db_name)
+        with self.cursor() as cursor:
+            cursor.execute(statements.CREATE_OR_ALTER_CONTAINED_USER, {
+                'db_name': db_name,
+                'db_user_name': db_user_name,
+                'password': password,
+            })
+        logger.info("Contained user created.")
+
     def revoke_access(self, db_name, db_user_name):
         logger.info("Revoking access for user %s to database %s.",
                     db_user_name, db_name)
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        USE [{db_name}]
-        DROP USER IF EXISTS [{db_user_name}]
-        """.format(db_name=db_name, db_user_name=db_user_name))
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(statements.REVOKE_DB_ACCESS, {
+                'db_name': db_name,
+                'db_user_name': db_user_name,
+            })
         logger.info("Database access revoked.")
 
+    def configure_resource_governor(self, resource_limits):
+        """Configures the Resource Governor pools of the given SQL logins.
+
+        :param resource_limits: dict mapping the SQL login names to dicts
+                                with their optional 'max_cpu_percent',
+                                'max_memory_percent' and
+                                'max_iops_per_volume' limits. The logins
+                                missing from it are not governed.
+        :returns: boolean telling whether the Resource Governor was
+                  configured. It is not available in all SQL Server
+                  editions.
+        """
+        pools = []
+        for login_name, limits in sorted(resource_limits.items()):
+            pool = {
+                'login_name': login_name,
+                'pool_name': self.resource_pool_name(login_name),
+            }
+            pool.update(limits)
+            pools.append(pool)
+        logger.info("Configuring the Resource Governor pools of the SQL "
+                    "logins: %s.", ", ".join(resource_limits.keys()))
+        with self.cursor() as cursor:
+            cursor.execute(statements.CONFIGURE_RESOURCE_GOVERNOR, {
+                'pools': json.dumps(pools),
+            })
+            configured = bool(cursor.fetchone()[0])
+        if not configured:
+            logger.warning("The Resource Governor is not available in this "
+                           "SQL Server edition. Ignoring the resource "
+                           "limits.")
+            return False
+        logger.info("Resource Governor configured.")
+        return True
+
+    def resource_pool_name(self, login_name):
+        """Returns the resource pool and workload group name of the login."""
+        return '{}{}'.format(self.RESOURCE_POOL_PREFIX, login_name)[:128]
+
     def create_master_encryption_key(self, master_key_password):
         logger.info("Creating the master encryption key.")
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        USE [master]
-        IF NOT EXISTS(SELECT * FROM sys.symmetric_keys
-                      WHERE name = '##MS_DatabaseMasterKey##')
-        BEGIN
-            CREATE MASTER KEY ENCRYPTION BY PASSWORD = '{0}'
-        END
-        ELSE
-        BEGIN
-            ALTER MASTER KEY REGENERATE WITH ENCRYPTION BY PASSWORD = '{0}'
-        END
-        """.format(master_key_password))
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(statements.CREATE_MASTER_KEY, {
+                'password': master_key_password,
+            })
         logger.info("Master encryption key created.")
 
     def create_master_cert(self, master_cert_key_password):
@@ -218,25 +581,12 @@ class MSSQLDatabaseClient(object):
             self.MSSQL_DATA_DIR, 'dbm_certificate.cer')
         cert_key_file = os.path.join(
             self.MSSQL_DATA_DIR, 'dbm_certificate.pvk')
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        USE [master]
-        IF NOT EXISTS(SELECT * FROM sys.certificates
-                      WHERE name = 'dbm_certificate')
-        BEGIN
-            CREATE CERTIFICATE dbm_certificate WITH SUBJECT = 'dbm'
-        END
-        BACKUP CERTIFICATE dbm_certificate
-            TO FILE = '{cert_file}'
-            WITH PRIVATE KEY (
-                FILE = '{cert_key_file}',
-                ENCRYPTION BY PASSWORD = '{master_cert_key_password}'
-            )
-        """.format(cert_file=cert_file,
-                   cert_key_file=cert_key_file,
-                   master_cert_key_password=master_cert_key_password))
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(statements.CREATE_MASTER_CERT, {
+                'cert_file': cert_file,
+                'cert_key_file': cert_key_file,
+                'password': master_cert_key_password,
+            })
         with open(cert_file, 'rb') as f:
             cert = f.read()
         with open(cert_key_file, 'rb') as f:
@@ -262,183 +612,417 @@ class MSSQLDatabaseClient(object):
             f.write(master_cert_key)
         os.chown(cert_key_file, uid, gid)
 
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        USE [master]
-        IF NOT EXISTS(SELECT * FROM sys.certificates
-                      WHERE name = 'dbm_certificate')
-        BEGIN
-            CREATE CERTIFICATE dbm_certificate
-                FROM FILE = '{cert_file}'
-                WITH PRIVATE KEY (
-                    FILE = '{cert_key_file}',
-                    DECRYPTION BY PASSWORD = '{master_cert_key_password}'
-                )
-        END
-        """.format(cert_file=cert_file,
-                   cert_key_file=cert_key_file,
-                   master_cert_key_password=master_cert_key_password))
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(statements.SETUP_MASTER_CERT, {
+                'cert_file': cert_file,
+                'cert_key_file': cert_key_file,
+                'password': master_cert_key_password,
+            })
         logger.info("Restored the master certificate.")
 
     def setup_db_mirroring_endpoint(self):
         logger.info("Creating the DB mirroring endpoint")
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        IF NOT EXISTS(SELECT * FROM sys.endpoints WHERE name = 'Hadr_endpoint')
-        BEGIN
-            CREATE ENDPOINT [Hadr_endpoint]
-                AS TCP (LISTENER_PORT = 5022)
-                FOR DATABASE_MIRRORING (
-                    ROLE = ALL,
-                    AUTHENTICATION = CERTIFICATE dbm_certificate,
-                    ENCRYPTION = REQUIRED ALGORITHM AES
-                    )
-        END
-        ALTER ENDPOINT [Hadr_endpoint] STATE = STARTED
-        """)
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(statements.SETUP_DB_MIRRORING_ENDPOINT)
         logger.info("Created the DB mirroring endpoint")
 
-    def create_ag(self, ag_name, ready_nodes):
+    def create_ag(self, ag_name, ready_nodes, availability_modes={},
+                  seeding_mode='AUTOMATIC'):
+        """Creates the AG, with the given nodes as replicas.
+
+        :param availability_modes: dict with the availability mode
+                                   (SYNCHRONOUS_COMMIT or ASYNCHRONOUS_COMMIT)
+                                   of the nodes. The nodes missing from it
+                                   use synchronous commit.
+        :param seeding_mode: seeding mode of the replicas (AUTOMATIC or
+                             MANUAL).
+        """
         logger.info("Creating the availability group %s.", ag_name)
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT * FROM sys.availability_groups WHERE name = '{0}'
-        """.format(ag_name))
-        if cursor.fetchone():
+        replicas = self._replicas_spec(ready_nodes, availability_modes)
+        with self.cursor() as cursor:
+            cursor.execute(statements.CREATE_AG, {
+                'ag_name': ag_name,
+                'replicas': json.dumps(replicas),
+                'seeding_mode': seeding_mode,
+            })
+            created = cursor.fetchone()[0]
+        if not created:
             logger.info("Availability group already exist.")
-            conn.close()
             return
-        t_sql_replica_nodes = []
-        for node_name, node_info in ready_nodes.items():
-            t_sql_replica_nodes.append("""
-                N'{node_name}'
-                WITH (
-                    ENDPOINT_URL = N'tcp://{node_address}:5022',
-                    AVAILABILITY_MODE = SYNCHRONOUS_COMMIT,
-                    FAILOVER_MODE = EXTERNAL,
-                    SEEDING_MODE = AUTOMATIC
-                    )""".format(node_name=node_name,
-                                node_address=node_info['address']))
-        cursor.execute("""
-        CREATE AVAILABILITY GROUP [{ag_name}]
-            WITH (DB_FAILOVER = ON, CLUSTER_TYPE = EXTERNAL)
-            FOR REPLICA ON {replica_nodes}
-        ALTER AVAILABILITY GROUP [{ag_name}] GRANT CREATE ANY DATABASE
-        """.format(ag_name=ag_name,
-                   replica_nodes=",".join(t_sql_replica_nodes)))
-        conn.close()
         logger.info("Created availability group.")
 
-    def add_replicas(self, ag_name, ready_nodes):
-        conn = self._connection()
-        cursor = conn.cursor()
-        for node_name, node_info in ready_nodes.items():
-            logger.info("Adding node %s as SQL Server replica.", node_name)
-            cursor.execute("""
-            SELECT * FROM sys.dm_hadr_availability_replica_cluster_nodes
-            WHERE group_name = '{ag_name}' and node_name = '{node_name}'
-            """.format(ag_name=ag_name,
-                       node_name=node_name))
-            if cursor.fetchone():
-                logger.info("Node is already a SQL Server replica.")
+    def add_replicas(self, ag_name, ready_nodes, availability_modes={},
+                     seeding_mode='AUTOMATIC'):
+        """Adds the given nodes as AG replicas, with a single round-trip.
+
+        The nodes already part of the AG are skipped. All the other nodes
+        are added, even if some of them fail.
+
+        :param availability_modes: dict with the availability mode of the
+                                   nodes, like for create_ag().
+        :param seeding_mode: seeding mode of the replicas, like for
+                             create_ag().
+        :raises: Exception listing the nodes which couldn't be added.
+        """
+        logger.info("Adding nodes %s as SQL Server replicas.",
+                    ", ".join(sorted(ready_nodes)))
+        replicas = self._replicas_spec(ready_nodes, availability_modes)
+        with self.cursor() as cursor:
+            cursor.execute(statements.ADD_AG_REPLICAS, {
+                'ag_name': ag_name,
+                'replicas': json.dumps(replicas),
+                'seeding_mode': seeding_mode,
+            })
+            rows = cursor.fetchall()
+        errors = []
+        for node_name, error_number, error_message in rows:
+            if error_number is None:
+                logger.info("Added node %s as SQL Server replica.",
+                            node_name)
                 continue
-            cursor.execute("""
-            ALTER AVAILABILITY GROUP [{ag_name}] ADD REPLICA ON '{node_name}'
-                WITH (
-                    ENDPOINT_URL = 'TCP://{node_address}:5022',
-                    AVAILABILITY_MODE = SYNCHRONOUS_COMMIT,
-                    FAILOVER_MODE = EXTERNAL,
-                    SEEDING_MODE = AUTOMATIC
-                    )""".format(ag_name=ag_name,
-                                node_name=node_name,
-                                node_address=node_info['address']))
-        conn.close()
+            logger.error("Failed to add node %s as SQL Server replica "
+                         "(%s): %s", node_name, error_number, error_message)
+            errors.append(node_name)
+        if errors:
+            raise Exception("Failed to add the SQL Server replicas: {}".format(
+                ", ".join(errors)))
         logger.info("Replicas added.")
 
+    def set_availability_modes(self, ag_name, availability_modes):
+        """Changes the availability mode of the existing AG replicas.
+
+        :param availability_modes: dict with the availability mode
+                                   (SYNCHRONOUS_COMMIT or ASYNCHRONOUS_COMMIT)
+                                   of the replicas.
+        """
+        logger.info("Setting the availability modes of the availability "
+                    "group %s replicas: %s", ag_name, availability_modes)
+        replicas = []
+        for node_name, availability_mode in availability_modes.items():
+            replicas.append({
+                'node_name': node_name,
+                'availability_mode': availability_mode,
+            })
+        with self.cursor() as cursor:
+            cursor.execute(statements.SET_AVAILABILITY_MODES, {
+                'ag_name': ag_name,
+                'replicas': json.dumps(replicas),
+            })
+        logger.info("Availability modes set.")
+
+    def set_seeding_mode(self, ag_name, seeding_mode):
+        """Sets the seeding mode (AUTOMATIC or MANUAL) of the AG replicas."""
+        logger.info("Setting the seeding mode of the availability group %s "
+                    "replicas to %s.", ag_name, seeding_mode)
+        with self.cursor() as cursor:
+            cursor.execute(statements.SET_SEEDING_MODE, {
+                'ag_name': ag_name,
+                'seeding_mode': seeding_mode,
+            })
+
+    def set_contained_database_authentication(self, enabled):
+        """Enables or disables the contained database authentication."""
+        logger.info("Setting the contained database authentication to %s.",
+                    enabled)
+        with self.cursor() as cursor:
+            cursor.execute(statements.SET_CONTAINED_DATABASE_AUTHENTICATION,
+                           {'enabled': int(enabled)})
+
+    def get_non_contained_databases(self, db_names):
+        """Returns the given databases which exist and are not contained."""
+        with self.cursor() as cursor:
+            cursor.execute(statements.GET_NON_CONTAINED_DATABASES,
+                           {'db_names': json.dumps(sorted(db_names))})
+            return [row[0] for row in cursor.fetchall()]
+
+    def set_seeding_compression(self, enabled):
+        """Enables or disables the automatic seeding compression."""
+        logger.info("Setting the automatic seeding compression to %s.",
+                    enabled)
+        with self.cursor() as cursor:
+            cursor.execute(statements.SET_SEEDING_COMPRESSION,
+                           {'enabled': enabled})
+
+    def seed_databases(self, ag_name, manual_seeding_dir):
+        """Manually seeds the AG databases missing from this replica.
+
+        The databases are restored from the backups taken by the primary
+        replica, and joined to the AG.
+
+        :returns: list with the names of the seeded databases.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(statements.GET_UNSEEDED_AG_DATABASES,
+                           {'ag_name': ag_name})
+            db_names = [row[0] for row in cursor.fetchall()]
+            for db_name in db_names:
+                logger.info("Seeding database %s from %s.", db_name,
+                            manual_seeding_dir)
+                backup_files, log_backup_file = \
+                    self._manual_seeding_backup_files(
+                        manual_seeding_dir, db_name)
+                cursor.execute(statements.RESTORE_AG_DATABASE, {
+                    'db_name': db_name,
+                    'ag_name': ag_name,
+                    'backup_files': json.dumps(backup_files),
+                    'log_backup_file': log_backup_file,
+                })
+        return db_names
+
+    def get_seeding_progress(self, ag_name):
+        """Returns the seeding progress of the AG databases on this replica.
+
+        :returns: dict with the last automatic seeding of every database,
+                  and the progress of the running seeding operations.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(statements.GET_SEEDING_PROGRESS,
+                           {'ag_name': ag_name})
+            seeding_rows = cursor.fetchall()
+            cursor.nextset()
+            stats_rows = cursor.fetchall()
+        automatic_seeding = {}
+        for db_name, start, end, state, failure in seeding_rows:
+            automatic_seeding[db_name] = {
+                'start_time': str(start),
+                'completion_time': str(end) if end else None,
+                'state': state,
+                'failure': failure,
+            }
+        running = []
+        for row in stats_rows:
+            db_name, remote, role, state, transferred, size, eta = row
+            running.append({
+                'database': db_name,
+                'remote_replica': remote,
+                'role': role,
+                'state': state,
+                'transferred_bytes': transferred,
+                'database_size_bytes': size,
+                'estimated_completion_time': str(eta) if eta else None,
+            })
+        return {
+            'automatic_seeding': automatic_seeding,
+            'running': running,
+        }
+
+    def configure_read_routing(self, ag_name, allow_connections):
+        """Configures the readable secondaries and the read-only routing.
+
+        :param allow_connections: connections allowed to the secondary
+                                  replicas: NO, READ_ONLY or ALL.
+        """
+        logger.info("Configuring the read-only routing of the availability "
+                    "group %s (ALLOW_CONNECTIONS = %s).", ag_name,
+                    allow_connections)
+        with self.cursor() as cursor:
+            cursor.execute(statements.CONFIGURE_READ_ROUTING, {
+                'ag_name': ag_name,
+                'allow_connections': allow_connections,
+            })
+        logger.info("Configured the read-only routing.")
+
     def join_ag(self, ag_name):
         logger.info("Joining availability group %s.", ag_name)
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        IF NOT EXISTS(SELECT * FROM sys.availability_groups WHERE name = '{0}')
-        BEGIN
-            ALTER AVAILABILITY GROUP [{0}] JOIN WITH (CLUSTER_TYPE = EXTERNAL)
-        END
-        ALTER AVAILABILITY GROUP [{0}] GRANT CREATE ANY DATABASE
-        """.format(ag_name))
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(statements.JOIN_AG, {'ag_name': ag_name})
         logger.info("Availability group joined.")
 
     def get_ag_primary_replica(self, ag_name):
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT primary_replica FROM
-            sys.dm_hadr_availability_group_states States
-            INNER JOIN
-            sys.availability_groups Groups
-            ON States.group_id = Groups.group_id
-        WHERE Groups.Name = '{0}'
-        """.format(ag_name))
-        row = cursor.fetchone()
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(statements.GET_AG_PRIMARY_REPLICA,
+                           {'ag_name': ag_name})
+            row = cursor.fetchone()
         return row[0]
 
     def get_ag_replicas(self, ag_name):
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT replica_server_name FROM
-            sys.availability_replicas Replicas
-            INNER JOIN
-            sys.availability_groups Groups
-            ON Replicas.group_id = Groups.group_id
-        WHERE Groups.Name = '{0}'
-        """.format(ag_name))
-        replicas = []
-        for row in cursor:
-            replicas.append(row[0])
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(statements.GET_AG_REPLICAS, {'ag_name': ag_name})
+            replicas = []
+            for row in cursor:
+                replicas.append(row[0])
         return replicas
 
-    def get_sql_login_roles(self, login_name):
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT r.name FROM
-        sys.server_role_members rm
-        INNER JOIN
-        sys.server_principals r ON (r.principal_id = rm.role_principal_id AND
-                                    r.type = 'R')
-        INNER JOIN
-        sys.server_principals m ON m.principal_id = rm.member_principal_id
-        WHERE m.name = '{login_name}'
-        """.format(login_name=login_name))
-        roles = []
-        for row in cursor:
-            roles.append(row[0])
-        conn.close()
-        return roles
+    def get_ag_topology(self, ag_name):
+        """Returns the AG topology, as seen from this SQL Server.
+
+        :returns: dict with the primary replica, the list of replicas and
+                  the known replica states (role and synchronization health),
+                  or None if this SQL Server is not an AG replica.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(statements.GET_AG_TOPOLOGY, {'ag_name': ag_name})
+            rows = cursor.fetchall()
+        if not rows:
+            return None
+        topology = {
+            'primary_replica': rows[0][1],
+            'replicas': [],
+            'replica_states': {},
+        }
+        for replica, _, is_local, role, sync_health in rows:
+            topology['replicas'].append(replica)
+            if role:
+                topology['replica_states'][replica] = {
+                    'is_local': bool(is_local),
+                    'role': role,
+                    'synchronization_health': sync_health,
+                }
+        return topology
+
+    def get_replication_health(self, ag_name):
+        """Returns the replication health of the AG replicas.
+
+        A single query returns the health of all the replicas, aggregated
+        over their databases.
+
+        :returns: dict with the role, synchronization health, worst queue
+                  sizes (KB), redo rate (KB/s) and lag (seconds) of every
+                  replica known by this SQL Server.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(statements.GET_REPLICATION_HEALTH,
+                           {'ag_name': ag_name})
+            rows = cursor.fetchall()
+        health = {}
+        for row in rows:
+            (replica, is_local, role, sync_health, databases,
+             log_send_queue, redo_queue, redo_rate, lag) = row
+            health[replica] = {
+                'is_local': bool(is_local),
+                'role': role,
+                'synchronization_health': sync_health,
+                'databases': databases,
+                'log_send_queue_kb': log_send_queue or 0,
+                'redo_queue_kb': redo_queue or 0,
+                'redo_rate_kb': redo_rate,
+                'lag_seconds': lag or 0,
+            }
+        return health
 
     def get_sql_logins(self):
-        conn = self._connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT name, sid, password_hash FROM sys.sql_logins
-        """)
+        """Returns the SQL logins together with their server roles.
+
+        The logins and the server role memberships are fetched with a single
+        batch, returning two result sets, which are joined client side.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(statements.GET_SQL_LOGINS)
+            login_rows = cursor.fetchall()
+            cursor.nextset()
+            role_rows = cursor.fetchall()
         sql_logins = {}
-        for row in cursor:
+        for row in login_rows:
             sql_logins.update({
                 row[0]: {
                     'sid': row[1].hex(),
                     'password_hash': row[2].hex(),
-                    'roles': self.get_sql_login_roles(login_name=row[0])
+                    'roles': []
                 }
             })
-        conn.close()
+        for login_name, role in role_rows:
+            if login_name in sql_logins:
+                sql_logins[login_name]['roles'].append(role)
         return sql_logins
+
+    def _manual_seeding_backup_files(self, backup_dir, db_name):
+        backup_files = []
+        for i in range(self.MANUAL_SEEDING_BACKUP_STRIPES):
+            backup_files.append(os.path.join(
+                backup_dir, '{}_{}.bak'.format(db_name, i + 1)))
+        log_backup_file = os.path.join(backup_dir, '{}.trn'.format(db_name))
+        return backup_files, log_backup_file
+
+    def _after_execute(self, func, *args):
+        """Calls the function once the executed statements are done.
+
+        The statements are run as soon as they are executed, so the function
+        is called right away. See MSSQLBatch._after_execute().
+        """
+        func(*args)
+
+    def _remove_stale_backup(self, db_name):
+        """Removes the full backup left on the data volume.
+
+        The previous charm versions took the backup needed to add the
+        database to the AG on the data volume, and never removed it. The
+        database name comes from the db consumers, so it must not point the
+        backup path outside the data directory.
+        """
+        data_dir = os.path.realpath(self.MSSQL_DATA_DIR)
+        backup_file = os.path.join(data_dir, '{}.bak'.format(db_name))
+        if ('/' in db_name or '\0' in db_name or
+                os.path.dirname(os.path.realpath(backup_file)) != data_dir):
+            logger.warning("Not removing the stale backup of the database "
+                           "%s, since its path is outside %s.",
+                           db_name, self.MSSQL_DATA_DIR)
+            return
+        if os.path.exists(backup_file):
+            logger.info("Removing the stale backup %s.", backup_file)
+            os.remove(backup_file)
+
+    @staticmethod
+    def _replicas_spec(ready_nodes, availability_modes):
+        replicas = []
+        for node_name, node_info in ready_nodes.items():
+            replicas.append({
+                'node_name': node_name,
+                'node_address': node_info['address'],
+                'availability_mode': availability_modes.get(
+                    node_name, 'SYNCHRONOUS_COMMIT'),
+            })
+        return replicas
+
+
+class _MSSQLBatchCursor(object):
+    """Cursor collecting the executed statements, instead of running them."""
+
+    def __init__(self, batch_statements):
+        self._batch_statements = batch_statements
+
+    def execute(self, t_sql, params=None):
+        self._batch_statements.append((t_sql, params))
+
+    def fetchone(self):
+        raise NotImplementedError(
+            "Operations returning results cannot be batched")
+
+    fetchall = fetchone
+    __iter__ = fetchone
+
+
+class MSSQLBatch(MSSQLDatabaseClient):
+    """DB client collecting the operations into a single batch.
+
+    The collected operations are executed by the originating DB client, when
+    the batch context is exited without errors.
+    """
+
+    def __init__(self, db_client, transaction=True):
+        super().__init__(user=db_client._user,
+                         password=db_client._password,
+                         host=db_client._host,
+                         port=db_client._port)
+        self._db_client = db_client
+        self._transaction = transaction
+        self._batch_statements = []
+        self._after_execute_calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type or not self._batch_statements:
+            return
+        self._db_client.exec_batch(self._batch_statements,
+                                   transaction=self._transaction)
+        for func, args in self._after_execute_calls:
+            func(*args)
+
+    def _after_execute(self, func, *args):
+        """Defers the function call until the batch was executed."""
+        self._after_execute_calls.append((func, args))
+
+    @contextlib.contextmanager
+    def cursor(self):
+        yield _MSSQLBatchCursor(self._batch_statements)
@@ -0,0 +1,792 @@
+"""
+Catalog of the T-SQL statements used by the MSSQL charm DB client.
+
+Every statement which depends on user input is a constant sp_executesql
+call, built once at import time. The parameter values are passed to the
+DB driver, and SQL Server receives them as sp_executesql parameters, so the
+inner statements are parameterized and their plans are reused. Identifiers
+(database, login or availability group names) are quoted server side with
+QUOTENAME before being used in dynamic DDL.
+"""
+
+
+def _literal(value):
+    """Returns the given string as a T-SQL unicode string literal."""
+    return "N'{}'".format(value.replace("'", "''"))
+
+
+def _sp_executesql(statement, params):
+    """Wraps a parameterized statement into a sp_executesql call.
+
+    :param statement: T-SQL statement referencing the parameters as @name.
+    :param params: list of (name, sql_type) tuples.
+    :returns: T-SQL batch with pyformat placeholders for the DB driver.
+    """
+    declarations = ", ".join(
+        "@{} {}".format(name, sql_type) for name, sql_type in params)
+    values = ", ".join(
+        "@{0} = %({0})s".format(name) for name, _ in params)
+    return "EXEC sp_executesql {}, {}, {}".format(
+        _literal(statement).replace("%", "%%"),
+        _literal(declarations),
+        values)
+
+
+def _in_database(statement, params):
+    """Runs a parameterized statement in the context of @db_name."""
+    declarations = ", ".join(
+        "@{} {}".format(name, sql_type) for name, sql_type in params)
+    values = ", ".join(
+        "@{0} = @{0}".format(name) for name, _ in params)
+    return """
+    DECLARE @proc nvarchar(300) = QUOTENAME(@db_name) + N'.sys.sp_executesql'
+    EXEC @proc {}, {}, {}
+    """.format(_literal(statement), _literal(declarations), values)
+
+
+# Wrappers used to run a batch of statements in a transaction, which is
+# rolled back if any of the statements fails.
+BEGIN_BATCH_TRANSACTION = """
+BEGIN TRY
+BEGIN TRANSACTION
+"""
+
+END_BATCH_TRANSACTION = """
+COMMIT TRANSACTION
+END TRY
+BEGIN CATCH
+    IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION;
+    THROW
+END CATCH
+"""
+
+
+def _quote_string(value):
+    """Quotes the given T-SQL value server side, as a string literal.
+
+    Unlike QUOTENAME, this supports values longer than 128 characters.
+    """
+    return "N'''' + REPLACE({}, N'''', N'''''') + N''''".format(value)
+
+
+def _availability_mode(value):
+    """Returns the AVAILABILITY_MODE keyword for the given T-SQL value.
+
+    Anything other than ASYNCHRONOUS_COMMIT means SYNCHRONOUS_COMMIT.
+    """
+    return ("CASE WHEN {} = N'ASYNCHRONOUS_COMMIT' "
+            "THEN N'ASYNCHRONOUS_COMMIT' ELSE N'SYNCHRONOUS_COMMIT' "
+            "END".format(value))
+
+
+def _seeding_mode(value):
+    """Returns the SEEDING_MODE keyword for the given T-SQL value.
+
+    Anything other than MANUAL means AUTOMATIC.
+    """
+    return ("CASE WHEN {} = N'MANUAL' THEN N'MANUAL' "
+            "ELSE N'AUTOMATIC' END".format(value))
+
+
+# Creates the database, if it doesn't exist. If @contained is set, the new
+# database is partially contained, so it can have contained users.
+CREATE_DATABASE = _sp_executesql("""
+IF NOT EXISTS (SELECT * FROM sys.databases WHERE name = @db_name)
+BEGIN
+    DECLARE @sql nvarchar(max) = N'CREATE DATABASE ' + QUOTENAME(@db_name)
+    IF @contained = 1
+        SET @sql = @sql + N' CONTAINMENT = PARTIAL'
+    EXEC (@sql)
+END
+""", [('db_name', 'sysname'), ('contained', 'bit')])
+
+# Adds the database to the AG, with automatic seeding. The full backup is
+# only needed to start the log chain of the database, so it's discarded
+# instead of being written to the data volume. Nothing is done if the
+# database is already in the AG.
+ADD_DATABASE_TO_AG = _sp_executesql("""
+IF NOT EXISTS(
+    SELECT db.name FROM
+        sys.dm_hadr_database_replica_states rs
+        JOIN
+        sys.databases db
+        ON rs.database_id = db.database_id
+    WHERE db.name = @db_name)
+BEGIN
+    DECLARE @db nvarchar(258) = QUOTENAME(@db_name)
+    DECLARE @sql nvarchar(max) =
+        N'ALTER DATABASE ' + @db + N' SET RECOVERY FULL; ' +
+        N'BACKUP DATABASE ' + @db + N' TO DISK = N''/dev/null'''
+    EXEC (@sql)
+    SET @sql = N'ALTER AVAILABILITY GROUP ' + QUOTENAME(@ag_name) +
+               N' ADD DATABASE ' + @db
+    EXEC (@sql)
+END
+""", [('db_name', 'sysname'), ('ag_name', 'sysname')])
+
+# Adds the database to the AG, for manual seeding. The compressed full
+# backup of the database is striped across the given backup files (JSON
+# array of paths), and it is followed by a log backup, so the secondary
+# replicas can restore them before joining the database to the AG.
+ADD_DATABASE_TO_AG_MANUAL_SEEDING = _sp_executesql("""
+IF NOT EXISTS(
+    SELECT db.name FROM
+        sys.dm_hadr_database_replica_states rs
+        JOIN
+        sys.databases db
+        ON rs.database_id = db.database_id
+    WHERE db.name = @db_name)
+BEGIN
+    DECLARE @db nvarchar(258) = QUOTENAME(@db_name)
+    DECLARE @backup_disks nvarchar(max)
+    SELECT @backup_disks = STRING_AGG(
+        CONVERT(nvarchar(max), N'DISK = ' + {backup_file}), N', ')
+    FROM OPENJSON(@backup_files)
+    DECLARE @sql nvarchar(max) =
+        N'ALTER DATABASE ' + @db + N' SET RECOVERY FULL; ' +
+        N'BACKUP DATABASE ' + @db + N' TO ' + @backup_disks +
+        N' WITH COMPRESSION, FORMAT, INIT; ' +
+        N'BACKUP LOG ' + @db + N' TO DISK = ' + {log_backup_file} +
+        N' WITH COMPRESSION, FORMAT, INIT; ' +
+        N'ALTER AVAILABILITY GROUP ' + QUOTENAME(@ag_name) +
+        N' ADD DATABASE ' + @db
+    EXEC (@sql)
+END
+""".format(backup_file=_quote_string('value'),
+           log_backup_file=_quote_string('@log_backup_file')), [
+    ('db_name', 'sysname'),
+    ('ag_name', 'sysname'),
+    ('backup_files', 'nvarchar(max)'),
+    ('log_backup_file', 'nvarchar(4000)')])
+
+CREATE_OR_ALTER_LOGIN = _sp_executesql("""
+DECLARE @sql nvarchar(max)
+DECLARE @password_clause nvarchar(max) = N'PASSWORD = ' + CASE
+    WHEN @is_hashed_password = 1 THEN CONVERT(
+        nvarchar(max), CONVERT(varbinary(256), @password, 2), 1) + N' HASHED'
+    ELSE N'''' + REPLACE(@password, N'''', N'''''') + N''''
+END
+IF EXISTS (SELECT * FROM sys.syslogins WHERE name = @name)
+BEGIN
+    SET @sql = N'ALTER LOGIN ' + QUOTENAME(@name) + N' WITH ' +
+               @password_clause
+END
+ELSE
+BEGIN
+    SET @sql = N'CREATE LOGIN ' + QUOTENAME(@name) + N' WITH ' +
+               @password_clause
+    IF @sid IS NOT NULL
+        SET @sql = @sql + N', SID = ' + CONVERT(
+            nvarchar(max), CONVERT(varbinary(85), @sid, 2), 1)
+END
+SET @sql = @sql + N', CHECK_POLICY = OFF, CHECK_EXPIRATION = OFF'
+EXEC (@sql)
+""", [
+    ('name', 'sysname'),
+    ('password', 'nvarchar(max)'),
+    ('is_hashed_password', 'bit'),
+    ('sid', 'nvarchar(170)')])
+
+ADD_SERVER_ROLE_MEMBER = _sp_executesql("""
+DECLARE @sql nvarchar(max) = N'ALTER SERVER ROLE ' + QUOTENAME(@role) +
+                             N' ADD MEMBER ' + QUOTENAME(@name)
+EXEC (@sql)
+""", [('role', 'sysname'), ('name', 'sysname')])
+
+DROP_LOGIN = _sp_executesql("""
+IF EXISTS (SELECT * FROM sys.syslogins WHERE name = @name)
+BEGIN
+    DECLARE @sql nvarchar(max) = N'DROP LOGIN ' + QUOTENAME(@name)
+    EXEC (@sql)
+END
+""", [('name', 'sysname')])
+
+GRANT_DB_ACCESS = _sp_executesql(_in_database("""
+IF NOT EXISTS(SELECT * FROM sys.sysusers WHERE name = @db_user_name)
+BEGIN
+    DECLARE @sql nvarchar(max) = N'CREATE USER ' + QUOTENAME(@db_user_name) +
+                                 N' FOR LOGIN ' + QUOTENAME(@login_name)
+    EXEC (@sql)
+END
+DECLARE @role_sql nvarchar(max) =
+    N'ALTER ROLE db_owner ADD MEMBER ' + QUOTENAME(@db_user_name)
+EXEC (@role_sql)
+""", [('db_user_name', 'sysname'), ('login_name', 'sysname')]), [
+    ('db_name', 'sysname'),
+    ('db_user_name', 'sysname'),
+    ('login_name', 'sysname')])
+
+REVOKE_DB_ACCESS = _sp_executesql(_in_database("""
+DECLARE @sql nvarchar(max) = N'DROP USER IF EXISTS ' + QUOTENAME(@db_user_name)
+EXEC (@sql)
+""", [('db_user_name', 'sysname')]), [
+    ('db_name', 'sysname'),
+    ('db_user_name', 'sysname')])
+
+# Creates or alters a contained database user, authenticated by the
+# database itself. The user is replicated with the database to the AG
+# secondary replicas, so no SQL login needs to be synced to them.
+CREATE_OR_ALTER_CONTAINED_USER = _sp_executesql(_in_database("""
+DECLARE @sql nvarchar(max)
+DECLARE @password_literal nvarchar(max) =
+    N'''' + REPLACE(@password, N'''', N'''''') + N''''
+IF EXISTS(SELECT * FROM sys.database_principals WHERE name = @db_user_name)
+    SET @sql = N'ALTER USER ' + QUOTENAME(@db_user_name) +
+               N' WITH PASSWORD = ' + @password_literal
+ELSE
+    SET @sql = N'CREATE USER ' + QUOTENAME(@db_user_name) +
+               N' WITH PASSWORD = ' + @password_literal
+EXEC (@sql)
+DECLARE @role_sql nvarchar(max) =
+    N'ALTER ROLE db_owner ADD MEMBER ' + QUOTENAME(@db_user_name)
+EXEC (@role_sql)
+""", [('db_user_name', 'sysname'), ('password', 'nvarchar(max)')]), [
+    ('db_name', 'sysname'),
+    ('db_user_name', 'sysname'),
+    ('password', 'nvarchar(max)')])
+
+CREATE_MASTER_KEY = _sp_executesql("""
+DECLARE @sql nvarchar(max)
+DECLARE @password_literal nvarchar(max) =
+    N'''' + REPLACE(@password, N'''', N'''''') + N''''
+IF NOT EXISTS(SELECT * FROM master.sys.symmetric_keys
+              WHERE name = '##MS_DatabaseMasterKey##')
+BEGIN
+    SET @sql = N'USE [master]; CREATE MASTER KEY ENCRYPTION BY PASSWORD = ' +
+               @password_literal
+END
+ELSE
+BEGIN
+    SET @sql = N'USE [master]; ALTER MASTER KEY REGENERATE ' +
+               N'WITH ENCRYPTION BY PASSWORD = ' + @password_literal
+END
+EXEC (@sql)
+""", [('password', 'nvarchar(128)')])
+
+CREATE_MASTER_CERT = _sp_executesql("""
+DECLARE @sql nvarchar(max) = N'USE [master]; '
+IF NOT EXISTS(SELECT * FROM master.sys.certificates
+              WHERE name = 'dbm_certificate')
+BEGIN
+    SET @sql = @sql +
+        N'CREATE CERTIFICATE dbm_certificate WITH SUBJECT = ''dbm''; '
+END
+SET @sql = @sql +
+    N'BACKUP CERTIFICATE dbm_certificate ' +
+    N'TO FILE = ' + QUOTENAME(@cert_file, N'''') + N' ' +
+    N'WITH PRIVATE KEY (' +
+    N'FILE = ' + QUOTENAME(@cert_key_file, N'''') + N', ' +
+    N'ENCRYPTION BY PASSWORD = ' + QUOTENAME(@password, N'''') + N')'
+EXEC (@sql)
+""", [
+    ('cert_file', 'nvarchar(128)'),
+    ('cert_key_file', 'nvarchar(128)'),
+    ('password', 'nvarchar(128)')])
+
+SETUP_MASTER_CERT = _sp_executesql("""
+IF NOT EXISTS(SELECT * FROM master.sys.certificates
+              WHERE name = 'dbm_certificate')
+BEGIN
+    DECLARE @sql nvarchar(max) =
+        N'USE [master]; CREATE CERTIFICATE dbm_certificate ' +
+        N'FROM FILE = ' + QUOTENAME(@cert_file, N'''') + N' ' +
+        N'WITH PRIVATE KEY (' +
+        N'FILE = ' + QUOTENAME(@cert_key_file, N'''') + N', ' +
+        N'DECRYPTION BY PASSWORD = ' + QUOTENAME(@password, N'''') + N')'
+    EXEC (@sql)
+END
+""", [
+    ('cert_file', 'nvarchar(128)'),
+    ('cert_key_file', 'nvarchar(128)'),
+    ('password', 'nvarchar(128)')])
+
+SETUP_DB_MIRRORING_ENDPOINT = """
+IF NOT EXISTS(SELECT * FROM sys.endpoints WHERE name = 'Hadr_endpoint')
+BEGIN
+    CREATE ENDPOINT [Hadr_endpoint]
+        AS TCP (LISTENER_PORT = 5022)
+        FOR DATABASE_MIRRORING (
+            ROLE = ALL,
+            AUTHENTICATION = CERTIFICATE dbm_certificate,
+            ENCRYPTION = REQUIRED ALGORITHM AES
+            )
+END
+ALTER ENDPOINT [Hadr_endpoint] STATE = STARTED
+"""
+
+# The replicas are given as a JSON array of {"node_name", "node_address",
+# "availability_mode"} objects. Returns a single row telling whether the AG
+# was created.
+CREATE_AG = _sp_executesql("""
+IF EXISTS (SELECT * FROM sys.availability_groups WHERE name = @ag_name)
+BEGIN
+    SELECT CAST(0 AS bit)
+    RETURN
+END
+DECLARE @replica_specs nvarchar(max)
+SELECT @replica_specs = STRING_AGG(CONVERT(nvarchar(max),
+    N'N' + QUOTENAME(node_name, N'''') + N' WITH (' +
+    N'ENDPOINT_URL = N' +
+    QUOTENAME(N'tcp://' + node_address + N':5022', N'''') + N', ' +
+    N'AVAILABILITY_MODE = ' + {availability_mode} + N', ' +
+    N'FAILOVER_MODE = EXTERNAL, ' +
+    N'SEEDING_MODE = ' + {seeding_mode} + N')'), N', ')
+FROM OPENJSON(@replicas)
+    WITH (node_name sysname, node_address nvarchar(255),
+          availability_mode nvarchar(60))
+DECLARE @sql nvarchar(max) =
+    N'CREATE AVAILABILITY GROUP ' + QUOTENAME(@ag_name) + N' ' +
+    N'WITH (DB_FAILOVER = ON, CLUSTER_TYPE = EXTERNAL) ' +
+    N'FOR REPLICA ON ' + @replica_specs + N'; ' +
+    N'ALTER AVAILABILITY GROUP ' + QUOTENAME(@ag_name) +
+    N' GRANT CREATE ANY DATABASE'
+EXEC (@sql)
+SELECT CAST(1 AS bit)
+""".format(availability_mode=_availability_mode('availability_mode'),
+           seeding_mode=_seeding_mode('@seeding_mode')), [
+    ('ag_name', 'sysname'),
+    ('replicas', 'nvarchar(max)'),
+    ('seeding_mode', 'nvarchar(60)')])
+
+# Adds the replicas given as a JSON array of {"node_name", "node_address",
+# "availability_mode"} objects, skipping the ones already part of the AG.
+# Every replica is added by its own ALTER AVAILABILITY GROUP statement, so a
+# failing replica doesn't prevent the others from being added. Returns one
+# row for every replica added, with the error number and message if adding
+# it failed.
+ADD_AG_REPLICAS = _sp_executesql("""
+DECLARE @results TABLE (
+    node_name sysname, error_number int, error_message nvarchar(4000))
+DECLARE @node_name sysname
+DECLARE @node_address nvarchar(255)
+DECLARE @availability_mode nvarchar(60)
+DECLARE @sql nvarchar(max)
+DECLARE replicas_cursor CURSOR LOCAL FAST_FORWARD FOR
+    SELECT j.node_name, j.node_address, j.availability_mode
+    FROM OPENJSON(@replicas)
+        WITH (node_name sysname, node_address nvarchar(255),
+              availability_mode nvarchar(60)) j
+    WHERE NOT EXISTS (
+        SELECT * FROM sys.dm_hadr_availability_replica_cluster_nodes n
+        WHERE n.group_name = @ag_name AND n.node_name = j.node_name)
+OPEN replicas_cursor
+FETCH NEXT FROM replicas_cursor
+    INTO @node_name, @node_address, @availability_mode
+WHILE @@FETCH_STATUS = 0
+BEGIN
+    SET @sql =
+        N'ALTER AVAILABILITY GROUP ' + QUOTENAME(@ag_name) +
+        N' ADD REPLICA ON ' + QUOTENAME(@node_name, N'''') + N' WITH (' +
+        N'ENDPOINT_URL = ' +
+        QUOTENAME(N'TCP://' + @node_address + N':5022', N'''') + N', ' +
+        N'AVAILABILITY_MODE = ' + {availability_mode} + N', ' +
+        N'FAILOVER_MODE = EXTERNAL, ' +
+        N'SEEDING_MODE = ' + {seeding_mode} + N')'
+    BEGIN TRY
+        EXEC (@sql)
+        INSERT INTO @results VALUES (@node_name, NULL, NULL)
+    END TRY
+    BEGIN CATCH
+        INSERT INTO @results VALUES (
+            @node_name, ERROR_NUMBER(), ERROR_MESSAGE())
+    END CATCH
+    FETCH NEXT FROM replicas_cursor
+    INTO @node_name, @node_address, @availability_mode
+END
+CLOSE replicas_cursor
+DEALLOCATE replicas_cursor
+SELECT node_name, error_number, error_message FROM @results
+""".format(availability_mode=_availability_mode('@availability_mode'),
+           seeding_mode=_seeding_mode('@seeding_mode')), [
+    ('ag_name', 'sysname'),
+    ('replicas', 'nvarchar(max)'),
+    ('seeding_mode', 'nvarchar(60)')])
+
+# Configures the Resource Governor pools of the db consumers. Every entry of
+# @pools (JSON array) gets a resource pool and a workload group with the
+# given pool_name, and the classifier function maps the login_name of the
+# entry to its workload group. The sessions of the other logins use the
+# default workload group. The pools no longer listed are kept, but no
+# session is classified into them, so the reconfiguration never fails
+# because of active sessions. The Resource Governor is available only in
+# the Enterprise edition (and its Developer and Evaluation variants), so
+# nothing is done on the other editions. Returns whether it was configured.
+CONFIGURE_RESOURCE_GOVERNOR = _sp_executesql("""
+IF CONVERT(int, SERVERPROPERTY('EngineEdition')) <> 3
+BEGIN
+    SELECT CONVERT(bit, 0)
+    RETURN
+END
+DECLARE @sql nvarchar(max) = N''
+SELECT @sql = @sql +
+    CASE WHEN EXISTS (
+        SELECT * FROM sys.resource_governor_resource_pools
+        WHERE name = p.pool_name)
+    THEN N'ALTER' ELSE N'CREATE' END +
+    N' RESOURCE POOL ' + QUOTENAME(p.pool_name) + N' WITH (' +
+    N'MAX_CPU_PERCENT = ' +
+    CONVERT(nvarchar(10), ISNULL(p.max_cpu_percent, 100)) + N', ' +
+    N'MAX_MEMORY_PERCENT = ' +
+    CONVERT(nvarchar(10), ISNULL(p.max_memory_percent, 100)) + N', ' +
+    N'MAX_IOPS_PER_VOLUME = ' +
+    CONVERT(nvarchar(10), ISNULL(p.max_iops_per_volume, 0)) + N'); ' +
+    CASE WHEN EXISTS (
+        SELECT * FROM sys.resource_governor_workload_groups
+        WHERE name = p.pool_name)
+    THEN N'' ELSE
+        N'CREATE WORKLOAD GROUP ' + QUOTENAME(p.pool_name) +
+        N' USING ' + QUOTENAME(p.pool_name) + N'; '
+    END
+FROM OPENJSON(@pools) WITH (
+    login_name sysname,
+    pool_name sysname,
+    max_cpu_percent int,
+    max_memory_percent int,
+    max_iops_per_volume int) p
+DECLARE @cases nvarchar(max)
+SELECT @cases = STRING_AGG(CONVERT(nvarchar(max),
+    N'WHEN ' + {login_name} + N' THEN ' + {pool_name}), N' ')
+FROM OPENJSON(@pools) WITH (login_name sysname, pool_name sysname)
+DECLARE @classifier nvarchar(max) =
+    N'CREATE OR ALTER FUNCTION dbo.juju_classifier() ' +
+    N'RETURNS sysname WITH SCHEMABINDING AS BEGIN RETURN ' +
+    ISNULL(N'CASE SUSER_SNAME() ' + @cases + N' ELSE N''default'' END',
+           N'N''default''') + N' END'
+ALTER RESOURCE GOVERNOR WITH (CLASSIFIER_FUNCTION = NULL)
+ALTER RESOURCE GOVERNOR RECONFIGURE
+EXEC (@sql)
+EXEC master.sys.sp_executesql @classifier
+EXEC master.sys.sp_executesql
+    N'ALTER RESOURCE GOVERNOR WITH (CLASSIFIER_FUNCTION = dbo.juju_classifier)'
+ALTER RESOURCE GOVERNOR RECONFIGURE
+SELECT CONVERT(bit, 1)
+""".format(login_name=_quote_string('login_name'),
+           pool_name=_quote_string('pool_name')), [
+    ('pools', 'nvarchar(max)')])
+
+# Statements which cannot run inside a user transaction (CREATE DATABASE,
+# ALTER DATABASE SET RECOVERY, BACKUP DATABASE, ALTER AVAILABILITY GROUP and
+# ALTER RESOURCE GOVERNOR).
+NON_TRANSACTIONAL = [
+    CREATE_DATABASE, ADD_DATABASE_TO_AG, ADD_DATABASE_TO_AG_MANUAL_SEEDING,
+    CREATE_AG, ADD_AG_REPLICAS, CONFIGURE_RESOURCE_GOVERNOR]
+
+# Enables or disables the authentication of the contained database users.
+# This is a server option, so it's set on every replica.
+SET_CONTAINED_DATABASE_AUTHENTICATION = _sp_executesql("""
+EXEC sp_configure N'contained database authentication', @enabled
+RECONFIGURE
+""", [('enabled', 'int')])
+
+# Returns the given databases which exist and are not contained, so they
+# cannot have contained users.
+GET_NON_CONTAINED_DATABASES = _sp_executesql("""
+SELECT name FROM sys.databases
+WHERE containment = 0 AND name IN (SELECT value FROM OPENJSON(@db_names))
+""", [('db_names', 'nvarchar(max)')])
+
+# Configures the secondary role connections of every AG replica, with the
+# given ALLOW_CONNECTIONS value (NO, READ_ONLY or ALL), and the read-only
+# routing. The read-intent connections to any replica acting as primary are
+# load balanced across all the other replicas.
+CONFIGURE_READ_ROUTING = _sp_executesql("""
+IF @allow_connections NOT IN (N'NO', N'READ_ONLY', N'ALL')
+    THROW 50000, N'Invalid ALLOW_CONNECTIONS value.', 1
+DECLARE @ag nvarchar(258) = QUOTENAME(@ag_name)
+DECLARE @sql nvarchar(max)
+SELECT @sql = STRING_AGG(CONVERT(nvarchar(max),
+    N'ALTER AVAILABILITY GROUP ' + @ag + N' MODIFY REPLICA ON ' +
+    QUOTENAME(r.replica_server_name, N'''') + N' WITH (SECONDARY_ROLE (' +
+    N'ALLOW_CONNECTIONS = ' + @allow_connections + N', ' +
+    N'READ_ONLY_ROUTING_URL = ' +
+    QUOTENAME(REPLACE(r.endpoint_url, N':5022', N':1433'), N'''') +
+    N')); ' +
+    N'ALTER AVAILABILITY GROUP ' + @ag + N' MODIFY REPLICA ON ' +
+    QUOTENAME(r.replica_server_name, N'''') + N' WITH (PRIMARY_ROLE (' +
+    N'READ_ONLY_ROUTING_LIST = ' +
+    CASE WHEN @allow_connections = N'NO' OR o.routing_list IS NULL
+    THEN N'NONE' ELSE N'((' + o.routing_list + N'))' END + N')); '), N'')
+FROM
+    sys.availability_replicas r
+    INNER JOIN
+    sys.availability_groups g
+    ON r.group_id = g.group_id
+    OUTER APPLY (
+        SELECT STRING_AGG(CONVERT(nvarchar(max),
+            QUOTENAME(other.replica_server_name, N'''')), N', ')
+            AS routing_list
+        FROM sys.availability_replicas other
+        WHERE other.group_id = r.group_id AND
+              other.replica_id <> r.replica_id) o
+WHERE g.name = @ag_name
+EXEC (@sql)
+""", [('ag_name', 'sysname'), ('allow_connections', 'nvarchar(16)')])
+
+# Changes the availability mode of the AG replicas given as a JSON array of
+# {"node_name", "availability_mode"} objects, when it differs from their
+# current availability mode.
+SET_AVAILABILITY_MODES = _sp_executesql("""
+DECLARE @ag nvarchar(258) = QUOTENAME(@ag_name)
+DECLARE @sql nvarchar(max)
+SELECT @sql = STRING_AGG(CONVERT(nvarchar(max),
+    N'ALTER AVAILABILITY GROUP ' + @ag + N' MODIFY REPLICA ON ' +
+    QUOTENAME(r.replica_server_name, N'''') + N' WITH (' +
+    N'AVAILABILITY_MODE = ' + m.mode + N'); '), N'')
+FROM
+    sys.availability_replicas r
+    INNER JOIN
+    sys.availability_groups g
+    ON r.group_id = g.group_id
+    INNER JOIN
+    OPENJSON(@replicas)
+        WITH (node_name sysname, availability_mode nvarchar(60)) j
+    ON j.node_name = r.replica_server_name
+    CROSS APPLY (SELECT {availability_mode} AS mode) m
+WHERE g.name = @ag_name AND r.availability_mode_desc <> m.mode
+EXEC (@sql)
+""".format(availability_mode=_availability_mode('j.availability_mode')), [
+    ('ag_name', 'sysname'),
+    ('replicas', 'nvarchar(max)')])
+
+# Sets the seeding mode (AUTOMATIC or MANUAL) of all the AG replicas.
+SET_SEEDING_MODE = _sp_executesql("""
+DECLARE @mode nvarchar(60) = {seeding_mode}
+DECLARE @ag nvarchar(258) = QUOTENAME(@ag_name)
+DECLARE @sql nvarchar(max)
+SELECT @sql = STRING_AGG(CONVERT(nvarchar(max),
+    N'ALTER AVAILABILITY GROUP ' + @ag + N' MODIFY REPLICA ON ' +
+    QUOTENAME(r.replica_server_name, N'''') + N' WITH (' +
+    N'SEEDING_MODE = ' + @mode + N'); '), N'')
+FROM
+    sys.availability_replicas r
+    INNER JOIN
+    sys.availability_groups g
+    ON r.group_id = g.group_id
+WHERE g.name = @ag_name AND r.seeding_mode_desc <> @mode
+EXEC (@sql)
+""".format(seeding_mode=_seeding_mode('@seeding_mode')), [
+    ('ag_name', 'sysname'),
+    ('seeding_mode', 'nvarchar(60)')])
+
+# Enables or disables the compression of the automatic seeding data streams
+# (trace flag 9567), used when the SQL Server acts as primary replica.
+SET_SEEDING_COMPRESSION = _sp_executesql("""
+IF @enabled = 1
+    DBCC TRACEON (9567, -1)
+ELSE
+    DBCC TRACEOFF (9567, -1)
+""", [('enabled', 'bit')])
+
+# Returns the AG databases which are not seeded yet on the local replica.
+GET_UNSEEDED_AG_DATABASES = _sp_executesql("""
+SELECT Databases.database_name FROM
+    sys.availability_databases_cluster Databases
+    INNER JOIN
+    sys.availability_groups Groups
+    ON Databases.group_id = Groups.group_id
+WHERE Groups.name = @ag_name AND NOT EXISTS (
+    SELECT * FROM sys.dm_hadr_database_replica_states States
+    WHERE States.group_database_id = Databases.group_database_id AND
+          States.is_local = 1)
+""", [('ag_name', 'sysname')])
+
+# Restores the database from the backups taken by the primary replica for
+# manual seeding, and joins it to the AG. It is safe to run it again.
+RESTORE_AG_DATABASE = _sp_executesql("""
+DECLARE @db nvarchar(258) = QUOTENAME(@db_name)
+DECLARE @sql nvarchar(max)
+IF NOT EXISTS (SELECT * FROM sys.databases WHERE name = @db_name)
+BEGIN
+    DECLARE @backup_disks nvarchar(max)
+    SELECT @backup_disks = STRING_AGG(
+        CONVERT(nvarchar(max), N'DISK = ' + {backup_file}), N', ')
+    FROM OPENJSON(@backup_files)
+    SET @sql =
+        N'RESTORE DATABASE ' + @db + N' FROM ' + @backup_disks +
+        N' WITH NORECOVERY; ' +
+        N'RESTORE LOG ' + @db + N' FROM DISK = ' + {log_backup_file} +
+        N' WITH NORECOVERY'
+    EXEC (@sql)
+END
+SET @sql = N'ALTER DATABASE ' + @db + N' SET HADR AVAILABILITY GROUP = ' +
+           QUOTENAME(@ag_name)
+EXEC (@sql)
+""".format(backup_file=_quote_string('value'),
+           log_backup_file=_quote_string('@log_backup_file')), [
+    ('db_name', 'sysname'),
+    ('ag_name', 'sysname'),
+    ('backup_files', 'nvarchar(max)'),
+    ('log_backup_file', 'nvarchar(4000)')])
+
+# Returns two result sets: the last automatic seeding of every AG database
+# on the local replica, and the progress of the running seeding operations.
+GET_SEEDING_PROGRESS = _sp_executesql("""
+SELECT Databases.database_name, Seeding.start_time, Seeding.completion_time,
+       Seeding.current_state, Seeding.failure_state_desc
+FROM
+    sys.dm_hadr_automatic_seeding Seeding
+    INNER JOIN
+    sys.availability_groups Groups
+    ON Seeding.ag_id = Groups.group_id
+    INNER JOIN
+    sys.availability_databases_cluster Databases
+    ON Seeding.ag_db_id = Databases.group_database_id
+WHERE Groups.name = @ag_name AND Seeding.start_time = (
+    SELECT MAX(Last.start_time) FROM sys.dm_hadr_automatic_seeding Last
+    WHERE Last.ag_db_id = Seeding.ag_db_id)
+SELECT Stats.database_name, Stats.remote_machine_name, Stats.role_desc,
+       Stats.internal_state_desc, Stats.transferred_size_bytes,
+       Stats.database_size_bytes, Stats.estimate_time_complete_utc
+FROM sys.dm_hadr_physical_seeding_stats Stats
+WHERE Stats.local_physical_seeding_id IS NOT NULL
+""", [('ag_name', 'sysname')])
+
+JOIN_AG = _sp_executesql("""
+DECLARE @ag nvarchar(258) = QUOTENAME(@ag_name)
+DECLARE @sql nvarchar(max)
+IF NOT EXISTS(SELECT * FROM sys.availability_groups WHERE name = @ag_name)
+BEGIN
+    SET @sql = N'ALTER AVAILABILITY GROUP ' + @ag +
+               N' JOIN WITH (CLUSTER_TYPE = EXTERNAL)'
+    EXEC (@sql)
+END
+SET @sql = N'ALTER AVAILABILITY GROUP ' + @ag + N' GRANT CREATE ANY DATABASE'
+EXEC (@sql)
+""", [('ag_name', 'sysname')])
+
+GET_AG_PRIMARY_REPLICA = _sp_executesql("""
+SELECT primary_replica FROM
+    sys.dm_hadr_availability_group_states States
+    INNER JOIN
+    sys.availability_groups Groups
+    ON States.group_id = Groups.group_id
+WHERE Groups.Name = @ag_name
+""", [('ag_name', 'sysname')])
+
+GET_AG_REPLICAS = _sp_executesql("""
+SELECT replica_server_name FROM
+    sys.availability_replicas Replicas
+    INNER JOIN
+    sys.availability_groups Groups
+    ON Replicas.group_id = Groups.group_id
+WHERE Groups.Name = @ag_name
+""", [('ag_name', 'sysname')])
+
+# Returns one row for every replica of the AG, as seen from the queried
+# SQL Server. The replica states are known only for the local replica, when
+# queried on a secondary replica.
+GET_AG_TOPOLOGY = _sp_executesql("""
+SELECT
+    Replicas.replica_server_name,
+    States.primary_replica,
+    ReplicaStates.is_local,
+    ReplicaStates.role_desc,
+    ReplicaStates.synchronization_health_desc
+FROM
+    sys.availability_groups Groups
+    INNER JOIN
+    sys.availability_replicas Replicas
+    ON Replicas.group_id = Groups.group_id
+    LEFT JOIN
+    sys.dm_hadr_availability_group_states States
+    ON States.group_id = Groups.group_id
+    LEFT JOIN
+    sys.dm_hadr_availability_replica_states ReplicaStates
+    ON ReplicaStates.replica_id = Replicas.replica_id
+WHERE Groups.Name = @ag_name
+""", [('ag_name', 'sysname')])
+
+# Returns the replication health of the AG replicas known by the queried
+# SQL Server, with the worst queue sizes (KB), redo rate (KB/s) and lag of
+# their secondary databases. Only the local replica is known, when queried
+# on a secondary replica.
+GET_REPLICATION_HEALTH = _sp_executesql("""
+SELECT
+    Replicas.replica_server_name,
+    ReplicaStates.is_local,
+    ReplicaStates.role_desc,
+    ReplicaStates.synchronization_health_desc,
+    COUNT(DatabaseStates.database_id),
+    MAX(DatabaseStates.log_send_queue_size),
+    MAX(DatabaseStates.redo_queue_size),
+    MIN(DatabaseStates.redo_rate),
+    MAX(DatabaseStates.secondary_lag_seconds)
+FROM
+    sys.availability_groups Groups
+    INNER JOIN
+    sys.availability_replicas Replicas
+    ON Replicas.group_id = Groups.group_id
+    INNER JOIN
+    sys.dm_hadr_availability_replica_states ReplicaStates
+    ON ReplicaStates.replica_id = Replicas.replica_id
+    LEFT JOIN
+    sys.dm_hadr_database_replica_states DatabaseStates
+    ON DatabaseStates.replica_id = Replicas.replica_id AND
+       DatabaseStates.is_primary_replica = 0
+WHERE Groups.name = @ag_name
+GROUP BY
+    Replicas.replica_server_name,
+    ReplicaStates.is_local,
+    ReplicaStates.role_desc,
+    ReplicaStates.synchronization_health_desc
+""", [('ag_name', 'sysname')])
+
+# Returns two result sets: the SQL logins, and the server role memberships
+# of the SQL logins.
+GET_SQL_LOGINS = """
+SELECT name, sid, password_hash FROM sys.sql_logins
+SELECT m.name, r.name FROM
+    sys.server_role_members rm
+    INNER JOIN
+    sys.server_principals r ON (
+        r.principal_id = rm.role_principal_id AND r.type = 'R')
+    INNER JOIN
+    sys.sql_logins m ON m.principal_id = rm.member_principal_id
+"""
+
+# Creates or alters the SQL logins given as a JSON array of {"name", "sid",
+# "password_hash", "roles"} objects, with the password hash and the SID as
+# hex strings, and adds them to their server roles. The SQL logins given as
+# a JSON array of names are dropped. Everything runs as a single dynamic
+# T-SQL batch, and it is safe to run it again.
+APPLY_LOGINS = _sp_executesql("""
+DECLARE @logins_sql nvarchar(max)
+SELECT @logins_sql = STRING_AGG(CONVERT(nvarchar(max),
+    CASE WHEN EXISTS (SELECT * FROM sys.sql_logins l WHERE l.name = j.name)
+    THEN N'ALTER LOGIN ' + QUOTENAME(j.name) + N' WITH PASSWORD = ' +
+        CONVERT(nvarchar(max), CONVERT(varbinary(256), j.password_hash, 2),
+                1) + N' HASHED'
+    ELSE N'CREATE LOGIN ' + QUOTENAME(j.name) + N' WITH PASSWORD = ' +
+        CONVERT(nvarchar(max), CONVERT(varbinary(256), j.password_hash, 2),
+                1) + N' HASHED, SID = ' +
+        CONVERT(nvarchar(max), CONVERT(varbinary(85), j.sid, 2), 1)
+    END + N', CHECK_POLICY = OFF, CHECK_EXPIRATION = OFF; '), N'')
+FROM OPENJSON(@logins)
+    WITH (name sysname, sid nvarchar(170), password_hash nvarchar(512)) j
+DECLARE @roles_sql nvarchar(max)
+SELECT @roles_sql = STRING_AGG(CONVERT(nvarchar(max),
+    N'ALTER SERVER ROLE ' + QUOTENAME(r.value) +
+    N' ADD MEMBER ' + QUOTENAME(j.name) + N'; '), N'')
+FROM OPENJSON(@logins) WITH (name sysname, roles nvarchar(max) AS JSON) j
+    CROSS APPLY OPENJSON(j.roles) r
+DECLARE @drop_sql nvarchar(max)
+SELECT @drop_sql = STRING_AGG(CONVERT(nvarchar(max),
+    N'DROP LOGIN ' + QUOTENAME(d.value) + N'; '), N'')
+FROM OPENJSON(@dropped) d
+WHERE EXISTS (SELECT * FROM sys.sql_logins l WHERE l.name = d.value)
+DECLARE @sql nvarchar(max) = CONCAT(@logins_sql, @roles_sql, @drop_sql)
+EXEC (@sql)
+""", [('logins', 'nvarchar(max)'), ('dropped', 'nvarchar(max)')])
+
+
+def statement_name(t_sql):
+    """Returns the name of the given statement from the catalog."""
+    return _STATEMENT_NAMES.get(t_sql, 'AD_HOC')
+
+
+# NOTE: This must stay at the end of the module, after all the statements.
+_STATEMENT_NAMES = {
+    value: name for name, value in list(globals().items())
+    if name.isupper() and not name.startswith('_') and
+    isinstance(value, str)
+}
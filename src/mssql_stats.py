@@ -0,0 +1,188 @@
+"""
+SQL instrumentation for the MSSQL charm.
+
+Records the latency and the row counts of the executed statements, and the
+connection open times and retries. The stats of every hook are kept in a
+small ring buffer on disk, used to build the summary returned by the
+get-sql-stats action.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the latency histogram buckets. The last bucket
+# counts everything slower than the last bound.
+HISTOGRAM_BUCKETS = [0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30]
+STATS_FILE_NAME = '.sql-stats.json'
+STATS_MAX_HOOKS = 100
+
+_lock = threading.Lock()
+_slow_query_threshold = None
+_hook_stats = None
+
+
+def _new_hook_stats():
+    return {
+        'connections': {
+            'count': 0,
+            'total_seconds': 0.0,
+            'max_seconds': 0.0,
+            'retries': 0,
+        },
+        'operations': {},
+    }
+
+
+def _new_operation_stats():
+    return {
+        'count': 0,
+        'total_seconds': 0.0,
+        'max_seconds': 0.0,
+        'rows': 0,
+        'histogram': [0] * (len(HISTOGRAM_BUCKETS) + 1),
+    }
+
+
+def _bucket_index(seconds):
+    for i, upper_bound in enumerate(HISTOGRAM_BUCKETS):
+        if seconds <= upper_bound:
+            return i
+    return len(HISTOGRAM_BUCKETS)
+
+
+def _get_hook_stats():
+    global _hook_stats
+    if _hook_stats is None:
+        _hook_stats = _new_hook_stats()
+    return _hook_stats
+
+
+def configure(slow_query_threshold=None):
+    """Configures the instrumentation.
+
+    :param slow_query_threshold: statements slower than this number of
+                                 seconds are logged. Disabled if not set.
+    """
+    global _slow_query_threshold
+    _slow_query_threshold = slow_query_threshold
+
+
+def record_connection(host, seconds, attempts):
+    with _lock:
+        stats = _get_hook_stats()['connections']
+        stats['count'] += 1
+        stats['total_seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+        stats['retries'] += attempts - 1
+    logger.debug("Connected to SQL Server %s in %.3f seconds "
+                 "(%d attempts).", host, seconds, attempts)
+
+
+def record_operation(name, seconds, rows=0):
+    with _lock:
+        operations = _get_hook_stats()['operations']
+        stats = operations.setdefault(name, _new_operation_stats())
+        stats['count'] += 1
+        stats['total_seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+        stats['rows'] += rows
+        stats['histogram'][_bucket_index(seconds)] += 1
+    if _slow_query_threshold and seconds >= _slow_query_threshold:
+        logger.warning("Slow SQL statement %s took %.3f seconds.",
+                       name, seconds)
+
+
+def record_rows(name, rows):
+    with _lock:
+        operations = _get_hook_stats()['operations']
+        operations.setdefault(name, _new_operation_stats())['rows'] += rows
+
+
+def stats_file_path():
+    return os.path.join(os.environ.get('JUJU_CHARM_DIR', os.getcwd()),
+                        STATS_FILE_NAME)
+
+
+def _load_records(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def flush(hook_name):
+    """Appends the current hook stats to the on-disk ring buffer."""
+    global _hook_stats
+    with _lock:
+        hook_stats = _hook_stats
+        _hook_stats = None
+    if not hook_stats:
+        return
+    hook_stats.update({'hook': hook_name, 'timestamp': time.time()})
+    path = stats_file_path()
+    records = _load_records(path)
+    records.append(hook_stats)
+    records = records[-STATS_MAX_HOOKS:]
+    tmp_path = '{}.tmp'.format(path)
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(records, f)
+        os.replace(tmp_path, path)
+    except OSError as ex:
+        logger.warning("Failed to save the SQL stats: %s", ex)
+
+
+def _percentile(histogram, percentile):
+    total = sum(histogram)
+    if not total:
+        return None
+    threshold = total * percentile / 100.0
+    count = 0
+    for i, bucket_count in enumerate(histogram):
+        count += bucket_count
+        if count >= threshold:
+            if i < len(HISTOGRAM_BUCKETS):
+                return HISTOGRAM_BUCKETS[i]
+            return '>{}'.format(HISTOGRAM_BUCKETS[-1])
+
+
+def summary():
+    """Returns the SQL stats aggregated over the recorded hooks."""
+    records = _load_records(stats_file_path())
+    connections = {
+        'count': 0,
+        'total_seconds': 0.0,
+        'max_seconds': 0.0,
+        'retries': 0,
+    }
+    operations = {}
+    for record in records:
+        for key in ['count', 'total_seconds', 'retries']:
+            connections[key] += record['connections'][key]
+        connections['max_seconds'] = max(
+            connections['max_seconds'], record['connections']['max_seconds'])
+        for name, op_stats in record['operations'].items():
+            stats = operations.setdefault(name, _new_operation_stats())
+            for key in ['count', 'total_seconds', 'rows']:
+                stats[key] += op_stats[key]
+            stats['max_seconds'] = max(
+                stats['max_seconds'], op_stats['max_seconds'])
+            stats['histogram'] = [
+                a + b for a, b in zip(stats['histogram'],
+                                      op_stats['histogram'])]
+    for stats in operations.values():
+        stats['avg_seconds'] = stats['total_seconds'] / stats['count']
+        stats['p50_seconds'] = _percentile(stats['histogram'], 50)
+        stats['p95_seconds'] = _percentile(stats['histogram'], 95)
+    return {
+        'hooks': len(records),
+        'histogram_buckets': HISTOGRAM_BUCKETS,
+        'connections': connections,
+        'operations': operations,
+    }
@@ -4,9 +4,14 @@ Utilities needed for the charm implementation
 
 import logging
 import functools
+import os
+import shutil
+import threading
 import traceback
 import time
 
+from concurrent import futures
+
 from python_hosts import Hosts, HostsEntry
 
 logger = logging.getLogger(__name__)
@@ -44,8 +49,118 @@ def retry_on_error(max_attempts=30, sleep_seconds=5, terminal_exceptions=[]):
     return _retry_on_error
 
 
-def append_hosts_entry(address, names):
-    new_entry = HostsEntry(entry_type='ipv4', address=address, names=names)
-    my_hosts = Hosts()
-    my_hosts.add([new_entry])
-    my_hosts.write()
+def run_concurrently(func, items, timeout=None, max_workers=8):
+    """Runs func(item) for every item, in parallel threads.
+
+    :param func: callable receiving a single item.
+    :param items: iterable with the items.
+    :param timeout: seconds to wait for all the calls to finish.
+    :param max_workers: maximum number of parallel threads.
+    :returns: dict mapping every item to a (result, exception) tuple. The
+              items whose calls didn't finish within the timeout get a
+              TimeoutError exception.
+    """
+    items = list(items)
+    results = {}
+    if not items:
+        return results
+    executor = futures.ThreadPoolExecutor(
+        max_workers=min(max_workers, len(items)))
+    pending = {executor.submit(func, item): item for item in items}
+    done, not_done = futures.wait(pending, timeout=timeout)
+    for future in done:
+        ex = future.exception()
+        if ex:
+            results[pending[future]] = (None, ex)
+        else:
+            results[pending[future]] = (future.result(), None)
+    for future in not_done:
+        future.cancel()
+        results[pending[future]] = (None, TimeoutError(
+            "Call didn't finish within {} seconds".format(timeout)))
+    executor.shutdown(wait=False)
+    return results
+
+
+class HostsManager(object):
+    """Manages /etc/hosts entries, coalescing the changes done in a hook.
+
+    The entries set or removed are kept in memory, and they are applied with
+    a single atomic write when flush() is called. The hosts file is not
+    written at all, if its content doesn't change.
+
+    The entries written by the charm are marked with an inline comment, and
+    only the marked entries are ever replaced or removed. The other entries
+    of the hosts file are kept, even if they have the same names.
+    """
+
+    HOSTS_PATH = '/etc/hosts'
+    MANAGED_ENTRY_COMMENT = 'juju-mssql'
+
+    def __init__(self, path=None):
+        self._path = path or self.HOSTS_PATH
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def set_entry(self, address, names):
+        self._pending[tuple(names)] = address
+
+    def remove_entry(self, names):
+        self._pending[tuple(names)] = None
+
+    def flush(self):
+        """Writes the pending changes to the hosts file.
+
+        :returns: boolean telling whether the hosts file was changed.
+        """
+        with self._lock:
+            return self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return False
+        pending = self._pending
+        self._pending = {}
+        with open(self._path) as f:
+            old_content = f.read()
+        hosts = Hosts(path=self._path)
+        for names, address in pending.items():
+            new_entry = None
+            if address:
+                new_entry = HostsEntry(
+                    entry_type='ipv4', address=address, names=list(names),
+                    comment=self.MANAGED_ENTRY_COMMENT)
+            entries = []
+            for entry in hosts.entries:
+                if not self._is_managed_entry(entry, names):
+                    entries.append(entry)
+                elif new_entry:
+                    # The managed entry is replaced in place.
+                    entries.append(new_entry)
+                    new_entry = None
+            if new_entry:
+                entries.append(new_entry)
+            hosts.entries = entries
+        tmp_path = '{}.tmp'.format(self._path)
+        hosts.write(path=tmp_path)
+        with open(tmp_path) as f:
+            new_content = f.read()
+        if new_content == old_content:
+            os.remove(tmp_path)
+            return False
+        logger.info("Updating the hosts file %s.", self._path)
+        shutil.copymode(self._path, tmp_path)
+        try:
+            os.replace(tmp_path, self._path)
+        except OSError:
+            # The hosts file may be a bind mount, which cannot be replaced.
+            os.remove(tmp_path)
+            with open(self._path, 'w') as f:
+                f.write(new_content)
+        return True
+
+    def _is_managed_entry(self, entry, names):
+        """Tells whether the entry was written by the charm for the names."""
+        return (entry.comment == self.MANAGED_ENTRY_COMMENT and
+                entry.entry_type in ('ipv4', 'ipv6') and
+                bool(set(entry.names) & set(names)))
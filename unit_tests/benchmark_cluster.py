@@ -0,0 +1,309 @@
+"""
+Cluster convergence benchmark for the MSSQL charm.
+
+Every unit of the simulated deployment runs the real charm code in its own
+ops Harness, on top of the fake SQL Server backend. The peer relation data
+written by a unit is delivered to the other units as relation-changed hooks,
+similar to what Juju does, until no more hooks are pending.
+
+The hooks of a unit run sequentially, while the units run in parallel. Every
+hook lasts a fixed dispatch overhead, plus the simulated latency of its SQL
+round-trips and the sleeps done by the charm. The reported wall time is the
+simulated time when the last unit reported it is ready.
+
+Run it with::
+
+    PYTHONPATH=src python3 -m unit_tests.benchmark_cluster 3 5 9
+"""
+
+import contextlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from unittest import mock
+
+from ops.testing import Harness
+
+import charm
+import interface_hacluster
+import interface_mssql_cluster
+import mssql_db_client
+
+from unit_tests import fake_mssql
+
+APP_NAME = 'mssql'
+RELATION_NAME = 'cluster'
+UNIT_READY_STATUS = interface_mssql_cluster.MssqlCluster.UNIT_ACTIVE_STATUS
+
+
+class HookError(Exception):
+    pass
+
+
+class _Unit(object):
+
+    def __init__(self, index, address, node_name):
+        self.index = index
+        self.name = '{}/{}'.format(APP_NAME, index)
+        self.address = address
+        self.node_name = node_name
+        self.harness = Harness(charm.MSSQLCharm)
+        self.relation_id = None
+        self.clock = 0.0
+        self.hooks = 0
+        self.ready_time = None
+        self.published_unit_data = {}
+        self.published_app_data = {}
+
+    def alias(self, unit):
+        """Returns the name of the given unit, as seen by this unit.
+
+        The Harness local unit is always '<app>/0', so the remote units are
+        renamed to avoid clashes with it.
+        """
+        if unit is self:
+            return '{}/0'.format(APP_NAME)
+        if unit.index < self.index:
+            return '{}/{}'.format(APP_NAME, unit.index + 1)
+        return unit.name
+
+    @property
+    def unit_data(self):
+        return dict(self.harness.get_relation_data(
+            self.relation_id, self.alias(self)))
+
+    @property
+    def app_data(self):
+        return dict(self.harness.get_relation_data(
+            self.relation_id, APP_NAME))
+
+
+class ClusterSimulator(object):
+    """Drives an N-unit deployment of the charm until it converges."""
+
+    HOOK_OVERHEAD = 1.0
+
+    def __init__(self, num_units, latency=0.005, connect_latency=0.05,
+                 hook_overhead=None):
+        self.backend = fake_mssql.FakeMSSQLBackend(
+            latency=latency, connect_latency=connect_latency)
+        self.hook_overhead = hook_overhead
+        if self.hook_overhead is None:
+            self.hook_overhead = self.HOOK_OVERHEAD
+        self.units = [
+            _Unit(i, '10.0.0.{}'.format(10 + i), 'mssql-{}'.format(i))
+            for i in range(num_units)
+        ]
+        self._queue = []
+        self._seq = 0
+        self._sleep_time = 0.0
+        self._tmp_dir = None
+        self._current = None
+
+    @contextlib.contextmanager
+    def _patched_environment(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        try:
+            with contextlib.ExitStack() as stack:
+                for patcher in self._get_patchers():
+                    stack.enter_context(patcher)
+                stack.enter_context(self.backend.patch())
+                yield
+        finally:
+            shutil.rmtree(self._tmp_dir)
+            for unit in self.units:
+                unit.harness.cleanup()
+
+    def _get_patchers(self):
+        fake_charm_subprocess = mock.MagicMock()
+        fake_charm_subprocess.check_call.side_effect = self._mssql_conf_setup
+        return [
+            mock.patch.dict(os.environ, {'JUJU_CHARM_DIR': self._tmp_dir}),
+            mock.patch.object(charm, 'urlopen'),
+            mock.patch.object(charm, 'add_source'),
+            mock.patch.object(charm, 'apt_update'),
+            mock.patch.object(charm, 'apt_install'),
+            mock.patch.object(charm, 'service'),
+            mock.patch.object(charm, 'subprocess', fake_charm_subprocess),
+            mock.patch.object(interface_mssql_cluster, 'HostsManager'),
+            mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                              'node_name', new_callable=mock.PropertyMock,
+                              side_effect=lambda: self._current.node_name),
+            mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                              'bind_address', new_callable=mock.PropertyMock,
+                              side_effect=lambda: self._current.address),
+            mock.patch.object(interface_hacluster.HaCluster,
+                              'PACEMAKER_LOGIN_CREDS_FILE',
+                              os.path.join(self._tmp_dir, 'passwd')),
+            mock.patch.object(mssql_db_client.MSSQLDatabaseClient,
+                              'MSSQL_DATA_DIR', self._tmp_dir),
+            mock.patch.object(mssql_db_client, 'pwd'),
+            mock.patch.object(mssql_db_client, 'grp'),
+            mock.patch.object(os, 'chown'),
+            mock.patch.object(mssql_db_client.time, 'sleep', self._sleep),
+        ]
+
+    def _mssql_conf_setup(self, args, env):
+        self.backend.add_server(self._current.address,
+                                self._current.node_name,
+                                env['MSSQL_SA_PASSWORD'])
+
+    def _sleep(self, seconds):
+        self._sleep_time += seconds
+
+    def _enqueue(self, unit, hook, source=None, time=0.0):
+        for event in self._queue:
+            if event[2:] == (unit, hook, source):
+                return
+        self._queue.append((time, self._seq, unit, hook, source))
+        self._seq += 1
+
+    def _next_event(self):
+        event = min(self._queue, key=lambda e: (max(e[0], e[2].clock), e[1]))
+        self._queue.remove(event)
+        return event
+
+    def _setup_units(self):
+        for unit in self.units:
+            harness = unit.harness
+            harness.update_config({'accept-eula': True})
+            unit.relation_id = harness.add_relation(RELATION_NAME, APP_NAME)
+            if unit.index == 0:
+                harness.set_leader(True)
+            harness.begin()
+            self._enqueue(unit, 'install')
+            if unit.index == 0:
+                self._enqueue(unit, 'leader-elected')
+            self._enqueue(unit, 'config-changed')
+            self._enqueue(unit, 'start')
+            for remote_unit in self.units:
+                if remote_unit is not unit:
+                    self._enqueue(unit, 'relation-joined', remote_unit)
+            for remote_unit in self.units:
+                if remote_unit is not unit:
+                    self._enqueue(unit, 'relation-changed', remote_unit)
+
+    def _emit(self, unit, hook, source):
+        harness = unit.harness
+        if hook == 'install':
+            harness.charm.on.install.emit()
+        elif hook == 'leader-elected':
+            harness.charm.on.leader_elected.emit()
+        elif hook == 'config-changed':
+            harness.charm.on.config_changed.emit()
+        elif hook == 'start':
+            harness.charm.on.start.emit()
+        elif hook == 'relation-joined':
+            harness.add_relation_unit(unit.relation_id, unit.alias(source))
+        elif source == APP_NAME:
+            harness.update_relation_data(
+                unit.relation_id, APP_NAME, source_data(
+                    harness.get_relation_data(unit.relation_id, APP_NAME),
+                    self.units[0].app_data))
+        else:
+            harness.update_relation_data(
+                unit.relation_id, unit.alias(source), source_data(
+                    harness.get_relation_data(
+                        unit.relation_id, unit.alias(source)),
+                    source.unit_data))
+
+    def _dispatch(self, event):
+        time, _, unit, hook, source = event
+        self._current = unit
+        self.backend.local_host = unit.address
+        start_clock = self.backend.clock
+        self._sleep_time = 0.0
+        try:
+            self._emit(unit, hook, source)
+            unit.harness.framework.commit()
+        except Exception as ex:
+            raise HookError("Hook {} failed on unit {}: {}".format(
+                hook, unit.name, ex)) from ex
+        duration = (self.hook_overhead + self._sleep_time +
+                    self.backend.clock - start_clock)
+        unit.clock = max(time, unit.clock) + duration
+        unit.hooks += 1
+        if (unit.ready_time is None and
+                unit.harness.charm.unit.status == UNIT_READY_STATUS):
+            unit.ready_time = unit.clock
+        self._publish_changes(unit)
+
+    def _publish_changes(self, unit):
+        unit_data = unit.unit_data
+        if unit_data != unit.published_unit_data:
+            unit.published_unit_data = unit_data
+            for remote_unit in self.units:
+                if remote_unit is not unit:
+                    self._enqueue(remote_unit, 'relation-changed', unit,
+                                  unit.clock)
+        if not unit.harness.charm.unit.is_leader():
+            return
+        app_data = unit.app_data
+        if app_data != unit.published_app_data:
+            unit.published_app_data = app_data
+            for remote_unit in self.units:
+                if remote_unit is not unit:
+                    self._enqueue(remote_unit, 'relation-changed', APP_NAME,
+                                  unit.clock)
+
+    def run(self, max_hooks=10000):
+        """Runs the deployment until no more hooks are pending.
+
+        :returns: dict with the benchmark results.
+        """
+        with self._patched_environment():
+            self._setup_units()
+            self.backend.reset_counters()
+            hooks = 0
+            while self._queue:
+                if hooks >= max_hooks:
+                    raise HookError(
+                        "The cluster didn't converge after {} hooks".format(
+                            hooks))
+                self._dispatch(self._next_event())
+                hooks += 1
+            return self.results()
+
+    def results(self):
+        ready_times = [unit.ready_time for unit in self.units]
+        converged = all(t is not None for t in ready_times)
+        return {
+            'units': len(self.units),
+            'converged': converged,
+            'hooks': sum(unit.hooks for unit in self.units),
+            'round_trips': self.backend.round_trips,
+            'connections': self.backend.connections,
+            'wall_time': max(ready_times) if converged else None,
+        }
+
+
+def source_data(current_data, new_data):
+    """Returns the relation data update turning current_data into new_data.
+
+    Keys missing from new_data are removed, by setting them to ''.
+    """
+    data = {key: '' for key in current_data if key not in new_data}
+    data.update(new_data)
+    return data
+
+
+def main(args):
+    logging.basicConfig(level=logging.ERROR)
+    unit_counts = [int(arg) for arg in args] or [3, 5, 9]
+    print('{:>5} {:>9} {:>6} {:>11} {:>11} {:>13}'.format(
+        'units', 'converged', 'hooks', 'round-trips', 'connections',
+        'wall-time (s)'))
+    for num_units in unit_counts:
+        results = ClusterSimulator(num_units).run()
+        wall_time = results['wall_time']
+        print('{:>5} {:>9} {:>6} {:>11} {:>11} {:>13}'.format(
+            results['units'], str(results['converged']), results['hooks'],
+            results['round_trips'], results['connections'],
+            '-' if wall_time is None else '{:.2f}'.format(wall_time)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
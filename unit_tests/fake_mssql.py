@@ -0,0 +1,804 @@
+"""
+In-memory fake SQL Server backend, used to exercise the charm DB client
+without a real SQL Server.
+
+The fake plugs in behind the 'connect' function imported by mssql_db_client,
+and it understands the statements from the mssql_statements catalog, either
+executed one by one or as batches. It emulates the server state queried by
+the charm (databases, SQL logins, availability groups and their replicas),
+and it counts the connections and the round-trips done by the charm.
+
+Usage::
+
+    backend = FakeMSSQLBackend(latency=0.005)
+    backend.add_server('10.0.0.10', 'node-1', sa_password='pass')
+    with backend.patch():
+        ...
+
+Every round-trip and every login advance the simulated clock by the
+configured latency. The clock is the sum of all the latencies, so it is an
+upper bound of the time spent in SQL calls made in parallel.
+"""
+
+import contextlib
+import copy
+import hashlib
+import json
+import re
+import threading
+import time
+
+from unittest import mock
+
+import mssql_db_client
+import mssql_statements as statements
+
+_PLACEHOLDER_REGEX = re.compile(r'%\\\((\w+)\\\)s')
+_BATCH_INDEX_REGEX = re.compile(r'%\(s(\d+)_\w+\)s')
+# Ad-hoc T-SQL sent by the hacluster interface.
+_GRANT_AG_PERMISSIONS_REGEX = re.compile(
+    r'GRANT ALTER, CONTROL, VIEW DEFINITION\s+'
+    r'ON AVAILABILITY GROUP::\[(?P<ag_name>[^\]]+)\] '
+    r'TO \[(?P<name>[^\]]+)\]\s+'
+    r'GRANT VIEW SERVER STATE TO \[[^\]]+\]')
+
+
+class FakeMSSQLError(Exception):
+    """Error raised like the pymssql ones: ((number, message),)."""
+
+    def __init__(self, number, message):
+        super().__init__((number, message.encode()))
+        self.number = number
+        self.message = message
+
+
+def _availability_mode(replica):
+    if replica.get('availability_mode') == 'ASYNCHRONOUS_COMMIT':
+        return 'ASYNCHRONOUS_COMMIT'
+    return 'SYNCHRONOUS_COMMIT'
+
+
+def _seeding_mode(params):
+    if params.get('seeding_mode') == 'MANUAL':
+        return 'MANUAL'
+    return 'AUTOMATIC'
+
+
+def _statement_regex(t_sql):
+    # The batched statements have their placeholders renamed from
+    # %(name)s to %(s<index>_name)s, so match both forms.
+    return re.compile(_PLACEHOLDER_REGEX.sub(
+        r'%\\((?:s\\d+_)?\1\\)s', re.escape(t_sql.strip())))
+
+
+class FakeMSSQLServer(object):
+    """State of a single fake SQL Server instance."""
+
+    def __init__(self, backend, host, node_name, sa_password):
+        self.backend = backend
+        self.host = host
+        self.node_name = node_name
+        self.running = True
+        self.state = {
+            'databases': {},
+            'logins': {},
+            'master_key': False,
+            'master_cert': False,
+            'endpoint': False,
+            'trace_flags': set(),
+            'contained_database_authentication': False,
+            'resource_pools': {},
+            'classifier': {},
+            # SERVERPROPERTY('EngineEdition'), 3 meaning Enterprise.
+            'engine_edition': 3,
+        }
+        self.connections = 0
+        self.round_trips = 0
+        self.set_login('sa', sa_password, roles=['sysadmin'])
+
+    @property
+    def databases(self):
+        return self.state['databases']
+
+    @property
+    def logins(self):
+        return self.state['logins']
+
+    def set_login(self, name, password, is_hashed_password=False, sid=None,
+                  roles=None):
+        if is_hashed_password:
+            password_hash = bytes.fromhex(password)
+        else:
+            password_hash = b'\x02\x00' + hashlib.sha256(
+                password.encode()).digest()
+        login = self.logins.get(name)
+        if login:
+            login['password_hash'] = password_hash
+            return
+        if sid:
+            sid = bytes.fromhex(sid)
+        else:
+            sid = hashlib.md5(
+                '{}:{}'.format(self.host, name).encode()).digest()
+        self.logins[name] = {
+            'sid': sid,
+            'password_hash': password_hash,
+            'roles': list(roles or []),
+        }
+
+    def authenticate(self, user, password):
+        login = self.logins.get(user.lower()) or self.logins.get(user)
+        expected_hash = b'\x02\x00' + hashlib.sha256(
+            password.encode()).digest()
+        if not login or login['password_hash'] != expected_hash:
+            raise FakeMSSQLError(
+                18456, "Login failed for user '{}'.".format(user))
+
+    @property
+    def ag(self):
+        """Returns the AG joined by this server, if any."""
+        for ag in self.backend.availability_groups.values():
+            replica = ag['replicas'].get(self.node_name)
+            if replica and replica['joined']:
+                return ag
+        return None
+
+
+class FakeMSSQLCursor(object):
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._result_sets = []
+        self._rows = []
+
+    def execute(self, t_sql, params=None):
+        self._result_sets = self._connection.backend.execute(
+            self._connection.server, t_sql, params)
+        self.nextset()
+
+    def nextset(self):
+        if not self._result_sets:
+            self._rows = []
+            return None
+        self._rows = list(self._result_sets.pop(0))
+        return True
+
+    def fetchone(self):
+        if not self._rows:
+            return None
+        return self._rows.pop(0)
+
+    def fetchall(self):
+        rows = self._rows
+        self._rows = []
+        return rows
+
+    def __iter__(self):
+        while self._rows:
+            yield self._rows.pop(0)
+
+    def close(self):
+        pass
+
+
+class FakeMSSQLConnection(object):
+
+    def __init__(self, backend, server):
+        self.backend = backend
+        self.server = server
+        self.closed = False
+
+    def autocommit(self, status):
+        pass
+
+    def cursor(self):
+        if self.closed:
+            raise FakeMSSQLError(20047, "DBPROCESS is dead or not enabled")
+        return FakeMSSQLCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeMSSQLBackend(object):
+    """Registry of fake SQL Servers, keyed by their host address."""
+
+    def __init__(self, latency=0.0, connect_latency=0.0, sleep=False):
+        """Creates the fake backend.
+
+        :param latency: seconds added to the clock for every round-trip.
+        :param connect_latency: seconds added to the clock for every login.
+        :param sleep: whether to actually sleep for the injected latency.
+        """
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.sleep = sleep
+        self.clock = 0.0
+        self.servers = {}
+        self.availability_groups = {}
+        # Backup files taken for the manual seeding, shared by all the
+        # servers.
+        self.backups = {}
+        self.executed = []
+        # Host of the server reached through 'localhost'.
+        self.local_host = None
+        self._lock = threading.RLock()
+        self._handlers = [
+            (_statement_regex(t_sql), handler)
+            for t_sql, handler in self._get_handlers()
+        ]
+        self._handlers.append(
+            (_GRANT_AG_PERMISSIONS_REGEX, self._grant_ag_permissions))
+
+    def add_server(self, host, node_name, sa_password):
+        server = FakeMSSQLServer(self, host, node_name, sa_password)
+        self.servers[host] = server
+        if not self.local_host:
+            self.local_host = host
+        return server
+
+    @property
+    def connections(self):
+        return sum(s.connections for s in self.servers.values())
+
+    @property
+    def round_trips(self):
+        return sum(s.round_trips for s in self.servers.values())
+
+    def reset_counters(self):
+        with self._lock:
+            self.clock = 0.0
+            self.executed = []
+            for server in self.servers.values():
+                server.connections = 0
+                server.round_trips = 0
+
+    def _advance_clock(self, seconds):
+        with self._lock:
+            self.clock += seconds
+        if self.sleep and seconds:
+            time.sleep(seconds)
+
+    def _get_server(self, host):
+        if host == 'localhost':
+            host = self.local_host
+        server = self.servers.get(host)
+        if not server:
+            # Node names are resolved like the hosts entries added by the
+            # charm.
+            for node_server in self.servers.values():
+                if node_server.node_name == host:
+                    server = node_server
+        if not server or not server.running:
+            raise FakeMSSQLError(
+                20009, "Unable to connect: Adaptive Server is unavailable "
+                       "or does not exist ({})".format(host))
+        return server
+
+    def is_port_open(self, host, port, timeout):
+        try:
+            self._get_server(host)
+        except FakeMSSQLError:
+            return False
+        return True
+
+    def connect(self, server, port, user, password, login_timeout=60):
+        self._advance_clock(self.connect_latency)
+        with self._lock:
+            mssql_server = self._get_server(server)
+            mssql_server.authenticate(user, password)
+            mssql_server.connections += 1
+        return FakeMSSQLConnection(self, mssql_server)
+
+    @contextlib.contextmanager
+    def patch(self):
+        """Plugs the fake backend into mssql_db_client."""
+        with mock.patch.object(mssql_db_client, 'connect', self.connect), \
+                mock.patch.object(mssql_db_client, '_is_port_open',
+                                  self.is_port_open):
+            try:
+                yield self
+            finally:
+                mssql_db_client.close_connections()
+
+    def execute(self, server, t_sql, params):
+        """Executes a single round-trip, returning its result sets."""
+        self._advance_clock(self.latency)
+        with self._lock:
+            server.round_trips += 1
+            return self._execute(server, t_sql, params or {})
+
+    def _execute(self, server, t_sql, params):
+        result_sets = []
+        pos = 0
+        snapshot = None
+        try:
+            while True:
+                while pos < len(t_sql) and t_sql[pos].isspace():
+                    pos += 1
+                if pos == len(t_sql):
+                    break
+                if t_sql.startswith(
+                        statements.BEGIN_BATCH_TRANSACTION.strip(), pos):
+                    snapshot = self._snapshot(server)
+                    pos += len(statements.BEGIN_BATCH_TRANSACTION.strip())
+                    continue
+                if t_sql.startswith(
+                        statements.END_BATCH_TRANSACTION.strip(), pos):
+                    snapshot = None
+                    pos += len(statements.END_BATCH_TRANSACTION.strip())
+                    continue
+                if t_sql.startswith('SELECT 1', pos):
+                    result_sets.append([(1,)])
+                    pos += len('SELECT 1')
+                    continue
+                pos = self._execute_statement(
+                    server, t_sql, pos, params, result_sets)
+        except Exception:
+            if snapshot:
+                self._restore(server, snapshot)
+            raise
+        return result_sets
+
+    def _execute_statement(self, server, t_sql, pos, params, result_sets):
+        for regex, handler in self._handlers:
+            match = regex.match(t_sql, pos)
+            if not match:
+                continue
+            index = _BATCH_INDEX_REGEX.search(match.group(0))
+            if index:
+                prefix = 's{}_'.format(index.group(1))
+                stmt_params = {
+                    name[len(prefix):]: value
+                    for name, value in params.items()
+                    if name.startswith(prefix)
+                }
+            elif regex.groupindex:
+                stmt_params = match.groupdict()
+            else:
+                stmt_params = params
+            self.executed.append((server.host, handler.__name__))
+            results = handler(server, stmt_params)
+            if results is not None:
+                result_sets.extend(results)
+            return match.end()
+        raise FakeMSSQLError(
+            102, "Unsupported statement: {}".format(t_sql[pos:pos + 200]))
+
+    def _snapshot(self, server):
+        return (copy.deepcopy(server.state),
+                copy.deepcopy(self.availability_groups))
+
+    def _restore(self, server, snapshot):
+        server.state, self.availability_groups = snapshot
+
+    def _get_handlers(self):
+        return [
+            (statements.CREATE_DATABASE, self._create_database),
+            (statements.ADD_DATABASE_TO_AG, self._add_database_to_ag),
+            (statements.CREATE_OR_ALTER_LOGIN, self._create_or_alter_login),
+            (statements.ADD_SERVER_ROLE_MEMBER, self._add_server_role_member),
+            (statements.DROP_LOGIN, self._drop_login),
+            (statements.APPLY_LOGINS, self._apply_logins),
+            (statements.GRANT_DB_ACCESS, self._grant_db_access),
+            (statements.CREATE_OR_ALTER_CONTAINED_USER,
+             self._create_or_alter_contained_user),
+            (statements.SET_CONTAINED_DATABASE_AUTHENTICATION,
+             self._set_contained_database_authentication),
+            (statements.REVOKE_DB_ACCESS, self._revoke_db_access),
+            (statements.CREATE_MASTER_KEY, self._create_master_key),
+            (statements.CREATE_MASTER_CERT, self._create_master_cert),
+            (statements.SETUP_MASTER_CERT, self._setup_master_cert),
+            (statements.SETUP_DB_MIRRORING_ENDPOINT,
+             self._setup_db_mirroring_endpoint),
+            (statements.CREATE_AG, self._create_ag),
+            (statements.ADD_AG_REPLICAS, self._add_ag_replicas),
+            (statements.ADD_DATABASE_TO_AG_MANUAL_SEEDING,
+             self._add_database_to_ag_manual_seeding),
+            (statements.SET_AVAILABILITY_MODES,
+             self._set_availability_modes),
+            (statements.SET_SEEDING_MODE, self._set_seeding_mode),
+            (statements.SET_SEEDING_COMPRESSION,
+             self._set_seeding_compression),
+            (statements.GET_UNSEEDED_AG_DATABASES,
+             self._get_unseeded_ag_databases),
+            (statements.RESTORE_AG_DATABASE, self._restore_ag_database),
+            (statements.GET_SEEDING_PROGRESS, self._get_seeding_progress),
+            (statements.CONFIGURE_RESOURCE_GOVERNOR,
+             self._configure_resource_governor),
+            (statements.CONFIGURE_READ_ROUTING,
+             self._configure_read_routing),
+            (statements.JOIN_AG, self._join_ag),
+            (statements.GET_AG_PRIMARY_REPLICA,
+             self._get_ag_primary_replica),
+            (statements.GET_AG_REPLICAS, self._get_ag_replicas),
+            (statements.GET_AG_TOPOLOGY, self._get_ag_topology),
+            (statements.GET_REPLICATION_HEALTH,
+             self._get_replication_health),
+            (statements.GET_SQL_LOGINS, self._get_sql_logins),
+            (statements.GET_NON_CONTAINED_DATABASES,
+             self._get_non_contained_databases),
+        ]
+
+    def _get_database(self, server, db_name):
+        database = server.databases.get(db_name)
+        if not database:
+            raise FakeMSSQLError(
+                911, "Database '{}' does not exist.".format(db_name))
+        return database
+
+    def _get_login(self, server, name):
+        login = server.logins.get(name)
+        if not login:
+            raise FakeMSSQLError(
+                15151, "Cannot find the login '{}'.".format(name))
+        return login
+
+    def _get_ag(self, name):
+        ag = self.availability_groups.get(name)
+        if not ag:
+            raise FakeMSSQLError(
+                15151, "Cannot find the availability group '{}'.".format(
+                    name))
+        return ag
+
+    def _replica_servers(self, ag):
+        for server in self.servers.values():
+            replica = ag['replicas'].get(server.node_name)
+            if replica and replica['joined']:
+                yield server
+
+    def _create_database(self, server, params):
+        if len(params['db_name']) > 128:
+            raise FakeMSSQLError(
+                103, "The identifier that starts with '{}' is too "
+                     "long.".format(params['db_name'][:128]))
+        if (params.get('contained') and
+                not server.state['contained_database_authentication']):
+            raise FakeMSSQLError(
+                12824, "The sp_configure value 'contained database "
+                       "authentication' must be set to 1.")
+        server.databases.setdefault(params['db_name'], {
+            'users': {},
+            'ag_name': None,
+            'contained': bool(params.get('contained')),
+        })
+
+    def _add_database_to_ag(self, server, params):
+        database = self._get_database(server, params['db_name'])
+        ag = self._get_ag(params['ag_name'])
+        if database['ag_name']:
+            return
+        database['ag_name'] = ag['name']
+        # Automatic seeding: the database shows up on every replica.
+        for replica_server in self._replica_servers(ag):
+            replica = ag['replicas'][replica_server.node_name]
+            if replica['seeding_mode'] == 'AUTOMATIC':
+                replica_server.databases[params['db_name']] = \
+                    copy.deepcopy(database)
+
+    def _add_database_to_ag_manual_seeding(self, server, params):
+        database = self._get_database(server, params['db_name'])
+        ag = self._get_ag(params['ag_name'])
+        if database['ag_name']:
+            return
+        database['ag_name'] = ag['name']
+        for backup_file in json.loads(params['backup_files']) + [
+                params['log_backup_file']]:
+            self.backups[backup_file] = copy.deepcopy(database)
+
+    def _create_or_alter_login(self, server, params):
+        server.set_login(params['name'], params['password'],
+                         is_hashed_password=params['is_hashed_password'],
+                         sid=params['sid'])
+
+    def _add_server_role_member(self, server, params):
+        self._add_server_role_members(server, params['name'],
+                                      [params['role']])
+
+    def _drop_login(self, server, params):
+        server.logins.pop(params['name'], None)
+
+    def _apply_logins(self, server, params):
+        for login in json.loads(params['logins']):
+            server.set_login(login['name'], login['password_hash'],
+                             is_hashed_password=True, sid=login['sid'])
+            self._add_server_role_members(server, login['name'],
+                                          login['roles'])
+        for name in json.loads(params['dropped']):
+            server.logins.pop(name, None)
+
+    def _add_server_role_members(self, server, name, roles):
+        login = self._get_login(server, name)
+        for role in roles:
+            if role not in login['roles']:
+                login['roles'].append(role)
+
+    def _configure_resource_governor(self, server, params):
+        if server.state['engine_edition'] != 3:
+            return [[(False,)]]
+        classifier = {}
+        for pool in json.loads(params['pools']):
+            server.state['resource_pools'][pool['pool_name']] = {
+                'max_cpu_percent': pool.get('max_cpu_percent', 100),
+                'max_memory_percent': pool.get('max_memory_percent', 100),
+                'max_iops_per_volume': pool.get('max_iops_per_volume', 0),
+            }
+            classifier[pool['login_name']] = pool['pool_name']
+        server.state['classifier'] = classifier
+        return [[(True,)]]
+
+    def _grant_db_access(self, server, params):
+        database = self._get_database(server, params['db_name'])
+        self._get_login(server, params['login_name'])
+        database['users'][params['db_user_name']] = params['login_name']
+        # User changes are replicated to the AG secondaries.
+        self._replicate_database(server, params['db_name'])
+
+    def _create_or_alter_contained_user(self, server, params):
+        database = self._get_database(server, params['db_name'])
+        if not database['contained']:
+            raise FakeMSSQLError(
+                33233, "You can only create a user with a password in a "
+                       "contained database.")
+        if not server.state['contained_database_authentication']:
+            raise FakeMSSQLError(
+                12824, "The sp_configure value 'contained database "
+                       "authentication' must be set to 1.")
+        # Contained users have no SQL login.
+        database['users'][params['db_user_name']] = None
+        self._replicate_database(server, params['db_name'])
+
+    def _revoke_db_access(self, server, params):
+        database = self._get_database(server, params['db_name'])
+        database['users'].pop(params['db_user_name'], None)
+        self._replicate_database(server, params['db_name'])
+
+    def _replicate_database(self, server, db_name):
+        database = server.databases[db_name]
+        if not database['ag_name']:
+            return
+        ag = self._get_ag(database['ag_name'])
+        for replica_server in self._replica_servers(ag):
+            replica_server.databases[db_name] = copy.deepcopy(database)
+
+    def _create_master_key(self, server, params):
+        server.state['master_key'] = True
+
+    def _create_master_cert(self, server, params):
+        if not server.state['master_key']:
+            raise FakeMSSQLError(
+                15581, "Please create a master key in the database.")
+        server.state['master_cert'] = True
+        with open(params['cert_file'], 'wb') as f:
+            f.write('cert:{}'.format(server.node_name).encode())
+        with open(params['cert_key_file'], 'wb') as f:
+            f.write('cert-key:{}'.format(server.node_name).encode())
+
+    def _setup_master_cert(self, server, params):
+        if not server.state['master_key']:
+            raise FakeMSSQLError(
+                15581, "Please create a master key in the database.")
+        server.state['master_cert'] = True
+
+    def _setup_db_mirroring_endpoint(self, server, params):
+        if not server.state['master_cert']:
+            raise FakeMSSQLError(
+                15151, "Cannot find the certificate 'dbm_certificate'.")
+        server.state['endpoint'] = True
+
+    def _create_ag(self, server, params):
+        if server.ag and server.ag['name'] == params['ag_name']:
+            return [[(False,)]]
+        if not server.state['endpoint']:
+            raise FakeMSSQLError(
+                35260, "Database mirroring endpoint is not configured.")
+        replicas = {}
+        for replica in json.loads(params['replicas']):
+            replicas[replica['node_name']] = {
+                'address': replica['node_address'],
+                'joined': replica['node_name'] == server.node_name,
+                'availability_mode': _availability_mode(replica),
+                'seeding_mode': _seeding_mode(params),
+            }
+        if server.node_name not in replicas:
+            raise FakeMSSQLError(
+                35237, "The local replica must be specified.")
+        self.availability_groups[params['ag_name']] = {
+            'name': params['ag_name'],
+            'primary_replica': server.node_name,
+            'replicas': replicas,
+        }
+        return [[(True,)]]
+
+    def _get_primary_ag(self, server, ag_name):
+        ag = self._get_ag(ag_name)
+        if ag['primary_replica'] != server.node_name:
+            raise FakeMSSQLError(
+                41190, "The local replica is not the primary replica.")
+        return ag
+
+    def _add_ag_replicas(self, server, params):
+        ag = self.availability_groups.get(params['ag_name'])
+        results = []
+        for replica in json.loads(params['replicas']):
+            node_name = replica['node_name']
+            if ag and server.ag is ag and node_name in ag['replicas']:
+                continue
+            try:
+                self._get_primary_ag(server, params['ag_name'])
+            except FakeMSSQLError as ex:
+                results.append((node_name, ex.number, ex.message))
+                continue
+            ag['replicas'][node_name] = {
+                'address': replica['node_address'],
+                'joined': False,
+                'availability_mode': _availability_mode(replica),
+                'seeding_mode': _seeding_mode(params),
+            }
+            results.append((node_name, None, None))
+        return [results]
+
+    def _set_availability_modes(self, server, params):
+        ag = self._get_primary_ag(server, params['ag_name'])
+        for replica in json.loads(params['replicas']):
+            if replica['node_name'] in ag['replicas']:
+                ag['replicas'][replica['node_name']]['availability_mode'] = \
+                    _availability_mode(replica)
+
+    def _configure_read_routing(self, server, params):
+        if params['allow_connections'] not in ('NO', 'READ_ONLY', 'ALL'):
+            raise FakeMSSQLError(50000, "Invalid ALLOW_CONNECTIONS value.")
+        ag = self._get_primary_ag(server, params['ag_name'])
+        for node_name, replica in ag['replicas'].items():
+            replica['allow_connections'] = params['allow_connections']
+            replica['read_only_routing_list'] = []
+            if params['allow_connections'] != 'NO':
+                replica['read_only_routing_list'] = sorted(
+                    name for name in ag['replicas'] if name != node_name)
+
+    def _set_seeding_mode(self, server, params):
+        ag = self._get_primary_ag(server, params['ag_name'])
+        for replica in ag['replicas'].values():
+            replica['seeding_mode'] = _seeding_mode(params)
+
+    def _set_contained_database_authentication(self, server, params):
+        server.state['contained_database_authentication'] = \
+            bool(params['enabled'])
+
+    def _set_seeding_compression(self, server, params):
+        if params['enabled']:
+            server.state['trace_flags'].add(9567)
+        else:
+            server.state['trace_flags'].discard(9567)
+
+    def _get_unseeded_ag_databases(self, server, params):
+        ag = server.ag
+        primary = ag and self._get_primary_server(ag)
+        if not primary or ag['name'] != params['ag_name']:
+            return [[]]
+        return [[
+            (db_name,) for db_name, database in primary.databases.items()
+            if database['ag_name'] == ag['name'] and
+            db_name not in server.databases
+        ]]
+
+    def _get_non_contained_databases(self, server, params):
+        return [[
+            (db_name,) for db_name in json.loads(params['db_names'])
+            if db_name in server.databases and
+            not server.databases[db_name]['contained']
+        ]]
+
+    def _restore_ag_database(self, server, params):
+        if params['db_name'] not in server.databases:
+            backup_files = json.loads(params['backup_files'])
+            for backup_file in backup_files + [params['log_backup_file']]:
+                if backup_file not in self.backups:
+                    raise FakeMSSQLError(
+                        3201, "Cannot open backup device '{}'.".format(
+                            backup_file))
+            server.databases[params['db_name']] = copy.deepcopy(
+                self.backups[backup_files[0]])
+
+    def _get_seeding_progress(self, server, params):
+        return [[], []]
+
+    def _join_ag(self, server, params):
+        ag = self._get_ag(params['ag_name'])
+        replica = ag['replicas'].get(server.node_name)
+        if not replica:
+            raise FakeMSSQLError(
+                41106, "The local replica is not part of the availability "
+                       "group '{}'.".format(ag['name']))
+        if not server.state['endpoint']:
+            raise FakeMSSQLError(
+                35260, "Database mirroring endpoint is not configured.")
+        if replica['joined']:
+            return
+        replica['joined'] = True
+        # Automatic seeding of the existing AG databases.
+        primary = self._get_primary_server(ag)
+        if primary and replica['seeding_mode'] == 'AUTOMATIC':
+            for db_name, database in primary.databases.items():
+                if database['ag_name'] == ag['name']:
+                    server.databases[db_name] = copy.deepcopy(database)
+
+    def _get_primary_server(self, ag):
+        for server in self.servers.values():
+            if server.node_name == ag['primary_replica']:
+                return server
+        return None
+
+    def _get_ag_primary_replica(self, server, params):
+        ag = server.ag
+        if not ag or ag['name'] != params['ag_name']:
+            return [[]]
+        return [[(ag['primary_replica'],)]]
+
+    def _get_ag_replicas(self, server, params):
+        ag = server.ag
+        if not ag or ag['name'] != params['ag_name']:
+            return [[]]
+        return [[(name,) for name in ag['replicas']]]
+
+    def _get_ag_topology(self, server, params):
+        ag = server.ag
+        if not ag or ag['name'] != params['ag_name']:
+            return [[]]
+        is_primary = ag['primary_replica'] == server.node_name
+        rows = []
+        for name, replica in ag['replicas'].items():
+            is_local = name == server.node_name
+            if is_local or (is_primary and replica['joined']):
+                if name == ag['primary_replica']:
+                    role = 'PRIMARY'
+                else:
+                    role = 'SECONDARY'
+                rows.append((name, ag['primary_replica'], is_local, role,
+                             'HEALTHY'))
+            elif is_primary:
+                rows.append((name, ag['primary_replica'], None, None,
+                             'NOT_HEALTHY'))
+            else:
+                rows.append((name, ag['primary_replica'], None, None,
+                             None))
+        return [rows]
+
+    def _get_replication_health(self, server, params):
+        ag = server.ag
+        if not ag or ag['name'] != params['ag_name']:
+            return [[]]
+        is_primary = ag['primary_replica'] == server.node_name
+        databases = len([db for db in server.databases.values()
+                         if db['ag_name'] == ag['name']])
+        rows = []
+        for name, replica in ag['replicas'].items():
+            is_local = name == server.node_name
+            if not is_local and not is_primary:
+                continue
+            if name == ag['primary_replica']:
+                rows.append((name, is_local, 'PRIMARY', 'HEALTHY', 0,
+                             None, None, None, None))
+            elif replica['joined']:
+                rows.append((name, is_local, 'SECONDARY', 'HEALTHY',
+                             databases,
+                             replica.get('log_send_queue_size', 0),
+                             replica.get('redo_queue_size', 0), 1024, 0))
+            else:
+                rows.append((name, is_local, None, 'NOT_HEALTHY', 0,
+                             None, None, None, None))
+        return [rows]
+
+    def _grant_ag_permissions(self, server, params):
+        self._get_ag(params['ag_name'])
+        self._get_login(server, params['name'])
+
+    def _get_sql_logins(self, server, params):
+        login_rows = []
+        role_rows = []
+        for name, login in server.logins.items():
+            login_rows.append((name, login['sid'], login['password_hash']))
+            for role in login['roles']:
+                role_rows.append((name, role))
+        return [login_rows, role_rows]
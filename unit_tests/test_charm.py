@@ -1,3 +1,5 @@
+import json
+import os
 import unittest
 
 from unittest import mock
@@ -169,3 +171,68 @@ class TestMssqlCharm(unittest.TestCase):
         self.assertFalse(self.harness.charm._validate_config())
         self.assertEqual(self.harness.charm.unit.status,
                          BlockedStatus('Invalid MSSQL product id'))
+
+    @mock.patch.object(charm.mssql_stats, 'summary')
+    def test_on_get_sql_stats_action(self, _summary):
+        _summary.return_value = {'connections': {'count': 2}}
+        event = mock.MagicMock()
+
+        self.harness.disable_hooks()
+        self.harness.begin()
+        self.harness.charm.on_get_sql_stats_action(event)
+
+        event.set_results.assert_called_once_with(
+            {'summary': json.dumps({'connections': {'count': 2}})})
+
+    @mock.patch.object(charm.MssqlCluster, 'mssql_db_client')
+    def test_on_get_seeding_progress_action(self, _mssql_db_client):
+        progress = [{'database_name': 'testdb', 'current_state': 'COMPLETED'}]
+        db_client = _mssql_db_client.return_value
+        db_client.get_seeding_progress.return_value = progress
+        event = mock.MagicMock()
+
+        self.harness.disable_hooks()
+        self.harness.begin()
+        self.harness.charm.cluster.state.ag_configured = True
+        self.harness.charm.on_get_seeding_progress_action(event)
+
+        db_client.get_seeding_progress.assert_called_once_with(
+            self.harness.charm.cluster.AG_NAME)
+        event.set_results.assert_called_once_with(
+            {'progress': json.dumps(progress)})
+        event.fail.assert_not_called()
+
+    @mock.patch.object(charm.MssqlCluster, 'mssql_db_client')
+    def test_on_get_seeding_progress_action_not_replica(
+            self, _mssql_db_client):
+        event = mock.MagicMock()
+
+        self.harness.disable_hooks()
+        self.harness.begin()
+        self.harness.charm.on_get_seeding_progress_action(event)
+
+        event.fail.assert_called_once_with(
+            'The unit is not an availability group replica yet.')
+        event.set_results.assert_not_called()
+        _mssql_db_client.assert_not_called()
+
+    @mock.patch.dict(os.environ, {'JUJU_HOOK_NAME': 'update-status'})
+    @mock.patch.object(charm.mssql_stats, 'flush')
+    @mock.patch.object(charm.mssql_db_client, 'close_connections')
+    def test_on_commit(self, _close_connections, _flush):
+        self.harness.begin()
+        self.harness.framework.commit()
+
+        _close_connections.assert_called_once_with()
+        _flush.assert_called_once_with('update-status')
+
+    @mock.patch.dict(os.environ, {'JUJU_ACTION_NAME': 'get-sql-stats'})
+    @mock.patch.object(charm.mssql_stats, 'flush')
+    @mock.patch.object(charm.mssql_db_client, 'close_connections')
+    def test_on_commit_action(self, _close_connections, _flush):
+        os.environ.pop('JUJU_HOOK_NAME', None)
+        self.harness.begin()
+        self.harness.framework.commit()
+
+        _close_connections.assert_called_once_with()
+        _flush.assert_called_once_with('get-sql-stats')
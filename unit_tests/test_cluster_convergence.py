@@ -0,0 +1,29 @@
+import unittest
+
+from unit_tests import benchmark_cluster
+
+
+class TestClusterConvergence(unittest.TestCase):
+
+    # Regression gate for the 3 units cluster formation. Lower the budgets
+    # whenever the cluster convergence is improved.
+    MAX_HOOKS = 40
+    MAX_ROUND_TRIPS = 30
+    MAX_CONNECTIONS = 16
+    MAX_WALL_TIME = 15
+
+    def test_three_units_convergence(self):
+        simulator = benchmark_cluster.ClusterSimulator(3)
+
+        results = simulator.run()
+
+        self.assertTrue(results['converged'])
+        self.assertLessEqual(results['hooks'], self.MAX_HOOKS)
+        self.assertLessEqual(results['round_trips'], self.MAX_ROUND_TRIPS)
+        self.assertLessEqual(results['connections'], self.MAX_CONNECTIONS)
+        self.assertLessEqual(results['wall_time'], self.MAX_WALL_TIME)
+        ag = simulator.backend.availability_groups['juju-ag']
+        self.assertEqual(sorted(ag['replicas']),
+                         ['mssql-0', 'mssql-1', 'mssql-2'])
+        for replica in ag['replicas'].values():
+            self.assertTrue(replica['joined'])
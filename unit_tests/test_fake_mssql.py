@@ -0,0 +1,233 @@
+import unittest
+
+import mssql_db_client
+
+from unit_tests import fake_mssql
+
+
+class TestFakeMSSQLBackend(unittest.TestCase):
+
+    TEST_SA_PASSWORD = 'test-sa-password'
+
+    def setUp(self):
+        self.backend = fake_mssql.FakeMSSQLBackend(latency=0.01)
+        self.primary = self.backend.add_server(
+            '10.0.0.10', 'node-1', self.TEST_SA_PASSWORD)
+        self.secondary = self.backend.add_server(
+            '10.0.0.11', 'node-2', self.TEST_SA_PASSWORD)
+        patcher = self.backend.patch()
+        patcher.__enter__()
+        self.addCleanup(patcher.__exit__, None, None, None)
+
+    def db_client(self, host):
+        return mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password=self.TEST_SA_PASSWORD, host=host)
+
+    def setup_ag_endpoint(self, host):
+        db_client = self.db_client(host)
+        db_client.create_master_encryption_key('test-key-password')
+        db_client.exec_t_sql(mssql_db_client.statements.SETUP_MASTER_CERT, {
+            'cert_file': 'test.cer',
+            'cert_key_file': 'test.pvk',
+            'password': 'test-cert-password',
+        })
+        db_client.setup_db_mirroring_endpoint()
+
+    def test_connect_and_round_trips(self):
+        db_client = self.db_client('10.0.0.10')
+        db_client.create_database('testdb')
+        db_client.create_login('testuser', 'test-pass')
+
+        self.assertEqual(self.backend.connections, 1)
+        self.assertEqual(self.backend.round_trips, 2)
+        self.assertAlmostEqual(self.backend.clock, 0.02)
+        self.assertIn('testdb', self.primary.databases)
+        self.assertIn('testuser', self.primary.logins)
+
+    def test_login_failed(self):
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='wrong-password', host='10.0.0.10')
+
+        self.assertRaises(mssql_db_client.MSSQLLoginError,
+                          db_client.create_database, 'testdb')
+
+    def test_batch(self):
+        db_client = self.db_client('10.0.0.10')
+
+        with db_client.batch() as batch:
+            batch.create_database(db_name='testdb')
+            batch.create_login(name='testuser', password='test-pass',
+                               server_roles=['dbcreator'])
+            batch.grant_access(db_name='testdb', db_user_name='testuser')
+
+        self.assertEqual(self.backend.round_trips, 1)
+        self.assertEqual(self.primary.logins['testuser']['roles'],
+                         ['dbcreator'])
+        self.assertEqual(self.primary.databases['testdb']['users'],
+                         {'testuser': 'testuser'})
+
+    def test_batch_rolled_back(self):
+        db_client = self.db_client('10.0.0.10')
+
+        with self.assertRaises(Exception):
+            with db_client.batch() as batch:
+                batch.create_login(name='testuser', password='test-pass')
+                batch.grant_access(db_name='missingdb',
+                                   db_user_name='testuser')
+
+        self.assertNotIn('testuser', self.primary.logins)
+
+    def test_availability_group(self):
+        self.setup_ag_endpoint('10.0.0.10')
+        self.setup_ag_endpoint('10.0.0.11')
+        nodes = {
+            'node-1': {'address': '10.0.0.10'},
+            'node-2': {'address': '10.0.0.11'},
+        }
+        primary_client = self.db_client('10.0.0.10')
+        secondary_client = self.db_client('10.0.0.11')
+
+        primary_client.create_ag('test-ag', {'node-1': nodes['node-1']})
+        self.assertIsNone(secondary_client.get_ag_topology('test-ag'))
+        primary_client.add_replicas('test-ag', nodes)
+        primary_client.add_replicas('test-ag', nodes)
+        self.assertRaises(Exception, secondary_client.add_replicas,
+                          'test-ag', {'node-3': {'address': '10.0.0.12'}})
+        primary_client.create_database('testdb', ag_name='test-ag')
+        secondary_client.join_ag('test-ag')
+
+        self.assertIn('testdb', self.secondary.databases)
+        topology = secondary_client.get_ag_topology('test-ag')
+        self.assertEqual(topology['primary_replica'], 'node-1')
+        self.assertEqual(topology['replicas'], ['node-1', 'node-2'])
+        self.assertEqual(topology['replica_states'], {
+            'node-2': {
+                'is_local': True,
+                'role': 'SECONDARY',
+                'synchronization_health': 'HEALTHY',
+            }
+        })
+        topology = primary_client.get_ag_topology('test-ag')
+        self.assertEqual(len(topology['replica_states']), 2)
+        health = primary_client.get_replication_health('test-ag')
+        self.assertEqual(health['node-2']['databases'], 1)
+        self.assertEqual(health['node-2']['synchronization_health'],
+                         'HEALTHY')
+        self.assertEqual(list(secondary_client.get_replication_health(
+            'test-ag')), ['node-2'])
+
+        primary_client.set_availability_modes(
+            'test-ag', {'node-2': 'ASYNCHRONOUS_COMMIT'})
+        replicas = self.backend.availability_groups['test-ag']['replicas']
+        self.assertEqual(replicas['node-1']['availability_mode'],
+                         'SYNCHRONOUS_COMMIT')
+        self.assertEqual(replicas['node-2']['availability_mode'],
+                         'ASYNCHRONOUS_COMMIT')
+
+        primary_client.configure_read_routing('test-ag', 'READ_ONLY')
+        replicas = self.backend.availability_groups['test-ag']['replicas']
+        self.assertEqual(replicas['node-2']['allow_connections'],
+                         'READ_ONLY')
+        self.assertEqual(replicas['node-1']['read_only_routing_list'],
+                         ['node-2'])
+
+    def test_configure_resource_governor(self):
+        db_client = self.db_client('10.0.0.10')
+
+        self.assertTrue(db_client.configure_resource_governor(
+            {'testuser': {'max_cpu_percent': 20}}))
+
+        self.assertEqual(self.backend.round_trips, 1)
+        self.assertEqual(self.primary.state['classifier'],
+                         {'testuser': 'juju_testuser'})
+        self.assertEqual(
+            self.primary.state['resource_pools']['juju_testuser'],
+            {'max_cpu_percent': 20, 'max_memory_percent': 100,
+             'max_iops_per_volume': 0})
+
+        db_client.configure_resource_governor({})
+        self.assertEqual(self.primary.state['classifier'], {})
+
+    def test_configure_resource_governor_unsupported_edition(self):
+        # Standard edition.
+        self.primary.state['engine_edition'] = 2
+        db_client = self.db_client('10.0.0.10')
+
+        self.assertFalse(db_client.configure_resource_governor(
+            {'testuser': {'max_cpu_percent': 20}}))
+
+        self.assertEqual(self.primary.state['classifier'], {})
+        self.assertEqual(self.primary.state['resource_pools'], {})
+
+    def test_get_sql_logins(self):
+        db_client = self.db_client('10.0.0.10')
+        db_client.create_login('testuser', 'test-pass',
+                               server_roles=['sysadmin'])
+        db_client.create_login('olduser', 'test-pass')
+        sql_logins = db_client.get_sql_logins()
+
+        secondary_client = self.db_client('10.0.0.11')
+        secondary_client.apply_logins(
+            {'olduser': sql_logins['olduser']})
+        secondary_client.apply_logins(
+            {'testuser': sql_logins['testuser']}, dropped=['olduser'])
+
+        self.assertEqual(self.primary.logins['testuser'],
+                         self.secondary.logins['testuser'])
+        self.assertNotIn('olduser', self.secondary.logins)
+
+    def test_unsupported_statement(self):
+        db_client = self.db_client('10.0.0.10')
+
+        self.assertRaises(Exception, db_client.exec_t_sql,
+                          'DROP DATABASE testdb')
+
+    def test_manual_seeding(self):
+        self.setup_ag_endpoint('10.0.0.10')
+        self.setup_ag_endpoint('10.0.0.11')
+        primary_client = self.db_client('10.0.0.10')
+        secondary_client = self.db_client('10.0.0.11')
+        primary_client.create_ag(
+            'test-ag', {'node-1': {'address': '10.0.0.10'}},
+            seeding_mode='MANUAL')
+        primary_client.add_replicas(
+            'test-ag', {'node-2': {'address': '10.0.0.11'}},
+            seeding_mode='MANUAL')
+        secondary_client.join_ag('test-ag')
+
+        primary_client.create_database(
+            'testdb', ag_name='test-ag', manual_seeding_dir='/srv/seeding')
+        self.assertNotIn('testdb', self.secondary.databases)
+        self.assertIn('/srv/seeding/testdb_1.bak', self.backend.backups)
+
+        self.assertEqual(
+            secondary_client.seed_databases('test-ag', '/srv/seeding'),
+            ['testdb'])
+        self.assertIn('testdb', self.secondary.databases)
+        self.assertEqual(
+            secondary_client.seed_databases('test-ag', '/srv/seeding'), [])
+
+    def test_contained_database(self):
+        self.setup_ag_endpoint('10.0.0.10')
+        self.setup_ag_endpoint('10.0.0.11')
+        primary_client = self.db_client('10.0.0.10')
+        secondary_client = self.db_client('10.0.0.11')
+        primary_client.create_ag('test-ag', {
+            'node-1': {'address': '10.0.0.10'},
+            'node-2': {'address': '10.0.0.11'},
+        })
+        secondary_client.join_ag('test-ag')
+        self.assertRaises(Exception, primary_client.create_database,
+                          'testdb', ag_name='test-ag', contained=True)
+
+        primary_client.set_contained_database_authentication(True)
+        with primary_client.batch() as batch:
+            batch.create_database(db_name='testdb', ag_name='test-ag',
+                                  contained=True)
+            batch.create_contained_user(db_name='testdb',
+                                        db_user_name='testuser',
+                                        password='test-pass')
+
+        self.assertNotIn('testuser', self.primary.logins)
+        self.assertEqual(self.secondary.databases['testdb']['users'],
+                         {'testuser': None})
@@ -1,7 +1,10 @@
+import json
 import string
+import threading
 import unittest
+import zlib
 
-from base64 import b64encode
+from base64 import b64decode, b64encode
 from unittest import mock
 
 from ops.testing import Harness
@@ -99,14 +102,14 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'configure_cluster_node')
     @mock.patch.object(interface_mssql_cluster,
-                       'append_hosts_entry')
+                       'HostsManager')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'set_sa_password')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'master_cert',
                        new_callable=mock.PropertyMock)
     def test_on_changed(self, _master_cert, _set_sa_password,
-                        _append_hosts_entry, _configure_cluster_node):
+                        _hosts_manager, _configure_cluster_node):
         _master_cert.return_value = self.TEST_MASTER_CERT
         self.harness.set_leader()
         self.harness.begin()
@@ -129,21 +132,21 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
         self.assertTrue(node_state.get('ready_to_cluster'))
         self.assertIsNone(node_state.get('clustered'))
         _set_sa_password.assert_called_once_with()
-        _append_hosts_entry.assert_called_once_with(
+        _hosts_manager.return_value.set_entry.assert_called_once_with(
             self.TEST_BIND_ADDRESS, [self.TEST_NODE_NAME])
         _configure_cluster_node.assert_called_once_with()
 
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'configure_cluster_node')
     @mock.patch.object(interface_mssql_cluster,
-                       'append_hosts_entry')
+                       'HostsManager')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'set_master_cert')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'master_cert',
                        new_callable=mock.PropertyMock)
     def test_on_initialized_unit(self, _master_cert, _set_master_cert,
-                                 _append_hosts_entry, _configure_cluster_node):
+                                 _hosts_manager, _configure_cluster_node):
         _master_cert.return_value = None
         self.harness.set_leader()
         self.harness.begin()
@@ -165,11 +168,46 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
         self.assertIsNone(rel_data.get('ready_to_cluster'))
         self.assertIsNone(rel_data.get('clustered'))
 
-        _append_hosts_entry.assert_called_once_with(
+        _hosts_manager.return_value.set_entry.assert_called_once_with(
             self.TEST_BIND_ADDRESS, [self.TEST_NODE_NAME])
         _set_master_cert.assert_called_once_with()
         _configure_cluster_node.assert_not_called()
 
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'configure_cluster_node')
+    @mock.patch.object(interface_mssql_cluster,
+                       'HostsManager')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'set_sa_password')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'master_cert',
+                       new_callable=mock.PropertyMock)
+    def test_on_departed(self, _master_cert, _set_sa_password,
+                         _hosts_manager, _configure_cluster_node):
+        _master_cert.return_value = self.TEST_MASTER_CERT
+        self.harness.set_leader()
+        self.harness.begin()
+        cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        rel_id = self.harness.add_relation('cluster', 'mssql')
+        self.harness.add_relation_unit(rel_id, 'mssql/1')
+        self.harness.update_relation_data(
+            rel_id,
+            'mssql/1',
+            {
+                'node_name': self.TEST_NODE_NAME,
+                'node_address': self.TEST_BIND_ADDRESS,
+            })
+        relation = self.harness.model.get_relation('cluster', rel_id)
+        unit = self.harness.model.get_unit('mssql/1')
+        self.harness.charm.on.cluster_relation_departed.emit(
+            relation, unit.app, unit)
+
+        self.assertNotIn(self.TEST_NODE_NAME, cluster.state.initialized_nodes)
+        self.assertNotIn('mssql/1', cluster.state.unit_nodes)
+        _hosts_manager.return_value.remove_entry.assert_called_with(
+            [self.TEST_NODE_NAME])
+
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'mssql_db_client')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
@@ -279,6 +317,42 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
         _configure_primary_replica.assert_not_called()
         _configure_secondary_replica.assert_called_once_with()
 
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'configure_secondary_replica')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_primary_replica',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'configure_master_cert')
+    def test_configure_cluster_node_unchanged_inputs(
+            self, _configure_master_cert, _mssql_db_client,
+            _is_primary_replica, _configure_secondary_replica):
+
+        _is_primary_replica.return_value = False
+        self.harness.disable_hooks()
+        self.harness.begin()
+        cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        cluster.state.initialized_nodes[self.TEST_NODE_NAME] = {
+            'address': self.TEST_BIND_ADDRESS
+        }
+        rel_id = self.harness.add_relation('cluster', 'mssql')
+        self.harness.add_relation_unit(rel_id, 'mssql/1')
+        cluster.configure_cluster_node()
+        cluster.configure_cluster_node()
+
+        _configure_secondary_replica.assert_called_once_with()
+
+        self.harness.update_relation_data(
+            rel_id, 'mssql/1', {'nonce': 'test-nonce'})
+        cluster.configure_cluster_node()
+
+        self.assertEqual(_configure_secondary_replica.call_count, 2)
+        mock_ret_value = _mssql_db_client.return_value
+        mock_ret_value.setup_db_mirroring_endpoint.assert_called_once_with()
+
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'create_ag')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
@@ -294,6 +368,8 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
         cluster.configure_primary_replica()
         _create_ag.assert_called_once_with()
 
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'publish_logins_manifest')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'mssql_db_client')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
@@ -309,7 +385,7 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
                        new_callable=mock.PropertyMock)
     def test_configure_primary_replica_ag_ready(
             self, _is_ag_ready, _ready_nodes, _ag_replicas, _create_ag,
-            _mssql_db_client):
+            _mssql_db_client, _publish_logins_manifest):
 
         _is_ag_ready.return_value = True
         _ready_nodes.return_value = {
@@ -330,16 +406,23 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
         _mssql_db_client.assert_called_once_with()
         mock_ret_value = _mssql_db_client.return_value
         mock_ret_value.add_replicas.assert_called_once_with(
-            cluster.AG_NAME, {'test-node-3': {'address': '10.0.0.13'}})
+            cluster.AG_NAME, {'test-node-3': {'address': '10.0.0.13'}}, {
+                self.TEST_NODE_NAME: 'SYNCHRONOUS_COMMIT',
+                'test-node-1': 'SYNCHRONOUS_COMMIT',
+                'test-node-2': 'SYNCHRONOUS_COMMIT',
+                'test-node-3': 'SYNCHRONOUS_COMMIT',
+            }, 'AUTOMATIC')
         rel_data = self.harness.get_relation_data(rel_id, 'mssql/0')
         self.assertIsNotNone(rel_data.get('nonce'))
+        _publish_logins_manifest.assert_called_once_with()
 
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'sync_logins_from_primary_replica')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'join_existing_ag')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
-                       'mssql_db_client')
+                       'ag_replicas',
+                       new_callable=mock.PropertyMock)
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'is_ag_ready',
                        new_callable=mock.PropertyMock)
@@ -347,12 +430,12 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
                        'ag_primary_replica',
                        new_callable=mock.PropertyMock)
     def test_configure_secondary_replica(
-            self, _ag_primary_replica, _is_ag_ready, _mssql_db_client,
+            self, _ag_primary_replica, _is_ag_ready, _ag_replicas,
             _join_existing_ag, _sync_logins_from_primary_replica):
 
         _is_ag_ready.return_value = True
         _ag_primary_replica.return_value = self.TEST_PRIMARY_REPLICA_NAME
-        _mssql_db_client.return_value.get_ag_replicas.return_value = \
+        _ag_replicas.return_value = \
             [self.TEST_PRIMARY_REPLICA_NAME, self.TEST_NODE_NAME]
         self.harness.disable_hooks()
         self.harness.begin()
@@ -360,13 +443,277 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
             self.harness.charm, 'cluster')
         cluster.configure_secondary_replica()
 
-        _mssql_db_client.assert_called_once_with(
-            self.TEST_PRIMARY_REPLICA_NAME)
-        mock_ret_value = _mssql_db_client.return_value
-        mock_ret_value.get_ag_replicas.assert_called_once_with(cluster.AG_NAME)
         _join_existing_ag.assert_called_once_with()
         _sync_logins_from_primary_replica.assert_called_once_with()
 
+    def test_replica_availability_modes(self):
+        self.harness.begin()
+        cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        nodes = ['test-node-3', 'test-node-1', self.TEST_NODE_NAME,
+                 'test-node-2']
+
+        modes = cluster.replica_availability_modes(nodes)
+        self.assertEqual(set(modes.values()), {'SYNCHRONOUS_COMMIT'})
+
+        self.harness.update_config({'synchronous-replicas': 2})
+        modes = cluster.replica_availability_modes(nodes)
+        self.assertEqual(modes, {
+            self.TEST_NODE_NAME: 'SYNCHRONOUS_COMMIT',
+            'test-node-1': 'SYNCHRONOUS_COMMIT',
+            'test-node-2': 'ASYNCHRONOUS_COMMIT',
+            'test-node-3': 'ASYNCHRONOUS_COMMIT',
+        })
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'ag_replicas',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_primary_replica',
+                       new_callable=mock.PropertyMock)
+    def test_configure_availability_modes(
+            self, _is_primary_replica, _ag_replicas, _mssql_db_client):
+        _is_primary_replica.return_value = True
+        _ag_replicas.return_value = [self.TEST_NODE_NAME, 'test-node-1',
+                                     'test-node-2']
+        self.harness.begin()
+        cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        db_client = _mssql_db_client.return_value
+
+        cluster.configure_availability_modes()
+        db_client.set_availability_modes.assert_not_called()
+
+        self.harness.update_config({'synchronous-replicas': 2})
+        cluster.configure_availability_modes()
+        cluster.configure_availability_modes()
+        db_client.set_availability_modes.assert_called_once_with(
+            cluster.AG_NAME, {
+                self.TEST_NODE_NAME: 'SYNCHRONOUS_COMMIT',
+                'test-node-1': 'SYNCHRONOUS_COMMIT',
+                'test-node-2': 'ASYNCHRONOUS_COMMIT',
+            })
+
+        db_client.set_availability_modes.reset_mock()
+        self.harness.update_config({'synchronous-replicas': 0})
+        cluster.configure_availability_modes()
+        db_client.set_availability_modes.assert_called_once_with(
+            cluster.AG_NAME, {
+                self.TEST_NODE_NAME: 'SYNCHRONOUS_COMMIT',
+                'test-node-1': 'SYNCHRONOUS_COMMIT',
+                'test-node-2': 'SYNCHRONOUS_COMMIT',
+            })
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'ag_replicas',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_primary_replica',
+                       new_callable=mock.PropertyMock)
+    def test_configure_read_routing(self, _is_primary_replica, _ag_replicas,
+                                    _mssql_db_client):
+        _is_primary_replica.return_value = True
+        _ag_replicas.return_value = ['test-node-1', 'test-node-2']
+        self.harness.begin()
+        cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        db_client = _mssql_db_client.return_value
+
+        cluster.configure_read_routing()
+        db_client.configure_read_routing.assert_not_called()
+
+        self.harness.update_config({'readable-secondaries': 'invalid'})
+        cluster.configure_read_routing()
+        db_client.configure_read_routing.assert_not_called()
+
+        self.harness.update_config(
+            {'readable-secondaries': 'read-intent-only'})
+        cluster.configure_read_routing()
+        cluster.configure_read_routing()
+        db_client.configure_read_routing.assert_called_once_with(
+            cluster.AG_NAME, 'READ_ONLY')
+
+        db_client.configure_read_routing.reset_mock()
+        _ag_replicas.return_value = ['test-node-1', 'test-node-2',
+                                     'test-node-3']
+        cluster.configure_read_routing()
+        db_client.configure_read_routing.assert_called_once_with(
+            cluster.AG_NAME, 'READ_ONLY')
+
+        db_client.configure_read_routing.reset_mock()
+        self.harness.update_config({'readable-secondaries': 'no'})
+        cluster.configure_read_routing()
+        db_client.configure_read_routing.assert_called_once_with(
+            cluster.AG_NAME, 'NO')
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_primary_replica',
+                       new_callable=mock.PropertyMock)
+    def test_configure_seeding(self, _is_primary_replica, _mssql_db_client):
+        _is_primary_replica.return_value = True
+        self.harness.begin()
+        cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        db_client = _mssql_db_client.return_value
+
+        cluster.configure_seeding()
+        _mssql_db_client.assert_not_called()
+
+        self.harness.update_config({'seeding-mode': 'automatic-compressed'})
+        cluster.configure_seeding()
+        db_client.set_seeding_compression.assert_called_once_with(True)
+        db_client.set_seeding_mode.assert_not_called()
+
+        db_client.reset_mock()
+        self.harness.update_config({'seeding-mode': 'manual'})
+        cluster.configure_seeding()
+        db_client.set_seeding_compression.assert_not_called()
+        db_client.set_seeding_mode.assert_not_called()
+
+        self.harness.update_config({'seeding-backup-path': '/srv/seeding'})
+        cluster.configure_seeding()
+        cluster.configure_seeding()
+        db_client.set_seeding_compression.assert_called_once_with(False)
+        db_client.set_seeding_mode.assert_called_once_with(
+            cluster.AG_NAME, 'MANUAL')
+        self.assertEqual(cluster.manual_seeding_dir, '/srv/seeding')
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    def test_configure_contained_database_authentication(
+            self, _mssql_db_client):
+        self.harness.begin()
+        cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        set_authentication = \
+            _mssql_db_client.return_value.set_contained_database_authentication
+
+        cluster.configure_contained_database_authentication()
+        set_authentication.assert_not_called()
+
+        self.harness.update_config({'contained-databases': True})
+        cluster.configure_contained_database_authentication()
+        cluster.configure_contained_database_authentication()
+        set_authentication.assert_called_once_with(True)
+
+        self.harness.update_config({'contained-databases': False})
+        cluster.configure_contained_database_authentication()
+        set_authentication.assert_called_with(False)
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    def test_seed_databases(self, _mssql_db_client):
+        self.harness.begin()
+        cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+
+        cluster.seed_databases()
+        _mssql_db_client.assert_not_called()
+
+        self.harness.update_config({
+            'seeding-mode': 'manual',
+            'seeding-backup-path': '/srv/seeding',
+        })
+        cluster.seed_databases()
+        _mssql_db_client.return_value.seed_databases.assert_called_once_with(
+            cluster.AG_NAME, '/srv/seeding')
+
+    @mock.patch.object(interface_mssql_cluster.time, 'time')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    def test_on_update_status(self, _mssql_db_client, _time):
+        health = {
+            'test-node-1': {
+                'is_local': True,
+                'role': 'PRIMARY',
+                'synchronization_health': 'HEALTHY',
+                'databases': 0,
+                'log_send_queue_kb': 0,
+                'redo_queue_kb': 0,
+                'redo_rate_kb': None,
+                'lag_seconds': 0,
+            },
+            'test-node-2': {
+                'is_local': False,
+                'role': 'SECONDARY',
+                'synchronization_health': 'HEALTHY',
+                'databases': 1,
+                'log_send_queue_kb': 2048,
+                'redo_queue_kb': 512,
+                'redo_rate_kb': 1024,
+                'lag_seconds': 3,
+            },
+        }
+        db_client = _mssql_db_client.return_value
+        db_client.get_replication_health.return_value = health
+        _time.return_value = 1000
+        self.harness.update_config({
+            'replication-health-interval': 300,
+            'log-send-queue-threshold': 1024,
+            'redo-queue-threshold': 1024,
+        })
+        self.harness.begin()
+        cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+
+        self.harness.charm.on.update_status.emit()
+        _mssql_db_client.assert_not_called()
+
+        cluster.state.ag_configured = True
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(
+            self.harness.charm.unit.status.message,
+            'Unit is ready. Replicas lagging: test-node-2 '
+            '(log send queue 2048 KB, redo queue 512 KB)')
+
+        _time.return_value = 1100
+        health['test-node-2']['log_send_queue_kb'] = 0
+        self.harness.charm.on.update_status.emit()
+        db_client.get_replication_health.assert_called_once_with(
+            cluster.AG_NAME)
+
+        _time.return_value = 1300
+        health['test-node-2']['synchronization_health'] = 'NOT_HEALTHY'
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(db_client.get_replication_health.call_count, 2)
+        self.assertEqual(self.harness.charm.unit.status.name, 'waiting')
+        self.assertEqual(self.harness.charm.unit.status.message,
+                         'Replicas not healthy: test-node-2')
+
+        health['test-node-2']['synchronization_health'] = 'HEALTHY'
+        self.assertEqual(cluster.replication_status(health),
+                         cluster.UNIT_ACTIVE_STATUS)
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    def test_publish_logins_manifest(self, _mssql_db_client):
+        logins = dict(self.TEST_PRIMARY_LOGINS)
+        logins.update({
+            'sa': {'sid': '01', 'password_hash': 'sa-hash',
+                   'roles': ['sysadmin']},
+            '##MS_PolicyEventProcessingLogin##': {
+                'sid': '02', 'password_hash': 'hash', 'roles': []},
+        })
+        _mssql_db_client.return_value.get_sql_logins.return_value = logins
+        self.harness.disable_hooks()
+        self.harness.begin()
+        cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        rel_id = self.harness.add_relation('cluster', 'mssql')
+        cluster.publish_logins_manifest()
+
+        rel_data = self.harness.get_relation_data(rel_id, 'mssql/0')
+        manifest = json.loads(zlib.decompress(
+            b64decode(rel_data['logins_manifest'])))
+        self.assertEqual(manifest, self.TEST_PRIMARY_LOGINS)
+        self.assertIsNotNone(rel_data.get('logins_version'))
+
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'mssql_db_client')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
@@ -375,47 +722,56 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
     def test_sync_logins_from_primary_replica(self, _ag_primary_replica,
                                               _mssql_db_client):
         _ag_primary_replica.return_value = self.TEST_PRIMARY_REPLICA_NAME
-        mocked_primary_db_client = mock.MagicMock()
-        mocked_primary_db_client.get_sql_logins.return_value = \
-            self.TEST_PRIMARY_LOGINS
-        mocked_this_db_client = mock.MagicMock()
-        mocked_this_db_client.get_sql_logins.return_value = \
-            self.TEST_SECONDARY_LOGINS
-        _mssql_db_client.side_effect = [
-            mocked_primary_db_client, mocked_this_db_client]
+        mocked_this_db_client = _mssql_db_client.return_value
         self.harness.disable_hooks()
         self.harness.begin()
         cluster = interface_mssql_cluster.MssqlCluster(
             self.harness.charm, 'cluster')
+        digests = {
+            name: cluster.login_digest(login_info)
+            for name, login_info in self.TEST_PRIMARY_LOGINS.items()
+        }
+        cluster.state.applied_logins = {
+            'test-login-1': digests['test-login-1'],
+            'test-login-2': digests['test-login-2'],
+            'test-login-5': 'test-login-5-digest',
+        }
+        rel_id = self.harness.add_relation('cluster', 'mssql')
+        self.harness.add_relation_unit(rel_id, 'mssql/1')
+        manifest = json.dumps(self.TEST_PRIMARY_LOGINS).encode()
+        self.harness.update_relation_data(rel_id, 'mssql/1', {
+            'node_name': self.TEST_PRIMARY_REPLICA_NAME,
+            'logins_manifest': b64encode(zlib.compress(manifest)).decode(),
+            'logins_version': 'test-version',
+        })
         cluster.sync_logins_from_primary_replica()
 
-        _mssql_db_client.assert_has_calls([
-            mock.call(self.TEST_PRIMARY_REPLICA_NAME),
-            mock.call()
-        ])
-        mocked_this_db_client.assert_has_calls([
-            mock.call.get_sql_logins()
-        ])
-        mocked_this_db_client.assert_has_calls([
-            mock.call.get_sql_logins(),
-            mock.call.create_login(name='test-login-3',
-                                   sid='sid3',
-                                   password='test-password-hash3',
-                                   is_hashed_password=True,
-                                   server_roles=['test-role3']),
-            mock.call.create_login(name='test-login-4',
-                                   sid='sid4',
-                                   password='test-password-hash4',
-                                   is_hashed_password=True,
-                                   server_roles=['test-role4'])
-        ])
+        # Only the local SQL Server is used.
+        _mssql_db_client.assert_called_once_with()
+        mocked_this_db_client.apply_logins.assert_called_once_with(
+            {
+                'test-login-3': self.TEST_PRIMARY_LOGINS['test-login-3'],
+                'test-login-4': self.TEST_PRIMARY_LOGINS['test-login-4'],
+            },
+            ['test-login-5'])
+        self.assertEqual(dict(cluster.state.applied_logins), digests)
+        self.assertEqual(cluster.state.applied_logins_version,
+                         'test-version')
+
+        # Nothing is done when the manifest version was already applied.
+        _mssql_db_client.reset_mock()
+        cluster.sync_logins_from_primary_replica()
+        _mssql_db_client.assert_not_called()
 
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'publish_logins_manifest')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'mssql_db_client')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'ready_nodes',
                        new_callable=mock.PropertyMock)
-    def test_create_ag(self, _ready_nodes, _mssql_db_client):
+    def test_create_ag(self, _ready_nodes, _mssql_db_client,
+                       _publish_logins_manifest):
         _ready_nodes.return_value = ['node1', 'node2', 'node3']
         self.harness.set_leader()
         self.harness.disable_hooks()
@@ -431,12 +787,18 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
                          cluster.UNIT_ACTIVE_STATUS)
         _mssql_db_client.assert_called_once_with()
         _mssql_db_client.return_value.create_ag.assert_called_once_with(
-            cluster.AG_NAME, ['node1', 'node2', 'node3'])
+            cluster.AG_NAME, ['node1', 'node2', 'node3'], {
+                self.TEST_NODE_NAME: 'SYNCHRONOUS_COMMIT',
+                'node1': 'SYNCHRONOUS_COMMIT',
+                'node2': 'SYNCHRONOUS_COMMIT',
+                'node3': 'SYNCHRONOUS_COMMIT',
+            }, 'AUTOMATIC')
         unit_rel_data = self.harness.get_relation_data(rel_id, 'mssql/0')
         self.assertEqual(unit_rel_data.get('clustered'), 'true')
         self.assertIsNotNone(unit_rel_data.get('nonce'))
         app_rel_data = self.harness.get_relation_data(rel_id, 'mssql')
         self.assertEqual(app_rel_data.get('ag_ready'), 'true')
+        _publish_logins_manifest.assert_called_once_with()
 
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'mssql_db_client')
@@ -459,8 +821,8 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
         self.assertEqual(unit_rel_data.get('clustered'), 'true')
 
     @mock.patch.object(interface_mssql_cluster,
-                       'append_hosts_entry')
-    def test_add_to_initialized_nodes(self, _append_hosts_entry):
+                       'HostsManager')
+    def test_add_to_initialized_nodes(self, _hosts_manager):
         self.harness.disable_hooks()
         self.harness.begin()
         cluster = interface_mssql_cluster.MssqlCluster(
@@ -628,8 +990,8 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
             self, _is_ag_ready, _mssql_db_client):
 
         _is_ag_ready.return_value = True
-        _mssql_db_client.return_value.get_ag_primary_replica.return_value = \
-            self.TEST_PRIMARY_REPLICA_NAME
+        _mssql_db_client.return_value.get_ag_topology.return_value = \
+            self.get_test_topology(self.TEST_PRIMARY_REPLICA_NAME)
         self.harness.disable_hooks()
         self.harness.begin()
         cluster = interface_mssql_cluster.MssqlCluster(
@@ -639,7 +1001,7 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
 
         _mssql_db_client.assert_called_once_with()
         mock_ret_value = _mssql_db_client.return_value
-        mock_ret_value.get_ag_primary_replica.assert_called_once_with(
+        mock_ret_value.get_ag_topology.assert_called_once_with(
             cluster.AG_NAME)
         self.assertEqual(primary_replica, self.TEST_PRIMARY_REPLICA_NAME)
 
@@ -663,40 +1025,90 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
 
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'mssql_db_client')
-    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
-                       'clustered_nodes',
-                       new_callable=mock.PropertyMock)
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'is_ag_ready',
                        new_callable=mock.PropertyMock)
-    def test_ag_primary_replica_other_clustered_node(
-            self, _is_ag_ready, _clustered_nodes, _mssql_db_client):
+    def test_ag_primary_replica_other_nodes(
+            self, _is_ag_ready, _mssql_db_client):
 
         _is_ag_ready.return_value = True
-        _mssql_db_client.return_value.get_ag_primary_replica.return_value = \
-            self.TEST_PRIMARY_REPLICA_NAME
-        _clustered_nodes.return_value = {
-            'node-1': {
-                'address': '10.0.0.11',
-                'clustered': True
-            },
-            'node-2': {
-                'address': '10.0.0.12',
-                'clustered': True
-            }
-        }
+        _mssql_db_client.side_effect = self.mock_nodes_db_clients({
+            'node-1': self.get_test_topology('node-1'),
+            'node-2': self.get_test_topology('node-1'),
+            'node-3': Exception('Unreachable node'),
+            'node-4': None,
+        })
         self.harness.disable_hooks()
         self.harness.begin()
         cluster = interface_mssql_cluster.MssqlCluster(
             self.harness.charm, 'cluster')
         cluster.state.ag_configured = False
+        for node in ['node-1', 'node-2', 'node-3', 'node-4',
+                     self.TEST_NODE_NAME]:
+            cluster.state.initialized_nodes[node] = {'address': node}
+        cluster.hosts = mock.MagicMock()
         primary_replica = cluster.ag_primary_replica
 
-        _mssql_db_client.assert_called_once_with('node-2')
+        cluster.hosts.flush.assert_called_once_with()
+        self.assertEqual(_mssql_db_client.call_count, 4)
+        _mssql_db_client.assert_has_calls([
+            mock.call(node,
+                      connect_timeout=cluster.TOPOLOGY_CONNECT_TIMEOUT,
+                      flush_hosts=False)
+            for node in ['node-1', 'node-2', 'node-3', 'node-4']
+        ], any_order=True)
+        self.assertEqual(primary_replica, 'node-1')
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_ag_ready',
+                       new_callable=mock.PropertyMock)
+    def test_ag_primary_replica_unreachable_nodes(
+            self, _is_ag_ready, _mssql_db_client):
+        _is_ag_ready.return_value = True
+        _mssql_db_client.side_effect = self.mock_nodes_db_clients({
+            'node-1': Exception('Unreachable node'),
+            'node-2': Exception('Unreachable node'),
+        })
+        self.harness.disable_hooks()
+        self.harness.begin()
+        cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        cluster.state.ag_configured = False
+        for node in ['node-1', 'node-2', self.TEST_NODE_NAME]:
+            cluster.state.initialized_nodes[node] = {'address': node}
+
+        with self.assertRaises(Exception):
+            cluster.ag_primary_replica
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_ag_ready',
+                       new_callable=mock.PropertyMock)
+    def test_ag_topology_memoized(self, _is_ag_ready, _mssql_db_client):
+        _is_ag_ready.return_value = True
         mock_ret_value = _mssql_db_client.return_value
-        mock_ret_value.get_ag_primary_replica.assert_called_once_with(
+        mock_ret_value.get_ag_topology.return_value = \
+            self.get_test_topology(self.TEST_NODE_NAME)
+        self.harness.disable_hooks()
+        self.harness.begin()
+        cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        cluster.state.ag_configured = True
+        rel_id = self.harness.add_relation('cluster', 'mssql')
+        self.harness.add_relation_unit(rel_id, 'mssql/1')
+
+        self.assertTrue(cluster.is_primary_replica)
+        self.assertListEqual(cluster.ag_replicas, [self.TEST_NODE_NAME])
+        mock_ret_value.get_ag_topology.assert_called_once_with(
             cluster.AG_NAME)
-        self.assertEqual(primary_replica, self.TEST_PRIMARY_REPLICA_NAME)
+
+        cluster.state.ag_configured = False
+        cluster.join_existing_ag()
+        self.assertListEqual(cluster.ag_replicas, [self.TEST_NODE_NAME])
+        self.assertEqual(mock_ret_value.get_ag_topology.call_count, 2)
 
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'ag_primary_replica',
@@ -742,8 +1154,8 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
                        new_callable=mock.PropertyMock)
     def test_ag_replicas_ag_configured(self, _is_ag_ready, _mssql_db_client):
         _is_ag_ready.return_value = True
-        _mssql_db_client.return_value.get_ag_replicas.return_value = \
-            ['node-1', 'node-2', 'node-3']
+        _mssql_db_client.return_value.get_ag_topology.return_value = \
+            self.get_test_topology('node-1', ['node-1', 'node-2', 'node-3'])
         self.harness.disable_hooks()
         self.harness.begin()
         cluster = interface_mssql_cluster.MssqlCluster(
@@ -753,7 +1165,7 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
 
         _mssql_db_client.assert_called_once_with()
         mock_ret_value = _mssql_db_client.return_value
-        mock_ret_value.get_ag_replicas.assert_called_once_with(
+        mock_ret_value.get_ag_topology.assert_called_once_with(
             cluster.AG_NAME)
         self.assertListEqual(ag_replicas, ['node-1', 'node-2', 'node-3'])
 
@@ -776,37 +1188,44 @@ class TestInterfaceMssqlCluster(unittest.TestCase):
 
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'mssql_db_client')
-    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
-                       'clustered_nodes',
-                       new_callable=mock.PropertyMock)
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'is_ag_ready',
                        new_callable=mock.PropertyMock)
-    def test_ag_replicas_other_clustered_node(
-            self, _is_ag_ready, _clustered_nodes, _mssql_db_client):
-
+    def test_ag_replicas_other_nodes(self, _is_ag_ready, _mssql_db_client):
         _is_ag_ready.return_value = True
-        _mssql_db_client.return_value.get_ag_replicas.return_value = \
-            ['node-1', 'node-2']
-        _clustered_nodes.return_value = {
-            'node-1': {
-                'address': '10.0.0.11',
-                'clustered': True
-            },
-            'node-2': {
-                'address': '10.0.0.12',
-                'clustered': True
-            }
-        }
+        _mssql_db_client.side_effect = self.mock_nodes_db_clients({
+            'node-1': self.get_test_topology('node-2', ['node-1']),
+            'node-2': self.get_test_topology('node-2', ['node-1', 'node-2']),
+        })
         self.harness.disable_hooks()
         self.harness.begin()
         cluster = interface_mssql_cluster.MssqlCluster(
             self.harness.charm, 'cluster')
         cluster.state.ag_configured = False
+        for node in ['node-1', 'node-2']:
+            cluster.state.initialized_nodes[node] = {'address': node}
         ag_replicas = cluster.ag_replicas
 
-        _mssql_db_client.assert_called_once_with('node-2')
-        mock_ret_value = _mssql_db_client.return_value
-        mock_ret_value.get_ag_replicas.assert_called_once_with(
-            cluster.AG_NAME)
         self.assertListEqual(ag_replicas, ['node-1', 'node-2'])
+
+    def get_test_topology(self, primary_replica, replicas=None):
+        return {
+            'primary_replica': primary_replica,
+            'replicas': replicas or [primary_replica],
+            'replica_states': {},
+        }
+
+    def mock_nodes_db_clients(self, nodes_topologies):
+        def _mssql_db_client(node=None, connect_timeout=None,
+                             flush_hosts=True):
+            # The DB clients must be built by the main thread, since they
+            # read the SA password from the charm model.
+            self.assertIs(threading.current_thread(), threading.main_thread())
+            db_client = mock.MagicMock()
+            topology = nodes_topologies[node]
+            if isinstance(topology, Exception):
+                db_client.get_ag_topology.side_effect = topology
+            else:
+                db_client.get_ag_topology.return_value = topology
+            return db_client
+        return _mssql_db_client
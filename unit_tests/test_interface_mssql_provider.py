@@ -4,10 +4,14 @@ from unittest import mock
 
 from ops.testing import Harness
 from ops.charm import CharmBase
+from ops.model import ActiveStatus, BlockedStatus
 
 import interface_hacluster
 import interface_mssql_provider
 import interface_mssql_cluster
+import mssql_db_client
+
+from unit_tests import fake_mssql
 
 
 class TestInterfaceMssqlDBProvider(unittest.TestCase):
@@ -31,8 +35,32 @@ class TestInterfaceMssqlDBProvider(unittest.TestCase):
         self.harness.update_config({'vip': self.TEST_VIP_ADDRESS})
         self.addCleanup(self.harness.cleanup)
 
+    def setup_fake_mssql(self):
+        """Sets up a fake SQL Server, acting as the AG primary replica.
+
+        :returns: the fake server, and a DB client connected to it.
+        """
+        backend = fake_mssql.FakeMSSQLBackend()
+        server = backend.add_server('10.0.0.10', 'node-1', 'test-sa-pass')
+        patcher = backend.patch()
+        patcher.__enter__()
+        self.addCleanup(patcher.__exit__, None, None, None)
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-sa-pass', host='10.0.0.10')
+        db_client.create_master_encryption_key('test-key-password')
+        db_client.exec_t_sql(mssql_db_client.statements.SETUP_MASTER_CERT, {
+            'cert_file': 'test.cer',
+            'cert_key_file': 'test.pvk',
+            'password': 'test-cert-password',
+        })
+        db_client.setup_db_mirroring_endpoint()
+        db_client.create_ag(interface_mssql_cluster.MssqlCluster.AG_NAME,
+                            {'node-1': {'address': '10.0.0.10'}})
+        backend.reset_counters()
+        return server, db_client
+
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
-                       'set_unit_rel_nonce')
+                       'publish_logins_manifest')
     @mock.patch.object(interface_mssql_cluster.MssqlCluster,
                        'mssql_db_client')
     @mock.patch('charmhelpers.core.host.pwgen')
@@ -47,7 +75,7 @@ class TestInterfaceMssqlDBProvider(unittest.TestCase):
                        new_callable=mock.PropertyMock)
     def test_on_changed(self, _is_ag_ready, _is_ha_cluster_ready,
                         _is_primary_replica, _pwgen, _mssql_db_client,
-                        _set_unit_rel_nonce):
+                        _publish_logins_manifest):
         _is_ag_ready.return_value = True
         _is_ha_cluster_ready.return_value = True
         _is_primary_replica.return_value = True
@@ -69,20 +97,25 @@ class TestInterfaceMssqlDBProvider(unittest.TestCase):
                 'database': 'testdb',
                 'username': 'testuser'
             })
+        self.harness.framework.commit()
 
         _pwgen.assert_called_once_with(32)
         _mssql_db_client.assert_called_once_with()
         db_client_mock = _mssql_db_client.return_value
-        db_client_mock.create_database.assert_called_once_with(
+        db_client_mock.batch.assert_called_once_with()
+        batch_mock = db_client_mock.batch.return_value.__enter__.return_value
+        batch_mock.create_database.assert_called_once_with(
             db_name='testdb',
-            ag_name=self.harness.charm.cluster.AG_NAME)
-        db_client_mock.create_login.assert_called_once_with(
+            ag_name=self.harness.charm.cluster.AG_NAME,
+            manual_seeding_dir=None,
+            contained=False)
+        batch_mock.create_login.assert_called_once_with(
             name='testuser',
             password='test-password')
-        db_client_mock.grant_access.assert_called_once_with(
+        batch_mock.grant_access.assert_called_once_with(
             db_name='testdb',
             db_user_name='testuser')
-        _set_unit_rel_nonce.assert_called_once_with()
+        _publish_logins_manifest.assert_called_once_with()
 
         rel_unit_data = self.harness.get_relation_data(rel_id, 'mssql/0')
         self.assertEqual(rel_unit_data.get('db_host'),
@@ -92,3 +125,545 @@ class TestInterfaceMssqlDBProvider(unittest.TestCase):
         self.assertEqual(rel_app_data.get('db_host'),
                          self.harness.charm.ha.bind_address)
         self.assertEqual(rel_app_data.get('password'), 'test-password')
+
+        # Already provisioned requests are answered from the registry.
+        self.harness.update_relation_data(
+            rel_id, 'mssqlconsumer/0', {'private-address': '10.0.0.20'})
+        self.harness.framework.commit()
+        _pwgen.assert_called_once_with(32)
+        _mssql_db_client.assert_called_once_with()
+        _publish_logins_manifest.assert_called_once_with()
+
+        _pwgen.return_value = 'test-password-2'
+        self.harness.update_relation_data(
+            rel_id, 'mssqlconsumer/0', {'username': 'testuser2'})
+        self.harness.framework.commit()
+        self.assertEqual(_mssql_db_client.call_count, 2)
+        batch_mock.create_login.assert_called_with(
+            name='testuser2',
+            password='test-password-2')
+        rel_unit_data = self.harness.get_relation_data(rel_id, 'mssql/0')
+        self.assertEqual(rel_unit_data.get('password'), 'test-password-2')
+        self.assertEqual(self.harness.charm.db_provider.state.provisioned, {
+            '{}/testdb/testuser'.format(rel_id): 'test-password',
+            '{}/testdb/testuser2'.format(rel_id): 'test-password-2',
+        })
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'publish_logins_manifest')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch('charmhelpers.core.host.pwgen')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_primary_replica',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_hacluster.HaCluster,
+                       'is_ha_cluster_ready',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_ag_ready',
+                       new_callable=mock.PropertyMock)
+    def test_on_changed_contained_databases(self, _is_ag_ready,
+                                            _is_ha_cluster_ready,
+                                            _is_primary_replica, _pwgen,
+                                            _mssql_db_client,
+                                            _publish_logins_manifest):
+        _is_ag_ready.return_value = True
+        _is_ha_cluster_ready.return_value = True
+        _is_primary_replica.return_value = True
+        _pwgen.return_value = 'test-password'
+        db_client_mock = _mssql_db_client.return_value
+        db_client_mock.get_non_contained_databases.return_value = []
+        self.harness.update_config({'contained-databases': True})
+        self.harness.set_leader()
+        self.harness.begin()
+        self.harness.charm.cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        self.harness.charm.ha = interface_hacluster.HaCluster(
+            self.harness.charm, 'ha')
+        self.harness.charm.db_provider = \
+            interface_mssql_provider.MssqlDBProvider(self.harness.charm, 'db')
+        rel_id = self.harness.add_relation('db', 'mssqlconsumer')
+        self.harness.add_relation_unit(rel_id, 'mssqlconsumer/0')
+        self.harness.update_relation_data(
+            rel_id, 'mssqlconsumer/0',
+            {'database': 'testdb', 'username': 'testuser'})
+        self.harness.framework.commit()
+
+        db_client_mock.get_non_contained_databases.assert_called_once_with(
+            {'testdb'})
+        batch_mock = db_client_mock.batch.return_value.__enter__.return_value
+        batch_mock.create_database.assert_called_once_with(
+            db_name='testdb',
+            ag_name=self.harness.charm.cluster.AG_NAME,
+            manual_seeding_dir=None,
+            contained=True)
+        batch_mock.create_contained_user.assert_called_once_with(
+            db_name='testdb',
+            db_user_name='testuser',
+            password='test-password')
+        batch_mock.create_login.assert_not_called()
+        batch_mock.grant_access.assert_not_called()
+        _publish_logins_manifest.assert_not_called()
+        rel_unit_data = self.harness.get_relation_data(rel_id, 'mssql/0')
+        self.assertEqual(rel_unit_data.get('password'), 'test-password')
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'publish_logins_manifest')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch('charmhelpers.core.host.pwgen')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_primary_replica',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_hacluster.HaCluster,
+                       'is_ha_cluster_ready',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_ag_ready',
+                       new_callable=mock.PropertyMock)
+    def test_process_pending_requests(self, _is_ag_ready,
+                                      _is_ha_cluster_ready,
+                                      _is_primary_replica, _pwgen,
+                                      _mssql_db_client,
+                                      _publish_logins_manifest):
+        _is_ag_ready.return_value = True
+        _is_ha_cluster_ready.return_value = False
+        _is_primary_replica.return_value = True
+        _pwgen.return_value = 'test-password'
+        self.harness.set_leader()
+        self.harness.begin()
+        self.harness.charm.cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        self.harness.charm.ha = interface_hacluster.HaCluster(
+            self.harness.charm, 'ha')
+        db_provider = interface_mssql_provider.MssqlDBProvider(
+            self.harness.charm, 'db')
+        rel_ids = []
+        for i in range(3):
+            rel_id = self.harness.add_relation('db', 'consumer{}'.format(i))
+            self.harness.add_relation_unit(rel_id, 'consumer{}/0'.format(i))
+            self.harness.update_relation_data(
+                rel_id, 'consumer{}/0'.format(i), {
+                    'database': 'testdb{}'.format(i),
+                    'username': 'testuser{}'.format(i),
+                })
+            self.harness.framework.commit()
+            rel_ids.append(rel_id)
+
+        _mssql_db_client.assert_not_called()
+        self.assertEqual(len(db_provider.state.pending), 3)
+
+        _is_ha_cluster_ready.return_value = True
+        self.harness.update_config({})
+        self.harness.framework.commit()
+
+        _mssql_db_client.assert_called_once_with()
+        db_client_mock = _mssql_db_client.return_value
+        db_client_mock.batch.assert_called_once_with()
+        batch_mock = db_client_mock.batch.return_value.__enter__.return_value
+        self.assertEqual(batch_mock.create_database.call_count, 3)
+        self.assertEqual(batch_mock.create_login.call_count, 3)
+        self.assertEqual(batch_mock.grant_access.call_count, 3)
+        _publish_logins_manifest.assert_called_once_with()
+        self.assertEqual(db_provider.state.pending, {})
+        for rel_id in rel_ids:
+            rel_data = self.harness.get_relation_data(rel_id, 'mssql/0')
+            self.assertEqual(rel_data.get('password'), 'test-password')
+
+        self.harness.update_config({})
+        self.harness.framework.commit()
+        _mssql_db_client.assert_called_once_with()
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'publish_logins_manifest')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_primary_replica',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_hacluster.HaCluster,
+                       'is_ha_cluster_ready',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_ag_ready',
+                       new_callable=mock.PropertyMock)
+    def test_process_pending_requests_batch(self, _is_ag_ready,
+                                            _is_ha_cluster_ready,
+                                            _is_primary_replica,
+                                            _mssql_db_client,
+                                            _publish_logins_manifest):
+        server, db_client = self.setup_fake_mssql()
+        _mssql_db_client.return_value = db_client
+        _is_ag_ready.return_value = True
+        _is_ha_cluster_ready.return_value = False
+        _is_primary_replica.return_value = True
+        self.harness.begin()
+        self.harness.charm.cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        self.harness.charm.ha = interface_hacluster.HaCluster(
+            self.harness.charm, 'ha')
+        db_provider = interface_mssql_provider.MssqlDBProvider(
+            self.harness.charm, 'db')
+        for i in range(3):
+            rel_id = self.harness.add_relation('db', 'consumer{}'.format(i))
+            self.harness.add_relation_unit(rel_id, 'consumer{}/0'.format(i))
+            self.harness.update_relation_data(
+                rel_id, 'consumer{}/0'.format(i), {
+                    'database': 'testdb{}'.format(i),
+                    'username': 'testuser{}'.format(i),
+                })
+            self.harness.framework.commit()
+
+        _is_ha_cluster_ready.return_value = True
+        self.harness.update_config({})
+        self.harness.framework.commit()
+
+        self.assertEqual(server.backend.round_trips, 1)
+        self.assertEqual(db_provider.state.pending, {})
+        self.assertEqual(len(db_provider.state.provisioned), 3)
+        for i in range(3):
+            database = server.databases['testdb{}'.format(i)]
+            self.assertEqual(database['ag_name'],
+                             interface_mssql_cluster.MssqlCluster.AG_NAME)
+            self.assertEqual(database['users'], {
+                'testuser{}'.format(i): 'testuser{}'.format(i),
+            })
+            self.assertIn('testuser{}'.format(i), server.logins)
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'publish_logins_manifest')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_primary_replica',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_hacluster.HaCluster,
+                       'is_ha_cluster_ready',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_ag_ready',
+                       new_callable=mock.PropertyMock)
+    def test_process_pending_requests_non_contained_database(
+            self, _is_ag_ready, _is_ha_cluster_ready, _is_primary_replica,
+            _mssql_db_client, _publish_logins_manifest):
+        server, db_client = self.setup_fake_mssql()
+        db_client.set_contained_database_authentication(True)
+        # Database created before the contained-databases option was set.
+        db_client.create_database('legacydb')
+        _mssql_db_client.return_value = db_client
+        _is_ag_ready.return_value = True
+        _is_ha_cluster_ready.return_value = False
+        _is_primary_replica.return_value = True
+        self.harness.update_config({'contained-databases': True})
+        self.harness.begin()
+        self.harness.charm.cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        self.harness.charm.ha = interface_hacluster.HaCluster(
+            self.harness.charm, 'ha')
+        db_provider = interface_mssql_provider.MssqlDBProvider(
+            self.harness.charm, 'db')
+        for db_name in ['legacydb', 'newdb']:
+            rel_id = self.harness.add_relation('db', db_name)
+            self.harness.add_relation_unit(rel_id, '{}/0'.format(db_name))
+            self.harness.update_relation_data(
+                rel_id, '{}/0'.format(db_name), {
+                    'database': db_name,
+                    'username': '{}user'.format(db_name),
+                })
+            self.harness.framework.commit()
+
+        _is_ha_cluster_ready.return_value = True
+        self.harness.update_config({})
+        self.harness.framework.commit()
+
+        self.assertEqual(len(db_provider.state.provisioned), 2)
+        self.assertFalse(server.databases['legacydb']['contained'])
+        self.assertEqual(server.databases['legacydb']['users'], {
+            'legacydbuser': 'legacydbuser',
+        })
+        self.assertIn('legacydbuser', server.logins)
+        self.assertTrue(server.databases['newdb']['contained'])
+        self.assertIn('newdbuser', server.databases['newdb']['users'])
+        self.assertNotIn('newdbuser', server.logins)
+        _publish_logins_manifest.assert_called_once_with()
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'set_unit_active_status')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'publish_logins_manifest')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_primary_replica',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_hacluster.HaCluster,
+                       'is_ha_cluster_ready',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_ag_ready',
+                       new_callable=mock.PropertyMock)
+    def test_process_pending_requests_failed(self, _is_ag_ready,
+                                             _is_ha_cluster_ready,
+                                             _is_primary_replica,
+                                             _mssql_db_client,
+                                             _publish_logins_manifest,
+                                             _set_unit_active_status):
+        server, db_client = self.setup_fake_mssql()
+        _mssql_db_client.return_value = db_client
+        _is_ag_ready.return_value = True
+        _is_ha_cluster_ready.return_value = False
+        _is_primary_replica.return_value = True
+        self.harness.begin()
+        self.harness.charm.cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        self.harness.charm.ha = interface_hacluster.HaCluster(
+            self.harness.charm, 'ha')
+        db_provider = interface_mssql_provider.MssqlDBProvider(
+            self.harness.charm, 'db')
+        bad_db_name = 'x' * 129
+        rel_ids = {}
+        for db_name in ['testdb0', bad_db_name, 'testdb1']:
+            rel_id = self.harness.add_relation('db', 'consumer')
+            self.harness.add_relation_unit(rel_id, 'consumer/0')
+            self.harness.update_relation_data(rel_id, 'consumer/0', {
+                'database': db_name,
+                'username': 'testuser{}'.format(rel_id),
+            })
+            self.harness.framework.commit()
+            rel_ids[db_name] = rel_id
+        bad_request_key = '{}/{}/testuser{}'.format(
+            rel_ids[bad_db_name], bad_db_name, rel_ids[bad_db_name])
+
+        # The queue is not processed by the actions or update-status.
+        _is_ha_cluster_ready.return_value = True
+        self.harness.charm.on.update_status.emit()
+        self.harness.framework.commit()
+        self.assertEqual(len(db_provider.state.pending), 3)
+
+        # The bad request doesn't block the other ones.
+        self.harness.update_config({})
+        self.harness.framework.commit()
+        self.assertIn('testdb0', server.databases)
+        self.assertIn('testdb1', server.databases)
+        self.assertEqual(len(db_provider.state.provisioned), 2)
+        self.assertEqual(list(db_provider.state.pending), [bad_request_key])
+        self.assertEqual(db_provider.state.failed_requests,
+                         [bad_request_key])
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            BlockedStatus('Failed to provision 1 db request(s). See the '
+                          'unit logs.'))
+        self.harness.charm.unit.status = ActiveStatus()
+        self.harness.charm.on.update_status.emit()
+        self.assertIsInstance(self.harness.charm.unit.status, BlockedStatus)
+
+        # The failed request stays queued until its relation departs.
+        self.harness.update_config({})
+        self.harness.framework.commit()
+        self.assertEqual(list(db_provider.state.pending), [bad_request_key])
+        _set_unit_active_status.assert_not_called()
+        rel = self.harness.model.get_relation('db', rel_ids[bad_db_name])
+        self.harness.charm.on['db'].relation_departed.emit(
+            rel, self.harness.model.get_app('consumer'),
+            self.harness.model.get_unit('consumer/0'))
+        self.harness.framework.commit()
+        self.assertEqual(db_provider.state.pending, {})
+        self.assertEqual(db_provider.state.failed_requests, [])
+        _set_unit_active_status.assert_called_once_with()
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'publish_logins_manifest')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch('charmhelpers.core.host.pwgen')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_primary_replica',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_hacluster.HaCluster,
+                       'is_ha_cluster_ready',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_ag_ready',
+                       new_callable=mock.PropertyMock)
+    def test_process_pending_requests_failover(self, _is_ag_ready,
+                                               _is_ha_cluster_ready,
+                                               _is_primary_replica, _pwgen,
+                                               _mssql_db_client,
+                                               _publish_logins_manifest):
+        _is_ag_ready.return_value = True
+        _is_ha_cluster_ready.return_value = True
+        _is_primary_replica.return_value = True
+        _pwgen.return_value = 'test-password'
+        self.harness.begin()
+        self.harness.charm.cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        self.harness.charm.ha = interface_hacluster.HaCluster(
+            self.harness.charm, 'ha')
+        db_provider = interface_mssql_provider.MssqlDBProvider(
+            self.harness.charm, 'db')
+        rel_id = self.harness.add_relation('db', 'mssqlconsumer')
+        self.harness.add_relation_unit(rel_id, 'mssqlconsumer/0')
+        self.harness.update_relation_data(
+            rel_id, 'mssqlconsumer/0', {
+                'database': 'testdb',
+                'username': 'testuser',
+            })
+        self.harness.framework.commit()
+        self.assertEqual(db_provider.state.provisioned, {
+            '{}/testdb/testuser'.format(rel_id): 'test-password',
+        })
+
+        # Another unit becomes the primary replica, and it provisions the
+        # request again.
+        _is_primary_replica.return_value = False
+        self.harness.update_relation_data(
+            rel_id, 'mssqlconsumer/0', {'private-address': '10.0.0.20'})
+        self.harness.framework.commit()
+        self.assertEqual(db_provider.state.provisioned, {})
+        _pwgen.assert_called_once_with(32)
+
+        # The unit is the primary replica again. The request is provisioned
+        # with a new password, instead of advertising the stale one.
+        _is_primary_replica.return_value = True
+        _pwgen.return_value = 'test-password-2'
+        self.harness.update_relation_data(
+            rel_id, 'mssqlconsumer/0', {'private-address': '10.0.0.21'})
+        self.harness.framework.commit()
+        self.assertEqual(_pwgen.call_count, 2)
+        db_client_mock = _mssql_db_client.return_value
+        batch_mock = db_client_mock.batch.return_value.__enter__.return_value
+        batch_mock.create_login.assert_called_with(
+            name='testuser',
+            password='test-password-2')
+        rel_unit_data = self.harness.get_relation_data(rel_id, 'mssql/0')
+        self.assertEqual(rel_unit_data.get('password'), 'test-password-2')
+        self.assertEqual(db_provider.state.provisioned, {
+            '{}/testdb/testuser'.format(rel_id): 'test-password-2',
+        })
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'publish_logins_manifest')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'mssql_db_client')
+    @mock.patch('charmhelpers.core.host.pwgen')
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_primary_replica',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_hacluster.HaCluster,
+                       'is_ha_cluster_ready',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_ag_ready',
+                       new_callable=mock.PropertyMock)
+    def test_resource_limits(self, _is_ag_ready, _is_ha_cluster_ready,
+                             _is_primary_replica, _pwgen, _mssql_db_client,
+                             _publish_logins_manifest):
+        _is_ag_ready.return_value = True
+        _is_ha_cluster_ready.return_value = True
+        _is_primary_replica.return_value = True
+        _pwgen.return_value = 'test-password'
+        self.harness.set_leader()
+        self.harness.begin()
+        self.harness.charm.cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        self.harness.charm.ha = interface_hacluster.HaCluster(
+            self.harness.charm, 'ha')
+        self.harness.charm.db_provider = \
+            interface_mssql_provider.MssqlDBProvider(self.harness.charm, 'db')
+        db_client_mock = _mssql_db_client.return_value
+        db_client_mock.configure_resource_governor.side_effect = Exception(
+            'Resource Governor failed')
+        batch_mock = db_client_mock.batch.return_value.__enter__.return_value
+        rel_id = self.harness.add_relation('db', 'mssqlconsumer')
+        self.harness.add_relation_unit(rel_id, 'mssqlconsumer/0')
+        self.harness.update_relation_data(
+            rel_id, 'mssqlconsumer/0', {
+                'database': 'testdb',
+                'username': 'testuser',
+                'max_cpu_percent': '20',
+                'max_memory_percent': '200',
+            })
+        self.harness.framework.commit()
+
+        # The Resource Governor failure doesn't block the request.
+        db_client_mock.configure_resource_governor.assert_called_once_with(
+            {'testuser': {'max_cpu_percent': 20}})
+        batch_mock.create_login.assert_called_once_with(
+            name='testuser', password='test-password')
+        self.assertEqual(
+            self.harness.charm.db_provider.state.applied_resource_limits,
+            '{}')
+
+        # The limits are applied again by the next hook.
+        db_client_mock.configure_resource_governor.side_effect = None
+        self.harness.update_config({})
+        self.harness.framework.commit()
+        self.assertEqual(
+            db_client_mock.configure_resource_governor.call_count, 2)
+
+        # Only the changed limits are applied, without provisioning again.
+        self.harness.update_config({})
+        self.harness.framework.commit()
+        self.harness.update_relation_data(
+            rel_id, 'mssqlconsumer/0', {'max_cpu_percent': ''})
+        self.harness.framework.commit()
+        db_client_mock.configure_resource_governor.assert_called_with({})
+        self.assertEqual(
+            db_client_mock.configure_resource_governor.call_count, 3)
+        batch_mock.create_login.assert_called_once()
+        _publish_logins_manifest.assert_called_once_with()
+
+        # The secondary replicas apply the limits on their own SQL Server.
+        _is_primary_replica.return_value = False
+        self.harness.update_relation_data(
+            rel_id, 'mssqlconsumer/0', {'max_iops_per_volume': '100'})
+        self.harness.framework.commit()
+        db_client_mock.configure_resource_governor.assert_called_with(
+            {'testuser': {'max_iops_per_volume': 100}})
+        self.assertEqual(
+            db_client_mock.configure_resource_governor.call_count, 4)
+
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_primary_replica',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_hacluster.HaCluster,
+                       'is_ha_cluster_ready',
+                       new_callable=mock.PropertyMock)
+    @mock.patch.object(interface_mssql_cluster.MssqlCluster,
+                       'is_ag_ready',
+                       new_callable=mock.PropertyMock)
+    def test_on_config_changed_read_only_endpoint(
+            self, _is_ag_ready, _is_ha_cluster_ready, _is_primary_replica):
+        _is_ag_ready.return_value = True
+        _is_ha_cluster_ready.return_value = True
+        _is_primary_replica.return_value = True
+        self.harness.set_leader()
+        self.harness.begin()
+        self.harness.charm.cluster = interface_mssql_cluster.MssqlCluster(
+            self.harness.charm, 'cluster')
+        self.harness.charm.ha = interface_hacluster.HaCluster(
+            self.harness.charm, 'ha')
+        self.harness.charm.db_provider = \
+            interface_mssql_provider.MssqlDBProvider(self.harness.charm, 'db')
+        rel_id = self.harness.add_relation('db', 'mssqlconsumer')
+        self.harness.add_relation_unit(rel_id, 'mssqlconsumer/0')
+        self.harness.update_relation_data(
+            rel_id, 'mssql/0', {'db_host': self.TEST_VIP_ADDRESS})
+
+        self.harness.update_config(
+            {'readable-secondaries': 'read-intent-only'})
+
+        for entity in ['mssql', 'mssql/0']:
+            rel_data = self.harness.get_relation_data(rel_id, entity)
+            self.assertEqual(rel_data.get('ro_db_host'),
+                             self.TEST_VIP_ADDRESS)
+            self.assertEqual(rel_data.get('ro_application_intent'),
+                             'ReadOnly')
+
+        self.harness.update_config({'readable-secondaries': 'no'})
+
+        for entity in ['mssql', 'mssql/0']:
+            rel_data = self.harness.get_relation_data(rel_id, entity)
+            self.assertIsNone(rel_data.get('ro_db_host'))
+            self.assertIsNone(rel_data.get('ro_application_intent'))
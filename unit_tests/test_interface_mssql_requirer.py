@@ -31,7 +31,9 @@ class TestInterfaceMssqlDBRequirer(unittest.TestCase):
     def test_on_joined_config_rel_vars(self):
         self.harness.update_config({
             'database-name': 'test-db',
-            'database-user-name': 'test-db-user'
+            'database-user-name': 'test-db-user',
+            'database-max-cpu-percent': 20,
+            'database-max-iops-per-volume': 500,
         })
         self.harness.begin()
         self.harness.charm.db = MssqlDBRequirer(self.harness.charm, 'db')
@@ -42,6 +44,27 @@ class TestInterfaceMssqlDBRequirer(unittest.TestCase):
             rel_id, self.harness.charm.unit.name)
         self.assertEqual(rel_data.get('database'), 'test-db')
         self.assertEqual(rel_data.get('username'), 'test-db-user')
+        self.assertEqual(rel_data.get('max_cpu_percent'), '20')
+        self.assertIsNone(rel_data.get('max_memory_percent'))
+        self.assertEqual(rel_data.get('max_iops_per_volume'), '500')
+
+    def test_on_config_changed_resource_limits(self):
+        self.harness.update_config({'database-max-cpu-percent': 20})
+        self.harness.begin()
+        self.harness.charm.db = MssqlDBRequirer(self.harness.charm, 'db')
+        rel_id = self.harness.add_relation('db', 'mssql')
+        self.harness.add_relation_unit(rel_id, 'mssql/0')
+
+        self.harness.update_config({
+            'database-max-cpu-percent': None,
+            'database-max-memory-percent': 50,
+        })
+
+        rel_data = self.harness.get_relation_data(
+            rel_id, self.harness.charm.unit.name)
+        self.assertNotIn('max_cpu_percent', rel_data)
+        self.assertEqual(rel_data.get('max_memory_percent'), '50')
+        self.assertNotIn('max_iops_per_volume', rel_data)
 
     def test_on_changed(self):
         self.harness.begin()
@@ -61,6 +84,32 @@ class TestInterfaceMssqlDBRequirer(unittest.TestCase):
         self.assertEqual(rel_data.get('db_host'), '10.0.0.100')
         self.assertEqual(rel_data.get('password'), 'test-db-password')
 
+    def test_on_changed_read_only_endpoint(self):
+        self.harness.begin()
+        self.harness.charm.db = MssqlDBRequirer(self.harness.charm, 'db')
+        rel_id = self.harness.add_relation('db', 'mssql')
+        self.harness.add_relation_unit(rel_id, 'mssql/0')
+        self.harness.update_relation_data(rel_id, 'mssql/0', {
+            'db_host': '10.0.0.100',
+            'password': 'test-db-password',
+            'ro_db_host': '10.0.0.100',
+            'ro_application_intent': 'ReadOnly',
+        })
+
+        state = self.harness.charm.db.state
+        self.assertEqual(state.database_host, '10.0.0.100')
+        self.assertEqual(state.database_ro_host, '10.0.0.100')
+        self.assertEqual(state.database_ro_application_intent, 'ReadOnly')
+
+        # The read-only endpoint is removed, if the secondary replicas are
+        # no longer readable.
+        self.harness.update_relation_data(rel_id, 'mssql/0', {
+            'ro_db_host': '',
+            'ro_application_intent': '',
+        })
+        self.assertFalse(state.database_ro_host)
+        self.assertFalse(state.database_ro_application_intent)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,452 @@
+import json
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+import mssql_db_client
+import mssql_statements
+
+
+class TestMSSQLConnectionPool(unittest.TestCase):
+
+    TEST_POOL_KEY = ('10.0.0.10', 1433, 'SA')
+
+    def setUp(self):
+        self.pool = mssql_db_client.MSSQLConnectionPool()
+
+    def test_acquire_new_connection(self):
+        connect_func = mock.MagicMock()
+
+        conn = self.pool.acquire(self.TEST_POOL_KEY, connect_func)
+
+        connect_func.assert_called_once_with()
+        self.assertEqual(conn, connect_func.return_value)
+
+    def test_acquire_reuses_released_connection(self):
+        conn = mock.MagicMock()
+        connect_func = mock.MagicMock()
+        self.pool.release(self.TEST_POOL_KEY, conn)
+
+        pooled_conn = self.pool.acquire(self.TEST_POOL_KEY, connect_func)
+
+        self.assertEqual(pooled_conn, conn)
+        connect_func.assert_not_called()
+        conn.cursor.assert_not_called()
+
+    def test_acquire_discards_unhealthy_connection(self):
+        conn = mock.MagicMock()
+        conn.cursor.return_value.execute.side_effect = Exception('broken')
+        connect_func = mock.MagicMock()
+        self.pool.release(self.TEST_POOL_KEY, conn)
+        self.pool.HEALTH_CHECK_INTERVAL = 0
+
+        pooled_conn = self.pool.acquire(self.TEST_POOL_KEY, connect_func)
+
+        conn.close.assert_called_once_with()
+        connect_func.assert_called_once_with()
+        self.assertEqual(pooled_conn, connect_func.return_value)
+
+    def test_close_all(self):
+        conns = [mock.MagicMock(), mock.MagicMock()]
+        for conn in conns:
+            self.pool.release(self.TEST_POOL_KEY, conn)
+
+        self.pool.close_all()
+
+        for conn in conns:
+            conn.close.assert_called_once_with()
+        connect_func = mock.MagicMock()
+        self.pool.acquire(self.TEST_POOL_KEY, connect_func)
+        connect_func.assert_called_once_with()
+
+
+class TestMSSQLDatabaseClient(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(mssql_db_client.close_connections)
+        mocked_connect = mock.patch.object(
+            mssql_db_client, 'connect').start()
+        self.mocked_conn = mocked_connect.return_value
+        self.mocked_connect = mocked_connect
+        self.mocked_is_port_open = mock.patch.object(
+            mssql_db_client, '_is_port_open').start()
+        self.mocked_is_port_open.return_value = True
+        self.mocked_sleep = mock.patch.object(
+            mssql_db_client.time, 'sleep').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_single_login_per_server(self):
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password', host='10.0.0.10')
+        db_client.create_database(db_name='testdb')
+        db_client.grant_access(db_name='testdb', db_user_name='testuser')
+        mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password',
+            host='10.0.0.10').revoke_access(
+                db_name='testdb', db_user_name='testuser')
+
+        self.mocked_connect.assert_called_once_with(
+            server='10.0.0.10', port=1433,
+            user='SA', password='test-password', login_timeout=60)
+        self.mocked_conn.autocommit.assert_called_once_with(True)
+        self.assertEqual(self.mocked_conn.cursor.call_count, 3)
+        self.mocked_conn.close.assert_not_called()
+
+        mssql_db_client.close_connections()
+        self.mocked_conn.close.assert_called_once_with()
+
+    def test_context_manager_pins_connection(self):
+        with mssql_db_client.MSSQLDatabaseClient(
+                user='SA', password='test-password') as db_client:
+            with db_client.connection() as conn:
+                self.assertEqual(conn, self.mocked_conn)
+                with db_client.connection() as nested_conn:
+                    self.assertEqual(nested_conn, self.mocked_conn)
+
+        self.mocked_connect.assert_called_once()
+
+    def test_failed_operation_discards_connection(self):
+        self.mocked_conn.cursor.return_value.execute.side_effect = \
+            Exception('execute failed')
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        self.assertRaises(Exception, db_client.exec_t_sql, 'SELECT 1')
+
+        self.mocked_conn.close.assert_called_once_with()
+
+    def test_connection_retries_until_port_is_open(self):
+        self.mocked_is_port_open.side_effect = [False, False, True]
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        conn = db_client._connection()
+
+        self.assertEqual(conn, self.mocked_conn)
+        self.assertEqual(self.mocked_sleep.call_count, 2)
+        self.mocked_connect.assert_called_once()
+        first_delay = self.mocked_sleep.call_args_list[0][0][0]
+        second_delay = self.mocked_sleep.call_args_list[1][0][0]
+        self.assertLessEqual(first_delay, 1)
+        self.assertGreaterEqual(second_delay, 1)
+
+    def test_connection_login_failed(self):
+        self.mocked_connect.side_effect = Exception(
+            (18456, b"Login failed for user 'SA'."))
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='wrong-password')
+
+        self.assertRaises(mssql_db_client.MSSQLLoginError,
+                          db_client._connection)
+        self.mocked_connect.assert_called_once()
+        self.mocked_sleep.assert_not_called()
+
+    @mock.patch.object(mssql_db_client.MSSQLDatabaseClient,
+                       'CONNECT_MIN_RETRY_TIME', 0)
+    @mock.patch.object(mssql_db_client, '_remaining_hook_time')
+    def test_connection_deadline(self, _remaining_hook_time):
+        _remaining_hook_time.return_value = 0
+        self.mocked_is_port_open.return_value = False
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        self.assertRaises(Exception, db_client._connection)
+        self.mocked_is_port_open.assert_called_once()
+        self.mocked_sleep.assert_not_called()
+
+    @mock.patch.object(mssql_db_client, '_remaining_hook_time')
+    def test_connection_exhausted_hook_time_budget(
+            self, _remaining_hook_time):
+        _remaining_hook_time.return_value = -100
+        self.mocked_is_port_open.side_effect = [False, False, True]
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        self.assertEqual(db_client._connection(), self.mocked_conn)
+        self.assertEqual(self.mocked_sleep.call_count, 2)
+
+    def test_configure_hook_time_budget(self):
+        self.addCleanup(mssql_db_client.configure)
+        self.assertIsNone(mssql_db_client._remaining_hook_time())
+
+        mssql_db_client.configure(hook_time_budget=0)
+        self.assertIsNone(mssql_db_client._remaining_hook_time())
+
+        mssql_db_client.configure(hook_time_budget=600)
+        self.assertLessEqual(mssql_db_client._remaining_hook_time(), 600)
+
+    def test_get_sql_logins(self):
+        mocked_cursor = self.mocked_conn.cursor.return_value
+        mocked_cursor.fetchall.side_effect = [
+            [
+                ('login-1', b'\x01', b'\x0a'),
+                ('login-2', b'\x02', b'\x0b'),
+            ],
+            [
+                ('login-1', 'sysadmin'),
+                ('login-1', 'dbcreator'),
+            ]
+        ]
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        sql_logins = db_client.get_sql_logins()
+
+        self.mocked_connect.assert_called_once()
+        mocked_cursor.execute.assert_called_once()
+        mocked_cursor.nextset.assert_called_once_with()
+        self.assertDictEqual(
+            sql_logins,
+            {
+                'login-1': {
+                    'sid': '01',
+                    'password_hash': '0a',
+                    'roles': ['sysadmin', 'dbcreator']
+                },
+                'login-2': {
+                    'sid': '02',
+                    'password_hash': '0b',
+                    'roles': []
+                }
+            })
+
+    def test_create_login_parameterized(self):
+        mocked_cursor = self.mocked_conn.cursor.return_value
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        db_client.create_login(name="test]'login", password='test-pass',
+                               server_roles=['sysadmin'])
+
+        mocked_cursor.execute.assert_has_calls([
+            mock.call(mssql_statements.CREATE_OR_ALTER_LOGIN, {
+                'name': "test]'login",
+                'password': 'test-pass',
+                'is_hashed_password': False,
+                'sid': None,
+            }),
+            mock.call(mssql_statements.ADD_SERVER_ROLE_MEMBER, {
+                'role': 'sysadmin',
+                'name': "test]'login",
+            })
+        ])
+
+    def test_apply_logins(self):
+        mocked_cursor = self.mocked_conn.cursor.return_value
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        db_client.apply_logins({
+            'login-1': {
+                'sid': '01',
+                'password_hash': '0a',
+                'roles': ['sysadmin'],
+            },
+        }, dropped=['login-2'])
+
+        mocked_cursor.execute.assert_called_once()
+        t_sql, params = mocked_cursor.execute.call_args[0]
+        self.assertEqual(t_sql, mssql_statements.APPLY_LOGINS)
+        self.assertEqual(json.loads(params['logins']), [{
+            'name': 'login-1',
+            'sid': '01',
+            'password_hash': '0a',
+            'roles': ['sysadmin'],
+        }])
+        self.assertEqual(json.loads(params['dropped']), ['login-2'])
+
+    def test_add_replicas_single_round_trip(self):
+        mocked_cursor = self.mocked_conn.cursor.return_value
+        mocked_cursor.fetchall.return_value = [
+            ('node-2', None, None),
+            ('node-3', 19471, 'The listener is not reachable.'),
+        ]
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        with self.assertRaisesRegex(Exception, 'node-3'):
+            db_client.add_replicas('test-ag', {
+                'node-2': {'address': '10.0.0.11'},
+                'node-3': {'address': '10.0.0.12'},
+            }, {'node-3': 'ASYNCHRONOUS_COMMIT'})
+
+        mocked_cursor.execute.assert_called_once()
+        t_sql, params = mocked_cursor.execute.call_args[0]
+        self.assertEqual(t_sql, mssql_statements.ADD_AG_REPLICAS)
+        self.assertEqual(params['ag_name'], 'test-ag')
+        self.assertEqual(json.loads(params['replicas']), [
+            {
+                'node_name': 'node-2',
+                'node_address': '10.0.0.11',
+                'availability_mode': 'SYNCHRONOUS_COMMIT',
+            },
+            {
+                'node_name': 'node-3',
+                'node_address': '10.0.0.12',
+                'availability_mode': 'ASYNCHRONOUS_COMMIT',
+            },
+        ])
+
+    @mock.patch.object(mssql_db_client.os, 'remove')
+    @mock.patch.object(mssql_db_client.os.path, 'exists')
+    def test_create_database_in_ag(self, _exists, _remove):
+        _exists.return_value = True
+        mocked_cursor = self.mocked_conn.cursor.return_value
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        db_client.create_database('testdb', ag_name='test-ag')
+
+        self.assertEqual(mocked_cursor.execute.call_count, 2)
+        mocked_cursor.execute.assert_called_with(
+            mssql_statements.ADD_DATABASE_TO_AG,
+            {'db_name': 'testdb', 'ag_name': 'test-ag'})
+        self.assertIn("TO DISK = N''''/dev/null''''",
+                      mssql_statements.ADD_DATABASE_TO_AG)
+        _remove.assert_called_once_with(
+            '/var/opt/mssql/data/testdb.bak')
+
+    @mock.patch.object(mssql_db_client.os, 'remove')
+    @mock.patch.object(mssql_db_client.os.path, 'exists')
+    def test_create_database_in_ag_batch(self, _exists, _remove):
+        _exists.return_value = True
+        mocked_cursor = self.mocked_conn.cursor.return_value
+        mocked_cursor.execute.side_effect = Exception('Batch failed')
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        # The stale backup is kept if the batch fails.
+        with self.assertRaises(Exception):
+            with db_client.batch() as batch:
+                batch.create_database('testdb', ag_name='test-ag')
+                _remove.assert_not_called()
+        _remove.assert_not_called()
+
+        mocked_cursor.execute.side_effect = None
+        with db_client.batch() as batch:
+            batch.create_database('testdb', ag_name='test-ag')
+            _remove.assert_not_called()
+        _remove.assert_called_once_with(
+            '/var/opt/mssql/data/testdb.bak')
+
+    @mock.patch.object(mssql_db_client.os, 'remove')
+    def test_remove_stale_backup_outside_data_dir(self, _remove):
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_dir = os.path.join(tmp_dir, 'data')
+            os.mkdir(data_dir)
+            open(os.path.join(tmp_dir, 'testdb.bak'), 'w').close()
+            os.symlink(os.path.join(tmp_dir, 'testdb.bak'),
+                       os.path.join(data_dir, 'linkdb.bak'))
+            open(os.path.join(data_dir, 'testdb.bak'), 'w').close()
+            with mock.patch.object(db_client, 'MSSQL_DATA_DIR', data_dir):
+                for db_name in ['../testdb', 'linkdb', 'test\0db']:
+                    db_client._remove_stale_backup(db_name)
+                _remove.assert_not_called()
+
+                db_client._remove_stale_backup('testdb')
+                _remove.assert_called_once_with(
+                    os.path.join(os.path.realpath(data_dir), 'testdb.bak'))
+
+    def test_create_database_manual_seeding(self):
+        mocked_cursor = self.mocked_conn.cursor.return_value
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        db_client.create_database('testdb', ag_name='test-ag',
+                                  manual_seeding_dir='/srv/seeding')
+
+        self.assertEqual(mocked_cursor.execute.call_count, 2)
+        t_sql, params = mocked_cursor.execute.call_args[0]
+        self.assertEqual(t_sql,
+                         mssql_statements.ADD_DATABASE_TO_AG_MANUAL_SEEDING)
+        self.assertEqual(json.loads(params['backup_files']), [
+            '/srv/seeding/testdb_{}.bak'.format(i + 1)
+            for i in range(db_client.MANUAL_SEEDING_BACKUP_STRIPES)
+        ])
+        self.assertEqual(params['log_backup_file'], '/srv/seeding/testdb.trn')
+
+    def test_batch(self):
+        mocked_cursor = self.mocked_conn.cursor.return_value
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        with db_client.batch() as batch:
+            batch.create_database(db_name='testdb')
+            batch.create_login(name='testuser', password='test-pass')
+            batch.grant_access(db_name='testdb', db_user_name='testuser')
+
+        mocked_cursor.execute.assert_called_once()
+        t_sql, params = mocked_cursor.execute.call_args[0]
+        self.assertLess(t_sql.index('CREATE DATABASE'),
+                        t_sql.index('BEGIN TRANSACTION'))
+        self.assertLess(t_sql.index('BEGIN TRANSACTION'),
+                        t_sql.index('CREATE LOGIN'))
+        self.assertLess(t_sql.index('CREATE USER'),
+                        t_sql.index('COMMIT TRANSACTION'))
+        self.assertIn('%(s1_password)s', t_sql)
+        self.assertEqual(params['s0_db_name'], 'testdb')
+        self.assertEqual(params['s1_name'], 'testuser')
+        self.assertEqual(params['s2_db_user_name'], 'testuser')
+
+    def test_batch_not_executed_on_error(self):
+        mocked_cursor = self.mocked_conn.cursor.return_value
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        with self.assertRaises(NotImplementedError):
+            with db_client.batch() as batch:
+                batch.create_login(name='testuser', password='test-pass')
+                batch.get_ag_replicas('test-ag')
+
+        mocked_cursor.execute.assert_not_called()
+
+    def test_exec_batch_percent_escaping(self):
+        mocked_cursor = self.mocked_conn.cursor.return_value
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        db_client.exec_batch([("SELECT '100%'", None)], transaction=False)
+        mocked_cursor.execute.assert_called_with("SELECT '100%'", None)
+
+        db_client.exec_batch([
+            ("SELECT '100%'", None),
+            (mssql_statements.DROP_LOGIN, {'name': 'testuser'}),
+        ], transaction=False)
+        t_sql, params = mocked_cursor.execute.call_args[0]
+        self.assertTrue(t_sql.startswith("SELECT '100%%'\n"))
+        self.assertEqual(params, {'s1_name': 'testuser'})
+
+    def test_exec_batch_non_transactional_order(self):
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password')
+
+        self.assertRaises(
+            ValueError, db_client.exec_batch, [
+                (mssql_statements.DROP_LOGIN, {'name': 'testuser'}),
+                (mssql_statements.CREATE_DATABASE, {'db_name': 'testdb'}),
+            ])
+
+    @mock.patch.object(mssql_db_client, 'mssql_stats')
+    def test_operations_instrumented(self, _mssql_stats):
+        mocked_cursor = self.mocked_conn.cursor.return_value
+        mocked_cursor.fetchall.side_effect = [
+            [('login-1', b'\x01', b'\x0a')],
+            [],
+        ]
+        db_client = mssql_db_client.MSSQLDatabaseClient(
+            user='SA', password='test-password', host='10.0.0.10')
+
+        db_client.get_sql_logins()
+
+        _mssql_stats.record_connection.assert_called_once_with(
+            '10.0.0.10', mock.ANY, 1)
+        _mssql_stats.record_operation.assert_called_once_with(
+            'GET_SQL_LOGINS', mock.ANY)
+        _mssql_stats.record_rows.assert_has_calls([
+            mock.call('GET_SQL_LOGINS', 1),
+            mock.call('GET_SQL_LOGINS', 0),
+        ])
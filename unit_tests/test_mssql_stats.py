@@ -0,0 +1,67 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+import mssql_stats
+
+
+class TestMSSQLStats(unittest.TestCase):
+
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        mock.patch.dict(
+            os.environ, {'JUJU_CHARM_DIR': self.charm_dir}).start()
+        self.addCleanup(mock.patch.stopall)
+        self.addCleanup(mssql_stats.configure)
+        mssql_stats._hook_stats = None
+
+    def test_flush_and_summary(self):
+        mssql_stats.record_connection('10.0.0.10', 0.2, 3)
+        mssql_stats.record_operation('CREATE_DATABASE', 0.004)
+        mssql_stats.record_operation('CREATE_DATABASE', 0.3)
+        mssql_stats.record_rows('CREATE_DATABASE', 2)
+        mssql_stats.flush('db-relation-changed')
+        mssql_stats.record_operation('GET_SQL_LOGINS', 45)
+        mssql_stats.flush('update-status')
+
+        summary = mssql_stats.summary()
+
+        self.assertEqual(summary['hooks'], 2)
+        self.assertEqual(summary['connections']['count'], 1)
+        self.assertEqual(summary['connections']['retries'], 2)
+        create_db = summary['operations']['CREATE_DATABASE']
+        self.assertEqual(create_db['count'], 2)
+        self.assertEqual(create_db['rows'], 2)
+        self.assertEqual(create_db['p50_seconds'], 0.005)
+        self.assertEqual(create_db['p95_seconds'], 0.5)
+        self.assertEqual(
+            summary['operations']['GET_SQL_LOGINS']['p95_seconds'], '>30')
+
+    def test_flush_ring_buffer(self):
+        for i in range(mssql_stats.STATS_MAX_HOOKS + 5):
+            mssql_stats.record_operation('DROP_LOGIN', 0.01)
+            mssql_stats.flush('hook-{}'.format(i))
+
+        with open(mssql_stats.stats_file_path()) as f:
+            records = json.load(f)
+        self.assertEqual(len(records), mssql_stats.STATS_MAX_HOOKS)
+        self.assertEqual(records[0]['hook'], 'hook-5')
+
+    def test_flush_without_stats(self):
+        mssql_stats.flush('update-status')
+
+        self.assertFalse(os.path.exists(mssql_stats.stats_file_path()))
+
+    @mock.patch.object(mssql_stats, 'logger')
+    def test_slow_query_logged(self, _logger):
+        mssql_stats.configure(slow_query_threshold=1.0)
+
+        mssql_stats.record_operation('CREATE_AG', 0.5)
+        _logger.warning.assert_not_called()
+        mssql_stats.record_operation('CREATE_AG', 2.5)
+        _logger.warning.assert_called_once()
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+import utils
+
+
+class TestHostsManager(unittest.TestCase):
+
+    HOSTS_CONTENT = '127.0.0.1 localhost\n'
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.hosts_path = os.path.join(self.tmp_dir, 'hosts')
+        with open(self.hosts_path, 'w') as f:
+            f.write(self.HOSTS_CONTENT)
+        self.hosts = utils.HostsManager(self.hosts_path)
+
+    def read_hosts(self):
+        with open(self.hosts_path) as f:
+            return f.read()
+
+    def test_flush_coalesces_changes(self):
+        self.hosts.set_entry('10.0.0.10', ['node-1'])
+        self.hosts.set_entry('10.0.0.11', ['node-2'])
+        self.hosts.set_entry('10.0.0.12', ['node-2'])
+
+        with mock.patch.object(utils.os, 'replace',
+                               wraps=os.replace) as _replace:
+            self.assertTrue(self.hosts.flush())
+            _replace.assert_called_once()
+
+        content = self.read_hosts()
+        self.assertIn('10.0.0.10\tnode-1', content)
+        self.assertIn('10.0.0.12\tnode-2', content)
+        self.assertNotIn('10.0.0.11', content)
+        self.assertIn('localhost', content)
+
+    def test_flush_unchanged(self):
+        self.hosts.set_entry('10.0.0.10', ['node-1'])
+        self.hosts.flush()
+        mtime = os.stat(self.hosts_path).st_mtime_ns
+
+        self.hosts.set_entry('10.0.0.10', ['node-1'])
+        self.assertFalse(self.hosts.flush())
+        self.assertFalse(self.hosts.flush())
+
+        self.assertEqual(os.stat(self.hosts_path).st_mtime_ns, mtime)
+        self.assertEqual(os.listdir(self.tmp_dir), ['hosts'])
+
+    def test_remove_entry(self):
+        self.hosts.set_entry('10.0.0.10', ['node-1'])
+        self.hosts.set_entry('10.0.0.11', ['node-2'])
+        self.hosts.flush()
+
+        self.hosts.remove_entry(['node-1'])
+        self.assertTrue(self.hosts.flush())
+
+        content = self.read_hosts()
+        self.assertNotIn('node-1', content)
+        self.assertIn('10.0.0.11\tnode-2', content)
+
+    def test_unmanaged_entries_kept(self):
+        with open(self.hosts_path, 'a') as f:
+            f.write('127.0.1.1 node-1.maas node-1\n')
+
+        self.hosts.set_entry('10.0.0.10', ['node-1'])
+        self.hosts.flush()
+        self.hosts.set_entry('10.0.0.11', ['node-1'])
+        self.assertTrue(self.hosts.flush())
+
+        content = self.read_hosts()
+        self.assertIn('127.0.1.1\tnode-1.maas node-1\n', content)
+        self.assertIn('10.0.0.11\tnode-1 # juju-mssql\n', content)
+        self.assertNotIn('10.0.0.10', content)
+
+        self.hosts.remove_entry(['node-1'])
+        self.assertTrue(self.hosts.flush())
+
+        self.assertEqual(self.read_hosts(), '127.0.0.1\tlocalhost\n'
+                                            '127.0.1.1\tnode-1.maas node-1\n')